@@ -0,0 +1,63 @@
+# Divisão de audios longos (Ogg/Opus - formato das mensagens de voz do WhatsApp) em trechos transcritos em paralelo
+# O corte é feito nos limites das páginas Ogg, sem decodificar o audio: cada trecho recebe as páginas de cabeçalho
+# (OpusHead/OpusTags) seguidas de uma sequência de páginas de audio, formando um arquivo Ogg válido por si só
+import struct
+
+OGG_CAPTURE = b"OggS"
+OGG_HEADER = struct.Struct("<4sBBqIIIB")           # capture, versão, tipo, granule, serial, sequência, CRC, qtde. de segmentos
+OPUS_RATE = 48000                                   # Granule do Opus é sempre em amostras de 48 kHz
+
+
+# Lista de páginas (inicio, fim, granule). Retorna None caso o conteúdo não seja um Ogg íntegro
+def _pages(content):
+    pages = []
+    position = 0
+    size = len(content)
+    while position < size:
+        if size - position < OGG_HEADER.size:
+            return None
+        capture, _, _, granule, _, _, _, segments = OGG_HEADER.unpack_from(content, position)
+        if capture != OGG_CAPTURE:
+            return None
+        table_end = position + OGG_HEADER.size + segments
+        if table_end > size:
+            return None
+        end = table_end + sum(content[position + OGG_HEADER.size:table_end])
+        if end > size:
+            return None
+        pages.append((position, end, granule))
+        position = end
+    return pages
+
+
+# Divide o audio em trechos de até max_seconds. Conteúdo que não seja Ogg/Opus (ou mais curto que o limite) é retornado inteiro
+def split_opus(content, max_seconds):
+    if not max_seconds or not content.startswith(OGG_CAPTURE):
+        return [content]
+    pages = _pages(content)
+    if not pages:
+        return [content]
+    first_start, first_end, _ = pages[0]
+    if b"OpusHead" not in content[first_start:first_end]:
+        return [content]
+
+    # Páginas de cabeçalho (granule 0) antecedem as páginas de audio
+    audio_start = 0
+    while audio_start < len(pages) and pages[audio_start][2] == 0:
+        audio_start += 1
+    if audio_start == 0 or audio_start == len(pages):
+        return [content]
+    header = content[:pages[audio_start][0]]
+
+    limit = max_seconds * OPUS_RATE
+    segments = []
+    segment_start = pages[audio_start][0]
+    segment_granule = 0                            # Granule ao fim do trecho anterior
+    for start, end, granule in pages[audio_start:]:
+        if granule > 0 and granule - segment_granule >= limit:
+            segments.append(header + content[segment_start:end])
+            segment_start = end
+            segment_granule = granule
+    if segment_start < len(content):
+        segments.append(header + content[segment_start:])
+    return segments if len(segments) > 1 else [content]
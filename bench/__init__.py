@@ -0,0 +1 @@
+# Benchmark offline do webhook (python -m bench.run --help)
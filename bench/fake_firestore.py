@@ -0,0 +1,247 @@
+# Firestore em memória para o benchmark: implementa o subconjunto da API utilizado pelo webhook
+# (documentos, subcoleções, consultas simples, lotes, get_all, Increment/ArrayUnion, pré-condição de exclusão) e contabiliza as RPCs por tipo de operação
+import itertools
+import threading
+import time
+from collections import Counter
+
+from google.api_core.exceptions import AlreadyExists, FailedPrecondition, NotFound
+
+_ids = itertools.count()
+
+
+class FakeFirestore:
+    def __init__(self, latency=0.0):
+        self.latency = latency                      # Segundos simulados por RPC
+        self.docs = {}                              # path (tupla) => dict
+        self.update_times = {}                      # path (tupla) => versão da última gravação (update_time)
+        self.rpcs = Counter()                       # tipo de operação => quantidade
+        self.lock = threading.RLock()
+
+    def rpc(self, kind):
+        with self.lock:
+            self.rpcs[kind] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def reset_counters(self):
+        with self.lock:
+            counters = dict(self.rpcs)
+            self.rpcs.clear()
+        return counters
+
+    def collection(self, name):
+        return FakeCollection(self, (name,))
+
+    def collections(self):
+        self.rpc("list_collections")
+        with self.lock:
+            names = sorted({path[0] for path in self.docs})
+        return [FakeCollection(self, (name,)) for name in names]
+
+    def batch(self):
+        return FakeBatch(self)
+
+    def write_option(self, last_update_time):
+        return FakeWriteOption(last_update_time)
+
+    def get_all(self, refs):
+        self.rpc("batch_get")
+        return [ref.snapshot() for ref in refs]
+
+    # Aplica gravação (set/update) sem contabilizar RPC
+    def apply(self, path, data, merge):
+        with self.lock:
+            current = self.docs.get(path) if merge else None
+            self.docs[path] = _merge(dict(current or {}), data)
+            self.update_times[path] = next(_ids)
+
+
+class FakeWriteOption:
+    def __init__(self, last_update_time):
+        self.last_update_time = last_update_time
+
+
+class FakeDocument:
+    def __init__(self, db, path):
+        self.db = db
+        self.path = path
+        self.id = path[-1]
+
+    @property
+    def reference(self):
+        return self
+
+    def snapshot(self):
+        with self.db.lock:
+            data = self.db.docs.get(self.path)
+            return FakeSnapshot(self, dict(data) if data is not None else None, self.db.update_times.get(self.path))
+
+    def get(self):
+        self.db.rpc("get")
+        return self.snapshot()
+
+    def set(self, data, merge=False):
+        self.db.rpc("set")
+        self.db.apply(self.path, data, merge)
+
+    def update(self, data):
+        self.db.rpc("update")
+        self._update(data)
+
+    def _update(self, data):
+        with self.db.lock:
+            if self.path not in self.db.docs:
+                raise NotFound(f"Documento {'/'.join(self.path)} não encontrado")
+            self.db.apply(self.path, data, True)
+
+    def create(self, data):
+        self.db.rpc("create")
+        self._create(data)
+
+    def _create(self, data):
+        with self.db.lock:
+            if self.path in self.db.docs:
+                raise AlreadyExists(f"Documento {'/'.join(self.path)} já existe")
+            self.db.apply(self.path, data, False)
+
+    def delete(self, option=None):
+        self.db.rpc("delete")
+        with self.db.lock:
+            if option is not None and self.db.update_times.get(self.path) != option.last_update_time:
+                raise FailedPrecondition(f"Documento {'/'.join(self.path)} alterado após a leitura")
+            self.db.docs.pop(self.path, None)
+            self.db.update_times.pop(self.path, None)
+
+    def collection(self, name):
+        return FakeCollection(self.db, self.path + (name,))
+
+
+class FakeSnapshot:
+    def __init__(self, reference, data, update_time=None):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+        self.update_time = update_time
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+
+    def get(self, field):
+        return (self._data or {}).get(field)
+
+
+class FakeQuery:
+    def __init__(self, db, path, filters=(), order=None, limit=None, start_after=None):
+        self.db = db
+        self.path = path
+        self.filters = filters
+        self.order = order
+        self.max_docs = limit
+        self.after = start_after
+
+    def _copy(self, **changes):
+        fields = {"filters": self.filters, "order": self.order, "limit": self.max_docs, "start_after": self.after}
+        fields.update(changes)
+        return FakeQuery(self.db, self.path, **fields)
+
+    def where(self, field, op, value):
+        return self._copy(filters=self.filters + ((field, op, value),))
+
+    def order_by(self, field, direction="ASCENDING"):
+        return self._copy(order=(field, direction))
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def start_after(self, values):
+        value = next(iter(values.values())) if isinstance(values, dict) else values
+        return self._copy(start_after=getattr(value, "id", value))
+
+    def stream(self):
+        self.db.rpc("query")
+        with self.db.lock:
+            docs = [(path, dict(data), self.db.update_times.get(path)) for path, data in self.db.docs.items()
+                    if len(path) == len(self.path) + 1 and path[:-1] == self.path]
+        docs = [(path, data, update_time) for path, data, update_time in docs if all(_matches(data, *condition) for condition in self.filters)]
+        if self.order:
+            field, direction = self.order
+            key = (lambda item: item[0][-1]) if not isinstance(field, str) else (lambda item: item[1].get(field, 0))
+            docs.sort(key=key, reverse=f"{direction}".upper().startswith("DESC"))
+            if self.after is not None:
+                docs = [doc for doc in docs if doc[0][-1] > self.after]
+        if self.max_docs is not None:
+            docs = docs[:self.max_docs]
+        return iter([FakeSnapshot(FakeDocument(self.db, path), data, update_time) for path, data, update_time in docs])
+
+    def get(self):
+        return list(self.stream())
+
+
+class FakeCollection(FakeQuery):
+    def __init__(self, db, path):
+        super().__init__(db, path)
+        self.id = path[-1]
+
+    def document(self, document_id=None):
+        return FakeDocument(self.db, self.path + (document_id or f"auto{next(_ids):012d}",))
+
+
+class FakeBatch:
+    def __init__(self, db):
+        self.db = db
+        self.ops = []
+
+    def set(self, ref, data, merge=False):
+        self.ops.append(lambda: self.db.apply(ref.path, data, merge))
+
+    def update(self, ref, data):
+        self.ops.append(lambda: ref._update(data))
+
+    def create(self, ref, data):
+        self.ops.append(lambda: ref._create(data))
+
+    def delete(self, ref):
+        self.ops.append(lambda: self.db.docs.pop(ref.path, None))
+
+    def commit(self):
+        self.db.rpc("commit")
+        with self.db.lock:
+            for op in self.ops:
+                op()
+        self.ops = []
+
+
+# Mescla gravação no documento (dicionários aninhados com merge, Increment somado ao valor atual)
+def _merge(current, data):
+    for field, value in data.items():
+        if type(value).__name__ == "Increment":
+            current[field] = current.get(field, 0) + value.value
+        elif type(value).__name__ == "ArrayUnion":
+            current[field] = list(current.get(field) or []) + [item for item in value.values if item not in (current.get(field) or [])]
+        elif isinstance(value, dict) and isinstance(current.get(field), dict):
+            current[field] = _merge(dict(current[field]), value)
+        else:
+            current[field] = value
+    return current
+
+
+def _matches(data, field, op, value):
+    current = data.get(field)
+    if op == "==":
+        return current == value
+    if current is None:
+        return False
+    if op == "<":
+        return current < value
+    if op == "<=":
+        return current <= value
+    if op == ">":
+        return current > value
+    if op == ">=":
+        return current >= value
+    raise ValueError(f"Operador não suportado no Firestore em memória: {op}")
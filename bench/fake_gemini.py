@@ -0,0 +1,136 @@
+# Substitutos locais do Gemini (google.generativeai) e do Cloud Storage para o benchmark, com latência configurável
+import io
+import os
+import pathlib
+import threading
+import time
+from collections import Counter
+
+from google.api_core.exceptions import PreconditionFailed
+
+calls = Counter()                                   # Chamadas por tipo (generate_content, send_message, upload_file, upload...)
+_lock = threading.Lock()
+
+
+def _count(kind):
+    with _lock:
+        calls[kind] += 1
+
+
+def reset_counters():
+    with _lock:
+        counters = dict(calls)
+        calls.clear()
+    return counters
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeChat:
+    def __init__(self, model, history):
+        self.model = model
+        self.history = list(history or [])
+        self.last = None
+
+    def send_message(self, text, stream=False, **kwargs):
+        _count("send_message")
+        time.sleep(self.model.latency)
+        self.history.append({"role": "user", "parts": [text]})
+        self.history.append({"role": "model", "parts": [self.model.reply]})
+        self.last = FakeResponse(self.model.reply)
+        if stream:
+            return [FakeResponse(f"{paragraph}\n\n") for paragraph in self.model.reply.split("\n\n")]
+        return self.last
+
+
+class FakeModel:
+    def __init__(self, latency=0.5, reply="Olá! Recebi sua mensagem.\n\nComo posso ajudar?"):
+        self.latency = latency                      # Segundos simulados por chamada
+        self.reply = reply
+
+    def generate_content(self, contents, stream=False, **kwargs):
+        _count("generate_content")
+        time.sleep(self.latency)
+        return FakeResponse("Transcrição simulada do conteúdo recebido.")
+
+    def start_chat(self, history=None):
+        return FakeChat(self, history)
+
+
+class FakeGenAI:
+    def __init__(self, latency=0.5):
+        self.latency = latency
+
+    def configure(self, **kwargs):
+        pass
+
+    def GenerativeModel(self, **kwargs):
+        return FakeModel(self.latency)
+
+    # Mesma exigência da biblioteca (google-generativeai 0.7.2): caminho de um arquivo existente
+    def upload_file(self, path, mime_type=None):
+        path = pathlib.Path(os.fspath(path))
+        path.stat()
+        _count("upload_file")
+        time.sleep(self.latency / 2)
+        return {"mime_type": mime_type, "uri": f"files/{id(path)}"}
+
+
+class FakeBlob:
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+
+    def upload_from_string(self, content, content_type=None, if_generation_match=None):
+        _count("storage_upload")
+        time.sleep(self.bucket.latency)
+        with _lock:
+            if if_generation_match == 0 and self.name in self.bucket.files:
+                raise PreconditionFailed(f"{self.name} já existe")
+            self.bucket.files[self.name] = bytes(content)
+
+    def open(self, mode="wb", **kwargs):
+        blob = self
+
+        class Writer(io.BytesIO):
+            def close(self):
+                if not self.closed:
+                    blob.upload_from_string(self.getvalue())
+                super().close()
+
+        return Writer()
+
+    def delete(self):
+        with _lock:
+            self.bucket.files.pop(self.name, None)
+
+
+class FakeBucket:
+    def __init__(self, name, latency):
+        self.name = name
+        self.latency = latency
+        self.files = {}
+
+    def blob(self, name, chunk_size=None):
+        return FakeBlob(self, name)
+
+    def copy_blob(self, blob, destination_bucket, new_name=None, if_generation_match=None):
+        _count("storage_copy")
+        time.sleep(self.latency)
+        with _lock:
+            if if_generation_match == 0 and new_name in destination_bucket.files:
+                raise PreconditionFailed(f"{new_name} já existe")
+            destination_bucket.files[new_name] = self.files[blob.name]
+
+
+class FakeStorageClient:
+    def __init__(self, latency=0.05):
+        self.latency = latency                      # Segundos simulados por upload
+        self.buckets = {}
+
+    def bucket(self, name):
+        with _lock:
+            return self.buckets.setdefault(name, FakeBucket(name, self.latency))
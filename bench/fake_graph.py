@@ -0,0 +1,96 @@
+# Servidor HTTP local que simula os endpoints da Graph API (WhatsApp Cloud API) utilizados pelo webhook:
+# envio de mensagens (POST /{versão}/{phone_number_id}/messages), informações da mídia (GET /{versão}/{id_media})
+# e download da mídia (GET /media/{id_media}). Latência configurável e contagem de chamadas por tipo
+import hashlib
+import itertools
+import json
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from bench.payloads import media_content, media_mime_type
+
+
+class FakeGraphApi:
+    def __init__(self, latency=0.05, host="127.0.0.1", port=0):
+        self.latency = latency                      # Segundos simulados por chamada
+        self.calls = Counter()
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self.url_base = f"http://{host}:{self.server.server_address[1]}/v19.0"
+        self._thread = threading.Thread(target=self.server.serve_forever, name="fake-graph-api", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+
+    def count(self, kind):
+        with self._lock:
+            self.calls[kind] += 1
+
+    def reset_counters(self):
+        with self._lock:
+            counters = dict(self.calls)
+            self.calls.clear()
+        return counters
+
+    def _handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"           # Keep-alive (o cliente da aplicação reutiliza conexões)
+
+            def log_message(self, format, *args):
+                pass
+
+            def _reply(self, status, body, content_type="application/json"):
+                if isinstance(body, dict):
+                    body = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                data = json.loads(self.rfile.read(length) or b"{}")
+                time.sleep(api.latency)
+                if data.get("status") == "read":
+                    api.count("mark_read")
+                    self._reply(200, {"success": True})
+                    return
+                api.count(f"send_{data.get('type', 'text')}")
+                self._reply(200, {
+                    "messaging_product": "whatsapp",
+                    "contacts": [{"input": data.get("to"), "wa_id": data.get("to")}],
+                    "messages": [{"id": f"wamid.bench{next(api._ids):012d}"}]
+                })
+
+            def do_GET(self):
+                time.sleep(api.latency)
+                parts = self.path.strip("/").split("/")
+                if parts[0] == "media":
+                    api.count("media_download")
+                    self._reply(200, media_content(parts[1]), media_mime_type(parts[1]))
+                    return
+                api.count("media_info")
+                id_media = parts[-1]
+                content = media_content(id_media)
+                host, port = api.server.server_address
+                self._reply(200, {
+                    "messaging_product": "whatsapp",
+                    "url": f"http://{host}:{port}/media/{id_media}",
+                    "mime_type": media_mime_type(id_media),
+                    "sha256": hashlib.sha256(content).hexdigest(),
+                    "file_size": len(content),
+                    "id": id_media
+                })
+
+        return Handler
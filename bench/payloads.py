@@ -0,0 +1,172 @@
+# Gerador de notificações realistas da WhatsApp Cloud API para o benchmark
+# (texto, audio, imagem, botão, ACKs, atualizações de modelos, entradas em lote e notificações de outros números)
+import functools
+import hashlib
+import itertools
+import json
+import random
+import struct
+import time
+
+KINDS = ("text", "audio", "long_audio", "image", "button", "statuses", "template_status", "template_quality", "batched", "foreign")
+
+OGG_HEADER = struct.Struct("<4sBBqIIIB")
+OPUS_RATE = 48000
+LONG_AUDIO_BYTES = 320 * 1024                       # Acima do INLINE_AUDIO_MAX_BYTES do benchmark (File API)
+
+TEXTS = (
+    "Oi, bom dia!",
+    "Gostaria de saber mais sobre os cursos disponíveis",
+    "Qual o horário de atendimento?",
+    "Preciso de ajuda com a minha matrícula, não consigo acessar a plataforma desde ontem",
+    "Obrigado!",
+)
+BUTTONS = ("Quero saber mais", "Falar com atendente", "Não tenho interesse")
+
+
+class PayloadGenerator:
+    def __init__(self, id_tel, contacts=1000, forward_ratio=0.2, seed=1):
+        self.id_tel = id_tel
+        self.contacts = [f"5511{9000000000 + i}" for i in range(contacts)]
+        self.forward_ratio = forward_ratio          # Parcela de mídias encaminhadas (mesmo conteúdo de outras mensagens)
+        self.random = random.Random(seed)
+        self._ids = itertools.count()
+
+    # Corpo (bytes) da notificação do tipo solicitado
+    def make(self, kind):
+        return json.dumps(getattr(self, kind)()).encode()
+
+    def _id(self):
+        return f"wamid.HBgN{next(self._ids):016d}"
+
+    def _tel(self):
+        return self.random.choice(self.contacts)
+
+    def _media_id(self, kind):
+        if self.random.random() < self.forward_ratio:
+            content_key = f"viral{self.random.randrange(5)}"
+        else:
+            content_key = f"c{next(self._ids)}"
+        return f"{kind}-{content_key}-{next(self._ids)}"
+
+    def _notification(self, changes):
+        return {
+            "object": "whatsapp_business_account",
+            "entry": [{"id": "102290129340398", "changes": changes}]
+        }
+
+    def _messages_change(self, messages=(), statuses=(), phone_number_id=None):
+        value = {
+            "messaging_product": "whatsapp",
+            "metadata": {"display_phone_number": "5511999999999", "phone_number_id": phone_number_id or self.id_tel}
+        }
+        if messages:
+            value["contacts"] = [{"profile": {"name": "Contato Bench"}, "wa_id": message["from"]} for message in messages]
+            value["messages"] = list(messages)
+        if statuses:
+            value["statuses"] = list(statuses)
+        return {"value": value, "field": "messages"}
+
+    def _message(self, message_type, content, tel=None):
+        tel = tel or self._tel()
+        return {"from": tel, "id": self._id(), "timestamp": f"{int(time.time())}", "type": message_type, message_type: content}
+
+    def text(self):
+        return self._notification([self._messages_change([self._message("text", {"body": self.random.choice(TEXTS)})])])
+
+    def audio(self):
+        id_media = self._media_id("audio")
+        audio = {"mime_type": "audio/ogg; codecs=opus", "sha256": hashlib.sha256(media_content(id_media)).hexdigest(),
+                 "id": id_media, "voice": True}
+        return self._notification([self._messages_change([self._message("audio", audio)])])
+
+    # Audio sem divisão em trechos (não Ogg) acima do limite inline: enviado à File API do Gemini
+    def long_audio(self):
+        id_media = self._media_id("longaudio")
+        audio = {"mime_type": "audio/mpeg", "sha256": hashlib.sha256(media_content(id_media)).hexdigest(), "id": id_media}
+        return self._notification([self._messages_change([self._message("audio", audio)])])
+
+    def image(self):
+        id_media = self._media_id("image")
+        image = {"mime_type": "image/jpeg", "sha256": hashlib.sha256(media_content(id_media)).hexdigest(), "id": id_media}
+        return self._notification([self._messages_change([self._message("image", image)])])
+
+    def button(self):
+        message = self._message("button", {"payload": "bench", "text": self.random.choice(BUTTONS)})
+        message["context"] = {"from": "5511999999999", "id": self._id()}
+        return self._notification([self._messages_change([message])])
+
+    def statuses(self):
+        statuses = []
+        for status in ("sent", "delivered", "read"):
+            statuses.append({
+                "id": self._id(),
+                "status": status,
+                "timestamp": f"{int(time.time())}",
+                "recipient_id": self._tel(),
+                "biz_opaque_callback_data": "bench-campaign",
+                "conversation": {"id": "bench", "origin": {"type": "marketing"}},
+                "pricing": {"billable": True, "pricing_model": "CBP", "category": "marketing"}
+            })
+        return self._notification([self._messages_change(statuses=statuses)])
+
+    def template_status(self):
+        return self._notification([{"value": {
+            "event": "APPROVED",
+            "message_template_id": 1234567890,
+            "message_template_name": "campanha_bench",
+            "message_template_language": "pt_BR",
+            "reason": "NONE"
+        }, "field": "message_template_status_update"}])
+
+    def template_quality(self):
+        return self._notification([{"value": {
+            "previous_quality_score": "GREEN",
+            "new_quality_score": "YELLOW",
+            "message_template_id": 1234567890,
+            "message_template_name": "campanha_bench",
+            "message_template_language": "pt_BR"
+        }, "field": "message_template_quality_update"}])
+
+    # Várias entradas numa única notificação (mensagens de contatos diferentes + ACKs)
+    def batched(self):
+        changes = [self._messages_change([self._message("text", {"body": self.random.choice(TEXTS)})]) for _ in range(3)]
+        changes.append(self.statuses()["entry"][0]["changes"][0])
+        return self._notification(changes)
+
+    # Notificação destinada a outro número (descartada pelo filtro rápido)
+    def foreign(self):
+        return self._notification([self._messages_change([self._message("text", {"body": "Oi"})], phone_number_id="999999999999999")])
+
+
+# Tipo MIME da mídia, conforme o prefixo do ID gerado
+def media_mime_type(id_media):
+    if id_media.startswith("longaudio"):
+        return "audio/mpeg"
+    return "audio/ogg" if id_media.startswith("audio") else "image/jpeg"
+
+
+# Conteúdo determinístico da mídia: IDs com a mesma chave de conteúdo (encaminhamentos) retornam os mesmos bytes
+@functools.lru_cache(maxsize=256)
+def media_content(id_media):
+    kind, content_key = id_media.split("-")[:2]
+    seed = hashlib.sha256(content_key.encode()).digest()
+    if kind == "audio":
+        return _ogg_opus(seed, seconds=60)
+    if kind == "longaudio":
+        return (seed * (LONG_AUDIO_BYTES // len(seed) + 1))[:LONG_AUDIO_BYTES]
+    return (seed * (100 * 1024 // len(seed)))[:100 * 1024]      # Imagem ~100 KB
+
+
+# Audio Ogg/Opus sintético (cabeçalhos OpusHead/OpusTags + páginas de 1 segundo)
+def _ogg_opus(seed, seconds):
+    pages = [_ogg_page(0, b"OpusHead" + bytes(11), 0), _ogg_page(0, b"OpusTags" + bytes(8), 1)]
+    frame = (seed * 8)[:240]
+    for second in range(1, seconds + 1):
+        pages.append(_ogg_page(second * OPUS_RATE, frame, second + 1))
+    return b"".join(pages)
+
+
+def _ogg_page(granule, body, sequence):
+    lacing = [255] * (len(body) // 255) + [len(body) % 255]
+    return OGG_HEADER.pack(b"OggS", 0, 0, granule, 1, sequence, 0, len(lacing)) + bytes(lacing) + body
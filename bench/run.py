@@ -0,0 +1,201 @@
+# Benchmark offline do webhook, com substitutos locais da Graph API (servidor HTTP), do Firestore (em memória ou emulador)
+# e do Gemini (latência configurável). Nenhum serviço externo é acessado.
+# Uso (na raiz do repositório):
+#   python -m bench.run --requests 200 --concurrency 8 --kinds text,audio,image,statuses --json resultado.json
+# Para cada tipo de notificação: requisições/s, latência p50/p95/p99 e RPCs do Firestore (total e por requisição)
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench import fake_gemini
+from bench.fake_firestore import FakeFirestore
+from bench.fake_graph import FakeGraphApi
+from bench.payloads import KINDS, PayloadGenerator
+
+ID_TEL = "100000000000001"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark offline do webhook (WhatsApp Cloud API)")
+    parser.add_argument("--kinds", default=",".join(KINDS), help=f"Tipos de notificação, separados por vírgula ({', '.join(KINDS)})")
+    parser.add_argument("--requests", type=int, default=200, help="Requisições por tipo de notificação")
+    parser.add_argument("--concurrency", type=int, default=8, help="Requisições simultâneas")
+    parser.add_argument("--contacts", type=int, default=1000, help="Quantidade de contatos distintos")
+    parser.add_argument("--forward-ratio", type=float, default=0.2, help="Parcela de mídias encaminhadas (conteúdo repetido)")
+    parser.add_argument("--gemini-latency", type=float, default=0.5, help="Segundos por chamada ao Gemini")
+    parser.add_argument("--graph-latency", type=float, default=0.05, help="Segundos por chamada à Graph API")
+    parser.add_argument("--firestore-latency", type=float, default=0.005, help="Segundos por RPC do Firestore em memória")
+    parser.add_argument("--storage-latency", type=float, default=0.05, help="Segundos por upload no Cloud Storage")
+    parser.add_argument("--firestore", choices=("memory", "emulator"), default="memory",
+                        help="memory = Firestore em memória (com contagem de RPCs) / emulator = FIRESTORE_EMULATOR_HOST")
+    parser.add_argument("--mode", choices=("sync", "async"), default="sync", help="PROCESSING_MODE do webhook")
+    parser.add_argument("--json", help="Arquivo para gravar os resultados (comparação entre versões)")
+    return parser.parse_args()
+
+
+# Variáveis de ambiente lidas por main.py (definidas antes da importação; o .env não sobrescreve valores existentes)
+def configure_environment(args, url_base):
+    os.environ.update({
+        "API_KEY": "bench",
+        "SYSTEM_INSTRUCTIONS": "Assistente de benchmark",
+        "URL_BASE": url_base,
+        "TOKEN": "bench",
+        "ID_TEL": ID_TEL,
+        "AUDIO_BUCKET_NAME": "bench-audios",
+        "IMAGE_BUCKET_NAME": "bench-images",
+        "PROCESSING_MODE": args.mode,
+        "STARTUP_WARM_UP": "0",
+        "OUTBOUND_RATE": "100000",
+        "OUTBOUND_BURST": "100000",
+        "RECIPIENT_RATE": "100000",
+        "RECIPIENT_BURST": "100000",
+        "BROADCAST_TOKEN": "bench",
+        "INLINE_AUDIO_MAX_BYTES": str(256 * 1024),     # Audios long_audio são enviados à File API
+    })
+
+
+# Substitui os clientes lazy do webhook pelos substitutos locais. Retorna o Firestore em memória (None com o emulador)
+def install_fakes(app_module, args):
+    import media_store
+
+    record_internal_errors(app_module)
+    genai = fake_gemini.FakeGenAI(args.gemini_latency)
+    app_module.genai.set(genai)
+    for model in (app_module.audio_model, app_module.image_model, app_module.summary_model):
+        model.set(genai.GenerativeModel())              # Modelo de conversa (por número) é construído a partir do genai substituto
+    media_store._storage_client.set(fake_gemini.FakeStorageClient(args.storage_latency))
+
+    if args.firestore == "emulator":
+        if not os.environ.get("FIRESTORE_EMULATOR_HOST"):
+            sys.exit("Defina FIRESTORE_EMULATOR_HOST para utilizar o emulador do Firestore")
+        from google.auth.credentials import AnonymousCredentials
+        from google.cloud import firestore
+        app_module.db.set(firestore.Client(project="bench", credentials=AnonymousCredentials()))
+        return None
+    import google.cloud.firestore_v1                 # Carregado pela construção do cliente real (pré-carga): fora da medição
+    db = FakeFirestore(args.firestore_latency)
+    app_module.db.set(db)
+    return db
+
+
+# Erros internos registrados pelo webhook (insert_internal_error), por operação: falhas tratadas sem resposta HTTP de erro
+internal_errors = Counter()
+_internal_errors_lock = threading.Lock()
+
+
+def record_internal_errors(app_module):
+    insert_internal_error = app_module.insert_internal_error
+
+    def record(operation, error_message, tel):
+        with _internal_errors_lock:
+            internal_errors[operation] += 1
+        insert_internal_error(operation, error_message, tel)
+
+    app_module.insert_internal_error = record
+
+
+def reset_internal_errors():
+    with _internal_errors_lock:
+        snapshot = dict(internal_errors)
+        internal_errors.clear()
+    return snapshot
+
+
+# Aguarda o fim do processamento em segundo plano e grava as escritas pendentes (contabilizadas no tipo em execução)
+def drain(app_module):
+    if app_module.worker_pool:
+        while True:
+            stats = app_module.worker_pool.stats()
+            if not stats["queue_depth"] and not stats["in_flight"] and not app_module.contact_lanes.active():
+                break
+            time.sleep(0.05)
+    app_module.firestore_writer.flush()
+    app_module.status_pipeline.flush()
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered))) - 1))]
+
+
+def run_kind(app_module, client, generator, kind, args, db, graph):
+    bodies = [generator.make(kind) for _ in range(args.requests)]
+
+    def post(body):
+        start = time.perf_counter()
+        response = client.post("/webhook", data=body, content_type="application/json")
+        return time.perf_counter() - start, response.status_code
+
+    if db:
+        db.reset_counters()
+    graph.reset_counters()
+    fake_gemini.reset_counters()
+    reset_internal_errors()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        results = list(executor.map(post, bodies))
+    drain(app_module)
+    elapsed = time.perf_counter() - start
+
+    latencies = [latency for latency, _ in results]
+    rpcs = db.reset_counters() if db else {}
+    return {
+        "kind": kind,
+        "requests": len(results),
+        "errors": sum(1 for _, status in results if status >= 400),
+        "rps": len(results) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "firestore_rpcs": rpcs,
+        "firestore_rpcs_per_request": sum(rpcs.values()) / len(results) if results and db else None,
+        "graph_calls": graph.reset_counters(),
+        "gemini_calls": fake_gemini.reset_counters(),
+        "internal_errors": reset_internal_errors(),
+    }
+
+
+def print_report(results):
+    print(f"{'tipo':<18}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'erros':>7}{'falhas':>8}{'RPCs/req':>10}  RPCs do Firestore")
+    for result in results:
+        per_request = result["firestore_rpcs_per_request"]
+        rpcs = ", ".join(f"{kind}={count}" for kind, count in sorted(result["firestore_rpcs"].items())) or "-"
+        print(f"{result['kind']:<18}{result['rps']:>9.1f}{result['p50_ms']:>10.1f}{result['p95_ms']:>10.1f}{result['p99_ms']:>10.1f}"
+              f"{result['errors']:>7}{sum(result['internal_errors'].values()):>8}{(f'{per_request:.2f}' if per_request is not None else 'n/d'):>10}  {rpcs}")
+
+
+def main():
+    args = parse_args()
+    kinds = [kind.strip() for kind in args.kinds.split(",") if kind.strip()]
+    unknown = set(kinds) - set(KINDS)
+    if unknown:
+        sys.exit(f"Tipos desconhecidos: {', '.join(sorted(unknown))}")
+
+    graph = FakeGraphApi(args.graph_latency).start()
+    configure_environment(args, graph.url_base)
+
+    import main as app_module                       # Importado após configurar o ambiente
+    db = install_fakes(app_module, args)
+    client = app_module.app.test_client()
+    generator = PayloadGenerator(ID_TEL, contacts=args.contacts, forward_ratio=args.forward_ratio)
+
+    results = [run_kind(app_module, client, generator, kind, args, db, graph) for kind in kinds]
+    print_report(results)
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=2)
+    graph.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+# Envio de campanhas (templates) para os contatos ativos
+# Os contatos (Tipo_Contato == "Ativos") são lidos em páginas; os envios passam pelo despachante (prioridade de envio em massa),
+# com limite de envios simultâneos. Ao fim de cada página o progresso é salvo (checkpoint), permitindo retomar após falhas.
+# O ID da mensagem de cada destinatário é registrado para correlação com os ACKs (status)
+import threading
+import time
+
+
+from dispatcher import PRIORITY_BULK
+
+BROADCAST_COLLECTION = "broadcasts"
+QUALITY_ORDER = {"GREEN": 3, "YELLOW": 2, "RED": 1}     # Score de qualidade dos modelos (maior = melhor)
+
+
+class CampaignBroadcaster:
+    def __init__(self, db, outbound, writer, page_size=500, max_in_flight=500, send_timeout=300, on_error=None):
+        self.db = db
+        self.outbound = outbound                    # OutboundDispatcher
+        self.writer = writer                        # BufferedWriter (registros por destinatário)
+        self.page_size = page_size
+        self.max_in_flight = max_in_flight
+        self.send_timeout = send_timeout
+        self.on_error = on_error                    # Callback (campaign_id, exception)
+        self._running = {}                          # campaign_id => threading.Event (sinal de pausa)
+        self._lock = threading.Lock()
+
+    def doc_ref(self, campaign_id):
+        return self.db.collection(BROADCAST_COLLECTION).document(campaign_id)
+
+    # Inicia (ou retoma, a partir do último checkpoint) o envio da campanha em segundo plano. Retorna False caso já esteja em andamento
+    def start(self, campaign_id):
+        campaign = self.db.collection("campaigns").document(campaign_id).get()
+        if not campaign.exists:
+            raise ValueError(f"Campanha {campaign_id} não encontrada")
+        campaign = campaign.to_dict()
+
+        with self._lock:
+            if campaign_id in self._running:
+                return False
+            pause = threading.Event()
+            self._running[campaign_id] = pause
+
+        self.doc_ref(campaign_id).set({
+            "template_id": f"{campaign.get('ID_Modelo', '')}",
+            "status": "running",
+            "updated": int(time.time())
+        }, merge=True)
+        thread = threading.Thread(target=self._run, args=(campaign_id, campaign, pause), name=f"broadcast-{campaign_id}", daemon=True)
+        thread.start()
+        return True
+
+    # Pausa o envio da campanha (o checkpoint é mantido para posterior retomada)
+    def pause(self, campaign_id, reason=""):
+        pause_campaign(self.db, campaign_id, reason)
+        with self._lock:
+            pause = self._running.get(campaign_id)
+        if pause:
+            pause.set()
+
+    # Pausa automaticamente as campanhas do modelo em caso de queda no score de qualidade
+    def on_quality_update(self, message_template_id, previous, new):
+        pause_on_quality_drop(self.db, message_template_id, previous, new, pause=self.pause)
+
+    def _run(self, campaign_id, campaign, pause):
+        try:
+            self._broadcast(campaign_id, campaign, pause)
+        except Exception as e:
+            self.doc_ref(campaign_id).set({"status": "error", "reason": f"{e}", "updated": int(time.time())}, merge=True)
+            if self.on_error:
+                self.on_error(campaign_id, e)
+        finally:
+            with self._lock:
+                self._running.pop(campaign_id, None)
+
+    def _broadcast(self, campaign_id, campaign, pause):
+        from google.cloud.firestore_v1.field_path import FieldPath
+        checkpoint = self.doc_ref(campaign_id).get().to_dict() or {}
+        last_contact = checkpoint.get("last_contact")
+        sent = checkpoint.get("sent", 0)
+        failed = checkpoint.get("failed", 0)
+        recipients = self.doc_ref(campaign_id).collection("recipients")
+
+        while not pause.is_set():
+            query = self.db.collection("contacts").where("Tipo_Contato", "==", "Ativos").order_by(FieldPath.document_id()).limit(self.page_size)
+            if last_contact:
+                query = query.start_after({FieldPath.document_id(): self.db.collection("contacts").document(last_contact)})
+            page = query.get()
+            if not page:
+                break
+
+            # Retomada: destinatários da página que já receberam a campanha são ignorados (uma única leitura em lote)
+            already_sent = {doc.id for doc in self.db.get_all([recipients.document(contact.id) for contact in page]) if doc.exists}
+
+            in_flight = []
+            for contact in page:
+                if contact.id in already_sent:
+                    continue
+                tel = contact.to_dict().get("Telefone") or contact.id
+                future = self.outbound.submit(tel, template_payload(tel, campaign, campaign_id), PRIORITY_BULK)
+                in_flight.append((contact.id, tel, future))
+                if len(in_flight) >= self.max_in_flight:
+                    page_sent, page_failed = self._collect(in_flight, recipients)
+                    sent += page_sent
+                    failed += page_failed
+                    in_flight = []
+                if pause.is_set():
+                    break
+            page_sent, page_failed = self._collect(in_flight, recipients)
+            sent += page_sent
+            failed += page_failed
+            if pause.is_set():
+                break                               # Página interrompida: o checkpoint não avança (destinatários já enviados são ignorados na retomada)
+
+            # Checkpoint da página + verificação de pausa solicitada por outra instância
+            last_contact = page[-1].id
+            self.writer.flush()
+            self.doc_ref(campaign_id).set({"last_contact": last_contact, "sent": sent, "failed": failed, "updated": int(time.time())}, merge=True)
+            if (self.doc_ref(campaign_id).get().to_dict() or {}).get("status") == "paused":
+                pause.set()
+
+        if not pause.is_set():
+            self.doc_ref(campaign_id).set({"status": "done", "sent": sent, "failed": failed, "updated": int(time.time())}, merge=True)
+        else:
+            self.doc_ref(campaign_id).set({"sent": sent, "failed": failed, "updated": int(time.time())}, merge=True)
+
+    # Aguarda os envios em andamento e registra o ID da mensagem de cada destinatário
+    def _collect(self, in_flight, recipients):
+        sent = 0
+        failed = 0
+        for contact_id, tel, future in in_flight:
+            record = {"tel": tel, "timestamp": int(time.time())}
+            try:
+                response = future.result(timeout=self.send_timeout)
+                json_response = response.json() if response.status_code == 200 else {}
+            except Exception:
+                json_response = {}
+            if json_response.get("messages"):
+                record["message_id"] = json_response["messages"][0].get("id")
+                record["status"] = "sent"
+                sent += 1
+                self.writer.set(recipients.document(contact_id), record)
+            else:
+                failed += 1                         # Falha: contabilizada, sem registro do destinatário
+        return sent, failed
+
+    # Campanhas em andamento nesta instância
+    def active(self):
+        with self._lock:
+            return list(self._running)
+
+
+# Pausa a campanha no Firestore: a instância que a executa interrompe o envio no próximo checkpoint
+def pause_campaign(db, campaign_id, reason=""):
+    db.collection(BROADCAST_COLLECTION).document(campaign_id).set({"status": "paused", "reason": reason, "updated": int(time.time())}, merge=True)
+
+
+# Pausa as campanhas em andamento do modelo em caso de queda no score de qualidade
+# Sem o CampaignBroadcaster do número (pause=None), somente o Firestore é atualizado (não constrói o despachante do número)
+def pause_on_quality_drop(db, message_template_id, previous, new, pause=None):
+    if QUALITY_ORDER.get(new, 0) >= QUALITY_ORDER.get(previous, 0) and new != "RED":
+        return
+    docs = db.collection(BROADCAST_COLLECTION).where("template_id", "==", f"{message_template_id}").where("status", "==", "running").get()
+    for doc in docs:
+        reason = f"Score de qualidade alterado de {previous} para {new}"
+        if pause:
+            pause(doc.id, reason)
+        else:
+            pause_campaign(db, doc.id, reason)
+
+
+# Mensagem de template da campanha. biz_opaque_callback_data retorna nos ACKs, identificando a campanha sem consultas adicionais
+def template_payload(tel, campaign, campaign_id):
+    template = {
+        "name": campaign.get("Nome_Modelo"),
+        "language": {"code": campaign.get("Idioma_Modelo", "pt_BR")}
+    }
+    if campaign.get("Componentes_Modelo"):
+        template["components"] = campaign["Componentes_Modelo"]
+    return {
+        "messaging_product": "whatsapp",
+        "recipient_type": "individual",
+        "to": tel,
+        "type": "template",
+        "template": template,
+        "biz_opaque_callback_data": campaign_id
+    }
@@ -0,0 +1,109 @@
+# Sessões de chat da IA (Gemini) reaproveitadas por contato
+# A sessão de cada contato fica em memória (LRU com expiração por inatividade), evitando recarregar e reconstruir o histórico a cada mensagem.
+# Opcionalmente, as instruções do sistema ficam no cache de contexto do Gemini (CachedContent): turnos seguintes pagam só os tokens novos
+import datetime
+import threading
+import time
+
+from history import apply_token_budget
+from ttl_cache import TTLCache
+
+
+class ChatSessionManager:
+    def __init__(self, get_model, max_sessions=1000, idle_ttl=1800, max_history=42, token_budget=0, cache=None):
+        self.get_model = get_model                  # Função que retorna o modelo usado para iniciar novas sessões
+        self.max_history = max_history              # Sessões com histórico maior que isto são reconstruídas (janela + resumo do histórico)
+        self.token_budget = token_budget            # Sessões com histórico acima do limite (estimado) de tokens são reconstruídas (0 = sem limite)
+        self.sessions = cache if cache is not None else TTLCache(max_items=max_sessions, ttl=idle_ttl)     # tel => sessão (cache informado: compartilhado entre números)
+
+    # Retorna a sessão do contato, iniciando uma nova a partir do histórico (load_history) caso não exista em memória
+    # ou tenha ultrapassado a janela do histórico (quantidade de turnos ou limite de tokens)
+    def get(self, tel, load_history):
+        convo = self.sessions.get(tel)                 # Acesso renova a posição LRU; o TTL é renovado abaixo
+        if convo is None or self._exceeded(convo.history):
+            convo = self.get_model().start_chat(history=load_history())
+        self.sessions.set(tel, convo)               # Renova expiração por inatividade
+        return convo
+
+    def _exceeded(self, history):
+        return len(history) > self.max_history or len(apply_token_budget(history, self.token_budget)) < len(history)
+
+    # Verifica se a sessão do contato está em memória (sem renovar a posição LRU)
+    def has(self, tel):
+        return tel in self.sessions
+
+    # Descarta a sessão (ex.: histórico alterado fora da sessão); a próxima mensagem reconstrói a partir do banco
+    def discard(self, tel):
+        self.sessions.pop(tel)
+
+    # Métricas das sessões em memória
+    def stats(self):
+        return self.sessions.stats()
+
+
+# Modelo baseado no cache de contexto do Gemini (instruções do sistema armazenadas uma única vez)
+# Caso o cache não possa ser criado, utiliza o modelo padrão: em definitivo para erros permanentes (ex.: instruções abaixo do mínimo
+# de tokens exigido) e, para falhas transitórias (rede, 429/5xx), até a próxima tentativa (backoff exponencial)
+class ContextCachedModel:
+    def __init__(self, model_name, system_instruction, fallback_model, generation_config=None, safety_settings=None, ttl=3600,
+                 retry_backoff=30, max_retry_backoff=900):
+        self.model_name = model_name                # Exige versão fixa do modelo (ex.: models/gemini-1.5-pro-001)
+        self.system_instruction = system_instruction
+        self.fallback_model = fallback_model
+        self.generation_config = generation_config
+        self.safety_settings = safety_settings
+        self.ttl = ttl
+        self.retry_backoff = retry_backoff          # Segundos até nova tentativa após a primeira falha transitória (dobra a cada falha)
+        self.max_retry_backoff = max_retry_backoff
+        self._cache = None
+        self._model = None
+        self._expires_at = 0
+        self._disabled = False
+        self._failures = 0
+        self._retry_at = 0
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self._disabled or time.monotonic() < self._retry_at:
+            return self.fallback_model
+        if self._model is not None and time.monotonic() < self._expires_at:
+            return self._model
+        with self._lock:
+            if self._disabled or time.monotonic() < self._retry_at:
+                return self.fallback_model
+            if self._model is not None and time.monotonic() < self._expires_at:
+                return self._model
+            try:
+                import google.generativeai as genai
+                from google.generativeai import caching
+
+                ttl = datetime.timedelta(seconds=self.ttl)
+                if self._cache is not None:
+                    try:
+                        self._cache.update(ttl=ttl)     # Prorroga o cache existente
+                    except Exception:
+                        self._cache = None              # Cache expirado/removido: cria novamente
+                if self._cache is None:
+                    self._cache = caching.CachedContent.create(model=self.model_name, system_instruction=self.system_instruction, ttl=ttl)
+                self._model = genai.GenerativeModel.from_cached_content(self._cache,
+                        generation_config=self.generation_config, safety_settings=self.safety_settings)
+                self._expires_at = time.monotonic() + self.ttl * 0.8
+                self._failures = 0
+                return self._model
+            except Exception as e:
+                if _permanent(e):
+                    print(f"Cache de contexto do Gemini indisponível, utilizando modelo padrão. Detalhes: {e}")
+                    self._disabled = True
+                else:
+                    backoff = min(self.retry_backoff * 2 ** self._failures, self.max_retry_backoff)
+                    self._failures += 1
+                    self._retry_at = time.monotonic() + backoff
+                    print(f"Falha ao criar o cache de contexto do Gemini, utilizando modelo padrão por {backoff}s. Detalhes: {e}")
+                return self.fallback_model
+
+
+# Erro permanente na criação do cache de contexto: requisição rejeitada (4xx, ex.: conteúdo abaixo do mínimo de tokens,
+# modelo sem suporte a cache). 429 (limite de requisições) é transitório
+def _permanent(error):
+    from google.api_core import exceptions
+    return isinstance(error, exceptions.ClientError) and not isinstance(error, exceptions.TooManyRequests)
@@ -0,0 +1,175 @@
+# Circuit breaker para dependências externas (Gemini, Graph API, Cloud Storage)
+# Acompanha o resultado das chamadas numa janela de tempo; acima do limite de falhas (ou de chamadas lentas) o circuito abre
+# e as chamadas falham imediatamente (CircuitOpenError), sem ocupar threads aguardando uma dependência indisponível.
+# Após open_seconds, o circuito fica semiaberto: algumas chamadas de teste decidem entre fechar ou reabrir
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    def __init__(self, name, failure_rate=0.5, slow_call_seconds=None, slow_call_rate=0.5, min_calls=10,
+                 window=60, open_seconds=30, half_open_probes=1, on_state_change=None):
+        self.name = name
+        self.failure_rate = failure_rate            # Parcela de falhas que abre o circuito
+        self.slow_call_seconds = slow_call_seconds  # Chamadas acima deste tempo contam como lentas (None = não considera latência)
+        self.slow_call_rate = slow_call_rate        # Parcela de chamadas lentas que abre o circuito
+        self.min_calls = min_calls                  # Mínimo de chamadas na janela para avaliar as parcelas
+        self.window = window                        # Segundos considerados na avaliação
+        self.open_seconds = open_seconds            # Segundos com o circuito aberto até a chamada de teste
+        self.half_open_probes = half_open_probes    # Chamadas de teste simultâneas no estado semiaberto
+        self.on_state_change = on_state_change      # Callback (nome, estado anterior, novo estado)
+        self._state = CLOSED
+        self._opened_at = 0
+        self._probes = 0
+        self._calls = deque()                       # (instante, falha, lenta)
+        self._changes = deque()                     # Transições ainda não notificadas (on_state_change é chamado fora do lock)
+        self._notifying = False
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            self._refresh()
+            state = self._state
+        self._notify()
+        return state
+
+    # Aberto há mais de open_seconds => semiaberto
+    def _refresh(self):
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+            self._transition(HALF_OPEN)
+
+    def _transition(self, state):
+        previous, self._state = self._state, state
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+        if state in (OPEN, CLOSED):
+            self._calls.clear()
+            self._probes = 0
+        if previous != state:
+            self._changes.append((previous, state))
+
+    # Notifica as transições registradas, em ordem, após liberar o lock (o callback pode consultar o circuito ou fazer I/O)
+    # Uma única thread notifica por vez; transições registradas durante a notificação são entregues por ela na sequência
+    def _notify(self):
+        if not self._changes:                       # Leitura sem lock: quem registra uma transição também chama _notify
+            return
+        with self._lock:
+            if self._notifying or not self._changes:
+                return
+            self._notifying = True
+        try:
+            while True:
+                with self._lock:
+                    if not self._changes:
+                        self._notifying = False
+                        return
+                    previous, state = self._changes.popleft()
+                if self.on_state_change:
+                    self.on_state_change(self.name, previous, state)
+        except BaseException:
+            with self._lock:
+                self._notifying = False
+            raise
+
+    # Reserva a execução de uma chamada. Lança CircuitOpenError caso o circuito esteja aberto (ou sem vaga para teste)
+    def acquire(self):
+        with self._lock:
+            self._refresh()
+            allowed = self._state == CLOSED or (self._state == HALF_OPEN and self._probes < self.half_open_probes)
+            if self._state == HALF_OPEN and allowed:
+                self._probes += 1
+            if not allowed:
+                self.rejected += 1
+        self._notify()
+        if allowed:
+            return
+        raise CircuitOpenError(f"Circuito {self.name} aberto")
+
+    # Registra o resultado da chamada (falha e/ou duração)
+    def record(self, failed, elapsed=0.0):
+        self._record(failed, elapsed)
+        self._notify()
+
+    def _record(self, failed, elapsed):
+        slow = bool(self.slow_call_seconds) and elapsed >= self.slow_call_seconds
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._transition(OPEN if failed or slow else CLOSED)
+                return
+            if self._state == OPEN:
+                return
+            now = time.monotonic()
+            self._calls.append((now, failed, slow))
+            while self._calls and self._calls[0][0] < now - self.window:
+                self._calls.popleft()
+            total = len(self._calls)
+            if total < self.min_calls:
+                return
+            failures = sum(1 for _, call_failed, _ in self._calls if call_failed)
+            slow_calls = sum(1 for _, _, call_slow in self._calls if call_slow)
+            if failures / total >= self.failure_rate or (self.slow_call_seconds and slow_calls / total >= self.slow_call_rate):
+                self._transition(OPEN)
+
+    # Executa o bloco protegido pelo circuito: exceções contam como falha; a duração é comparada ao limite de lentidão
+    @contextmanager
+    def guard(self):
+        self.acquire()
+        start = time.monotonic()
+        try:
+            yield
+        except BaseException:                       # Qualquer interrupção conta como falha (libera a vaga de teste no estado semiaberto)
+            self.record(True, time.monotonic() - start)
+            raise
+        self.record(False, time.monotonic() - start)
+
+    def call(self, fn, *args, **kwargs):
+        with self.guard():
+            return fn(*args, **kwargs)
+
+    # Itera sobre uma resposta em stream protegida pelo circuito (start(*args, **kwargs) inicia a chamada e retorna o stream)
+    # Somente o tempo de obtenção dos trechos é medido: o processamento de cada trecho pelo chamador (ex.: envio ao usuário)
+    # não conta como lentidão, e o abandono do stream pelo chamador não conta como falha da dependência
+    def stream(self, start, *args, **kwargs):
+        self.acquire()
+        elapsed = 0.0
+        try:
+            begin = time.monotonic()
+            iterator = iter(start(*args, **kwargs))
+            elapsed += time.monotonic() - begin
+            while True:
+                begin = time.monotonic()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                finally:
+                    elapsed += time.monotonic() - begin
+                yield item
+        except GeneratorExit:
+            self.record(False, elapsed)
+            raise
+        except BaseException:
+            self.record(True, elapsed)
+            raise
+        self.record(False, elapsed)
+
+    def stats(self):
+        with self._lock:
+            self._refresh()
+            total = len(self._calls)
+            failures = sum(1 for _, failed, _ in self._calls if failed)
+            stats = {"state": self._state, "calls": total, "failures": failures, "rejected": self.rejected}
+        self._notify()
+        return stats
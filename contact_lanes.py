@@ -0,0 +1,85 @@
+# Filas de execução ordenadas por contato (telefone)
+# Mensagens de um mesmo contato são processadas em ordem de chegada; contatos diferentes são processados em paralelo
+# (cada fila ativa é esvaziada por uma thread do pool das filas, não pela thread que enfileirou a tarefa)
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from lazy_init import on_fork
+
+
+class ContactLanes:
+    def __init__(self, coalesce_window=0.0, on_error=None, workers=32):
+        self.on_error = on_error                        # Callback chamado com (exception) quando uma tarefa falha
+        self.coalesce_window = coalesce_window          # Janela (segundos) para agrupar mensagens consecutivas em um único processamento
+        self.workers = workers                          # Contatos processados simultaneamente
+        self._lanes = {}                                # tel => deque de tarefas pendentes
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="contact-lane")
+        on_fork(self._after_fork)
+
+    # Enfileira tarefa na fila do contato. A fila ociosa passa a ser processada por uma thread do pool
+    # Tarefas consecutivas com o mesmo batch_fn são agrupadas e processadas numa única chamada batch_fn([args, ...])
+    # Retorna future concluído ao final da tarefa (falhas são informadas ao on_error, não ao future)
+    def submit(self, key, fn, *args, batch_fn=None):
+        future = Future()
+        task = (fn, args, batch_fn, time.monotonic(), future)
+        with self._lock:
+            lane = self._lanes.get(key)
+            if lane is not None:
+                lane.append(task)
+                return future
+            lane = deque([task])
+            self._lanes[key] = lane
+        self._executor.submit(self._drain, key, lane)
+        return future
+
+    def _drain(self, key, lane):
+        while True:
+            with self._lock:
+                if not lane:
+                    del self._lanes[key]
+                    return
+                fn, args, batch_fn, arrival, _ = lane[0]
+
+            if batch_fn and self.coalesce_window > 0:
+                wait = self.coalesce_window - (time.monotonic() - arrival)
+                if wait > 0:
+                    time.sleep(wait)                    # Aguarda outras mensagens da mesma rajada
+                with self._lock:
+                    tasks = []
+                    while lane and lane[0][2] is batch_fn:
+                        tasks.append(lane.popleft())
+                self._call(batch_fn, ([task[1] for task in tasks],), [task[4] for task in tasks])
+            else:
+                with self._lock:
+                    task = lane.popleft()
+                self._call(fn, args, [task[4]])
+
+    def _call(self, fn, args, futures):
+        try:
+            fn(*args)
+        except Exception as e:
+            if self.on_error:
+                try:
+                    self.on_error(e)
+                except Exception:
+                    pass
+        finally:
+            for future in futures:
+                future.set_result(None)
+
+    # Quantidade de contatos com processamento em andamento
+    def active(self):
+        with self._lock:
+            return len(self._lanes)
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+    # Processo filho (fork): um executor já utilizado no processo pai não cria novas threads no filho
+    def _after_fork(self):
+        self._lanes = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="contact-lane")
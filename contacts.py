@@ -0,0 +1,68 @@
+# Repositório de contatos (Firestore - coleção "contacts")
+# O contato é identificado pelo próprio telefone (ID do documento), lido uma única vez e mantido em cache (LRU/TTL).
+# As alterações de um evento são acumuladas e gravadas numa única escrita (flush)
+import threading
+
+from ttl_cache import TTLCache
+
+COLLECTION = "contacts"
+
+
+class ContactRepository:
+    def __init__(self, db, cache_items=5000, cache_ttl=900, cache=None):
+        self.db = db
+        self.cache = cache if cache is not None else TTLCache(max_items=cache_items, ttl=cache_ttl)    # tel => dict do contato (ou None, quando não existe)
+        self._pending = {}                                              # tel => alterações ainda não gravadas
+        self._lock = threading.Lock()
+
+    def doc_ref(self, tel):
+        return self.db.collection(COLLECTION).document(tel)
+
+    # Obtem contato (cache => documento {tel} => documento legado localizado pelo campo "Telefone"). Retorna None caso não exista
+    def get(self, tel):
+        with self._lock:
+            if tel in self.cache:
+                return self.cache.get(tel)
+        contact = self._load(tel)
+        with self._lock:
+            self.cache.add(tel, contact)
+            return self.cache.get(tel, contact)
+
+    def _load(self, tel):
+        doc = self.doc_ref(tel).get()
+        if doc.exists:
+            return doc.to_dict()
+
+        # Contato gravado no formato antigo (ID aleatório): migra para o documento identificado pelo telefone
+        legacy = self.db.collection(COLLECTION).where("Telefone", "==", tel).limit(1).get()
+        if legacy:
+            contact = legacy[0].to_dict()
+            batch = self.db.batch()
+            batch.set(self.doc_ref(tel), contact)
+            batch.delete(legacy[0].reference)
+            batch.commit()
+            return contact
+        return None
+
+    # Registra alterações do contato (em cache). A gravação ocorre no flush()
+    def update(self, tel, fields):
+        with self._lock:
+            contact = dict(self.cache.get(tel) or {})
+            contact.update(fields)
+            self.cache.set(tel, contact)
+            self._pending.setdefault(tel, {}).update(fields)
+
+    # Grava, numa única escrita (merge), as alterações pendentes do contato
+    def flush(self, tel):
+        with self._lock:
+            fields = self._pending.pop(tel, None)
+        if fields:
+            try:
+                self.doc_ref(tel).set(fields, merge=True)
+            except Exception:
+                self.cache.pop(tel)                 # Cache pode divergir do banco: força nova leitura
+                raise
+
+    # Métricas do cache de contatos
+    def cache_stats(self):
+        return self.cache.stats()
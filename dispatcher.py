@@ -0,0 +1,227 @@
+# Despachante de mensagens enviadas à WhatsApp Cloud API
+# Todo envio passa por uma fila de prioridade limitada (respostas de conversa antes de envios em massa),
+# com controle de vazão global e por destinatário (token bucket) e novas tentativas com backoff em caso de 429.
+# POST /messages não é idempotente: falhas após o envio da requisição (ex.: ReadTimeout) não são repetidas, evitando mensagens duplicadas
+import heapq
+import itertools
+import random
+import threading
+import time
+from concurrent.futures import Future
+
+import requests
+from urllib3.exceptions import ConnectTimeoutError
+
+from circuit_breaker import CircuitOpenError
+from ttl_cache import TTLCache
+
+PRIORITY_REPLY = 0                          # Respostas de conversa
+PRIORITY_BULK = 10                          # Campanhas / envios em massa
+
+RATE_LIMIT_CODES = frozenset((4, 80007, 130429, 131048, 131056))    # Códigos de erro da Graph API referentes a limite de vazão
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate                            # Tokens por segundo
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    # Consome um token. Retorna 0 em caso de sucesso ou os segundos até haver token disponível (sem consumir)
+    def take(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    # Esvazia o bucket (ex.: após 429), pausando os envios por alguns instantes
+    def drain(self):
+        with self.lock:
+            self.tokens = min(self.tokens, 0)
+            self.updated = time.monotonic()
+
+
+class _Job:
+    __slots__ = ("priority", "seq", "not_before", "tel", "data", "future", "attempts", "enqueued_at")
+
+    def __init__(self, priority, seq, tel, data):
+        self.priority = priority
+        self.seq = seq
+        self.not_before = 0
+        self.tel = tel
+        self.data = data
+        self.future = Future()
+        self.attempts = 0
+        self.enqueued_at = time.monotonic()
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class OutboundDispatcher:
+    def __init__(self, send_fn, rate=80, burst=80, recipient_rate=1, recipient_burst=5,
+                 max_queue=10000, workers=16, max_retries=5, backoff=1.0):
+        self.send_fn = send_fn                      # Função (data) => resposta HTTP
+        self.bucket = TokenBucket(rate, burst)
+        self.recipient_rate = recipient_rate
+        self.recipient_burst = recipient_burst
+        self.recipient_buckets = TTLCache(max_items=100000, ttl=600)
+        self.max_queue = max_queue
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._heap = []                             # Jobs liberados, por (prioridade, ordem de chegada)
+        self._delayed = []                          # Jobs reagendados: (not_before, seq, job)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._running = True
+        self._metrics = {"sent": 0, "failed": 0, "retried": 0, "rejected": 0, "wait_total": 0.0, "wait_max": 0.0}
+        self._threads = [threading.Thread(target=self._run, name=f"outbound-{i}", daemon=True) for i in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    # Enfileira envio. Retorna Future com a resposta HTTP (ou exceção QueueFullError / de rede)
+    def submit(self, tel, data, priority=PRIORITY_REPLY):
+        job = _Job(priority, next(self._seq), tel, data)
+        with self._cond:
+            if len(self._heap) + len(self._delayed) >= self.max_queue or not self._running:
+                self._metrics["rejected"] += 1
+                job.future.set_exception(QueueFullError("Fila de envio cheia"))
+                return job.future
+            heapq.heappush(self._heap, job)
+            self._cond.notify()
+        return job.future
+
+    def _recipient_bucket(self, tel):
+        bucket = self.recipient_buckets.get(tel)
+        if bucket is None:
+            bucket = TokenBucket(self.recipient_rate, self.recipient_burst)
+            if not self.recipient_buckets.add(tel, bucket):
+                bucket = self.recipient_buckets.get(tel, bucket)
+        return bucket
+
+    # Retira da fila o job de maior prioridade já liberado (not_before). Retorna (job, espera até o próximo reagendado)
+    def _next_job(self):
+        now = time.monotonic()
+        while self._delayed and self._delayed[0][0] <= now:
+            heapq.heappush(self._heap, heapq.heappop(self._delayed)[2])
+        wait = self._delayed[0][0] - now if self._delayed else None
+        if self._heap:
+            return heapq.heappop(self._heap), wait
+        return None, wait
+
+    def _run(self):
+        while True:
+            with self._cond:
+                job, wait = self._next_job()
+                while job is None:
+                    if not self._running and not self._heap and not self._delayed:
+                        return
+                    self._cond.wait(wait if wait is not None else 1)
+                    job, wait = self._next_job()
+
+            # Vazão por destinatário: reagenda sem ocupar o worker
+            delay = self._recipient_bucket(job.tel).take()
+            if delay:
+                self._requeue(job, delay)
+                continue
+            # Vazão global
+            delay = self.bucket.take()
+            while delay:
+                time.sleep(delay)
+                delay = self.bucket.take()
+
+            self._send(job)
+
+    def _send(self, job):
+        job.attempts += 1
+        try:
+            response = self.send_fn(job.data)
+        except Exception as e:
+            if job.attempts <= self.max_retries and _connect_failed(e):    # Somente falhas antes do envio da requisição são repetidas
+                self._retry(job)
+                return
+            self._finish(job, error=e)
+            return
+
+        if _is_rate_limited(response) and job.attempts <= self.max_retries:
+            self.bucket.drain()                     # Limite atingido: pausa os envios globais
+            self._retry(job)
+            return
+        self._finish(job, response=response)
+
+    def _retry(self, job):
+        with self._cond:
+            self._metrics["retried"] += 1
+        self._requeue(job, random.uniform(0, self.backoff * (2 ** job.attempts)))
+
+    def _requeue(self, job, delay):
+        with self._cond:
+            job.not_before = time.monotonic() + delay
+            heapq.heappush(self._delayed, (job.not_before, job.seq, job))
+            self._cond.notify()
+
+    def _finish(self, job, response=None, error=None):
+        waited = time.monotonic() - job.enqueued_at
+        with self._cond:
+            self._metrics["wait_total"] += waited
+            self._metrics["wait_max"] = max(self._metrics["wait_max"], waited)
+            if error is None and response is not None and response.status_code == 200:
+                self._metrics["sent"] += 1
+            else:
+                self._metrics["failed"] += 1
+        if error is not None:
+            job.future.set_exception(error)
+        else:
+            job.future.set_result(response)
+
+    # Encerramento: para de aceitar envios e aguarda o esvaziamento da fila
+    def shutdown(self, timeout=30):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(0, deadline - time.monotonic()))
+
+    # Métricas (profundidade da fila, enviados, falhas, novas tentativas, tempo de espera)
+    def stats(self):
+        with self._cond:
+            metrics = dict(self._metrics)
+            metrics["queue_depth"] = len(self._heap) + len(self._delayed)
+        finished = metrics["sent"] + metrics["failed"]
+        metrics["wait_avg"] = metrics["wait_total"] / finished if finished else 0.0
+        return metrics
+
+
+# Verifica se a resposta da Graph API indica limite de vazão atingido
+def _is_rate_limited(response):
+    if response.status_code == 429:
+        return True
+    if response.status_code == 400:
+        try:
+            code = response.json().get("error", {}).get("code")
+        except ValueError:
+            return False
+        return code in RATE_LIMIT_CODES
+    return False
+
+
+# Falha na conexão (requisição não enviada): nova tentativa não duplica a mensagem. Circuito aberto: falha imediata, sem novas tentativas
+def _connect_failed(error):
+    if isinstance(error, CircuitOpenError):
+        return False
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    if isinstance(error, requests.exceptions.ConnectionError) and error.args:
+        return isinstance(getattr(error.args[0], "reason", error.args[0]), ConnectTimeoutError)   # NewConnectionError, falha de DNS
+    return False
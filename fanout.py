@@ -0,0 +1,84 @@
+# Execução concorrente das etapas de I/O independentes do processamento de uma mensagem
+# (controle de duplicidade, contato, histórico, URL da mídia, upload da mídia, transcrição...)
+# Cada etapa é submetida a um pool de threads compartilhado; quem depende do resultado aguarda com o timeout próprio da etapa
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from lazy_init import on_fork
+from telemetry import current_trace, use_trace
+from tenants import current_tenant, use_tenant
+
+_local = threading.local()
+
+
+class StageTimeoutError(Exception):
+    pass
+
+
+# Etapa em execução: o timeout é contado a partir da submissão
+class Stage:
+    __slots__ = ("name", "future", "timeout", "deadline")
+
+    def __init__(self, name, future, timeout):
+        self.name = name
+        self.future = future
+        self.timeout = timeout
+        self.deadline = time.monotonic() + timeout
+
+    # Aguarda o resultado da etapa (exceções da etapa são relançadas). Lança StageTimeoutError caso o prazo se esgote
+    def result(self):
+        try:
+            return self.future.result(max(0, self.deadline - time.monotonic()))
+        except FutureTimeoutError:
+            raise StageTimeoutError(f"Etapa {self.name} excedeu {self.timeout}s") from None
+
+
+class FanOut:
+    def __init__(self, workers=32, default_timeout=15, on_error=None):
+        self.default_timeout = default_timeout
+        self.on_error = on_error                    # Callback (nome da etapa, exception) para etapas sem espera (detach)
+        self.workers = workers
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="fanout")
+        on_fork(self._after_fork)
+
+    # Inicia etapa em paralelo. Chamadas feitas dentro de outra etapa executam na própria thread (evita esgotar o pool em esperas encadeadas)
+    def submit(self, name, fn, *args, timeout=None, **kwargs):
+        timeout = timeout or self.default_timeout
+        if getattr(_local, "inside", False):
+            future = Future()
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+            return Stage(name, future, timeout)
+        return Stage(name, self._executor.submit(self._run, current_trace(), current_tenant(), fn, args, kwargs), timeout)
+
+    # Inicia etapa cujo resultado não é aguardado (ex.: indicador "digitando...")
+    def detach(self, name, fn, *args, **kwargs):
+        stage = self.submit(name, fn, *args, **kwargs)
+
+        def report(future):
+            error = future.exception()
+            if error is not None and self.on_error:
+                self.on_error(name, error)
+
+        stage.future.add_done_callback(report)
+        return stage
+
+    # Executa a etapa no pool, propagando o trace e o número atendido da thread que a submeteu
+    def _run(self, trace, tenant, fn, args, kwargs):
+        _local.inside = True
+        try:
+            with use_trace(trace), use_tenant(tenant):
+                return fn(*args, **kwargs)
+        finally:
+            _local.inside = False
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+    # Processo filho (fork): um executor já utilizado no processo pai não cria novas threads no filho
+    def _after_fork(self):
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="fanout")
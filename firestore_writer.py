@@ -0,0 +1,184 @@
+# Gravação assíncrona (write-behind) no Firestore
+# As gravações são acumuladas e enviadas em commits em lote (WriteBatch), ao atingir o tamanho máximo ou o intervalo de tempo.
+# flush() é o ponto de durabilidade: ao retornar, todas as gravações enfileiradas antes da chamada já foram confirmadas
+# (lança WriteError caso alguma tenha falhado). wait() confirma somente as gravações informadas (ex.: turno do usuário de um contato).
+# Um lote com falha é regravado documento a documento, de modo que um valor inválido não descarta as demais gravações do lote;
+# gravações com falha voltam para a fila e são descartadas após max_attempts tentativas
+import threading
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from lazy_init import on_fork, on_start
+
+MAX_BATCH_WRITES = 500                      # Limite de operações por commit do Firestore
+
+
+class WriteError(Exception):
+    pass
+
+
+# Gravação enfileirada: future concluído quando confirmada (ou descartada após a última tentativa)
+class Write:
+    __slots__ = ("operation", "doc_ref", "data", "merge", "future", "attempts")
+
+    def __init__(self, operation, doc_ref, data, merge=False):
+        self.operation = operation
+        self.doc_ref = doc_ref
+        self.data = data
+        self.merge = merge
+        self.future = Future()
+        self.attempts = 0
+
+
+class BufferedWriter:
+    def __init__(self, db, max_batch=400, flush_interval=0.5, max_attempts=3, wait_timeout=30):
+        self.db = db
+        self.max_batch = min(max_batch, MAX_BATCH_WRITES)
+        self.flush_interval = flush_interval        # Segundos entre commits automáticos (0 = grava imediatamente, sem buffer)
+        self.max_attempts = max_attempts            # Tentativas por gravação antes do descarte
+        self.wait_timeout = wait_timeout            # Segundos aguardando gravações em andamento em outra thread (wait)
+        self._pending = []                          # Write
+        self._lock = threading.Lock()
+        self._commit_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+        self.commits = 0
+        self.writes = 0
+        self.failures = 0
+        self.dropped = 0
+        self._thread = None
+        on_fork(self._after_fork)
+        if flush_interval > 0:
+            on_start(self.start)                    # Thread de gravação iniciada com o processo (antes disso, grava imediatamente)
+
+    def start(self):
+        if self._closed:
+            return
+        self._thread = threading.Thread(target=self._run, name="firestore-writer", daemon=True)
+        self._thread.start()
+
+    # Enfileira gravação. Retorna o future da gravação (ver wait)
+    def set(self, doc_ref, data, merge=False):
+        return self._add(Write("set", doc_ref, data, merge))
+
+    def update(self, doc_ref, data):
+        return self._add(Write("update", doc_ref, data))
+
+    def _add(self, write):
+        if not self._thread or self._closed:
+            self._commit([write])                   # Sem buffer: grava imediatamente (falha registrada no future)
+            return write.future
+        with self._lock:
+            self._pending.append(write)
+            full = len(self._pending) >= self.max_batch
+        if full:
+            self._wakeup.set()
+        return write.future
+
+    # Ponto de durabilidade: grava (na thread atual) tudo o que estiver pendente. Lança WriteError caso alguma gravação falhe
+    def flush(self):
+        errors = []
+        with self._commit_lock:
+            with self._lock:
+                writes, self._pending = self._pending, []
+            for start in range(0, len(writes), self.max_batch):
+                errors += self._commit(writes[start:start + self.max_batch])
+        if errors:
+            raise WriteError(f"{len(errors)} gravações no Firebase/FireStore falharam. Detalhes: {errors[0]}")
+
+    # Ponto de durabilidade de gravações específicas (futures retornados por set/update): grava somente essas, sem aguardar as demais
+    # Gravações já retiradas da fila por outra thread são aguardadas até wait_timeout. Lança WriteError caso alguma falhe
+    def wait(self, futures):
+        futures = [future for future in futures if not future.done()]
+        if futures:
+            selected = set(futures)
+            with self._lock:
+                writes = [write for write in self._pending if write.future in selected]
+                self._pending = [write for write in self._pending if write.future not in selected]
+            errors = self._commit(writes)
+            if errors:
+                raise WriteError(f"{len(errors)} gravações no Firebase/FireStore falharam. Detalhes: {errors[0]}")
+        for future in futures:
+            try:
+                future.result(self.wait_timeout)
+            except FutureTimeoutError:
+                raise WriteError(f"Gravação no Firebase/FireStore não confirmada em {self.wait_timeout}s") from None
+            except Exception as e:
+                raise WriteError(f"Gravação no Firebase/FireStore descartada. Detalhes: {e}") from e
+
+    def _run(self):
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Erro ao gravar lote no Firebase/FireStore. Detalhes: {e}")
+
+    # Grava o lote. Em caso de falha, regrava documento a documento. Retorna as exceções das gravações que falharam
+    def _commit(self, writes):
+        if not writes:
+            return []
+        try:
+            self._commit_batch(writes)
+            return []
+        except Exception as e:
+            if len(writes) == 1:
+                return self._failed(writes[0], e)
+        errors = []
+        for write in writes:
+            try:
+                self._commit_batch([write])
+            except Exception as e:
+                errors += self._failed(write, e)
+        return errors
+
+    def _commit_batch(self, writes):
+        batch = self.db.batch()
+        for write in writes:
+            if write.operation == "set":
+                batch.set(write.doc_ref, write.data, merge=write.merge)
+            else:
+                batch.update(write.doc_ref, write.data)
+        batch.commit()
+        self.commits += 1
+        self.writes += len(writes)
+        for write in writes:
+            write.future.set_result(None)
+
+    # Gravação com falha: volta para a fila (próximo commit) ou é descartada após a última tentativa
+    def _failed(self, write, error):
+        self.failures += 1
+        write.attempts += 1
+        if write.attempts >= self.max_attempts or not self._thread or self._closed:
+            self.dropped += 1
+            write.future.set_exception(error)
+            print(f"Gravação no Firebase/FireStore descartada após {write.attempts} tentativas. Detalhes: {error}")
+        else:
+            with self._lock:
+                self._pending.insert(0, write)
+        return [error]
+
+    # Encerramento: grava pendências e passa a gravar imediatamente
+    def close(self):
+        self._closed = True
+        self._wakeup.set()
+        try:
+            self.flush()
+        except WriteError as e:
+            print(f"Erro ao gravar pendências no Firebase/FireStore. Detalhes: {e}")
+
+    # Processo filho (fork): a thread de gravação não existe no filho (iniciada com o processo). Pendências pertencem ao processo pai
+    def _after_fork(self):
+        self._pending = []
+        self._lock = threading.Lock()
+        self._commit_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    # Métricas do buffer de gravação
+    def stats(self):
+        with self._lock:
+            pending = len(self._pending)
+        return {"pending": pending, "commits": self.commits, "writes": self.writes, "failures": self.failures, "dropped": self.dropped}
+
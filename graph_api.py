@@ -0,0 +1,120 @@
+# Cliente HTTP compartilhado para a WhatsApp Cloud API (Graph API)
+# Mantém conexões keep-alive num pool, aplica timeouts por chamada e repete requisições com status 429/5xx (backoff exponencial com jitter)
+import random
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from circuit_breaker import CircuitOpenError
+from telemetry import count_graph_request
+
+RETRY_STATUS = frozenset((429, 500, 502, 503, 504))     # Status HTTP que justificam nova tentativa
+
+
+# Circuito da Graph API aberto: falha imediata, tratada pelos chamadores como falha de conexão (RequestException)
+class GraphApiUnavailableError(CircuitOpenError, requests.exceptions.ConnectionError):
+    pass
+
+
+class GraphApiClient:
+    def __init__(self, url_base, id_tel, token, pool_size=20, connect_timeout=3.05, read_timeout=20, max_retries=3, backoff=0.5, breaker=None):
+        self.url_base = url_base
+        self.breaker = breaker                      # CircuitBreaker opcional: 5xx e falhas de conexão contam como falha
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+
+        # URLs e headers pré-calculados
+        self.messages_url = f"{url_base}/{id_tel}/messages"
+        self.auth_headers = {"Authorization": f"Bearer {token}"}
+        self.json_headers = {"Content-Type": "application/json", "Authorization": f"Bearer {token}"}
+
+        # Pool de conexões keep-alive (as repetições são tratadas em request(), por isso max_retries=0 no adapter)
+        # pool_size deve acompanhar as threads que usam o cliente simultaneamente; conexões além do pool são abertas e descartadas a cada chamada
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0, pool_block=False)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    # Executa requisição com timeout e novas tentativas para status 429/5xx e falhas de conexão
+    def request(self, method, url, max_retries=None, endpoint="other", **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        max_retries = self.max_retries if max_retries is None else max_retries
+        attempt = 0
+        while True:
+            self._acquire()
+            start = time.perf_counter()
+            recorded = False                        # Toda tentativa registra o resultado no circuito (libera a vaga de teste no estado semiaberto)
+            try:
+                response = self.session.request(method, url, **kwargs)
+                count_graph_request(endpoint, response.status_code, time.perf_counter() - start)     # Métricas por tentativa (inclusive 429/5xx)
+                recorded = True
+                self._record(response.status_code >= 500, time.perf_counter() - start)
+                if response.status_code not in RETRY_STATUS or attempt >= max_retries:
+                    return response
+                delay = self._retry_after(response)
+                response.close()
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if not recorded:
+                    count_graph_request(endpoint, "error", time.perf_counter() - start)
+                    self._record(True, time.perf_counter() - start)
+                if attempt >= max_retries:
+                    raise
+                delay = None
+            except BaseException:
+                if not recorded:                    # Demais falhas (ex.: ChunkedEncodingError, TooManyRedirects) também contam como falha
+                    count_graph_request(endpoint, "error", time.perf_counter() - start)
+                    self._record(True, time.perf_counter() - start)
+                raise
+            if delay is None:
+                delay = random.uniform(0, self.backoff * (2 ** attempt))   # Jitter ("full jitter") para não sincronizar as novas tentativas
+            time.sleep(delay)
+            attempt += 1
+
+    # Reserva tentativa no circuito (falha imediata com o circuito aberto)
+    def _acquire(self):
+        if self.breaker is None:
+            return
+        try:
+            self.breaker.acquire()
+        except CircuitOpenError as e:
+            raise GraphApiUnavailableError(str(e)) from None
+
+    def _record(self, failed, elapsed):
+        if self.breaker is not None:
+            self.breaker.record(failed, elapsed)
+
+    # Respeita o header Retry-After, quando informado
+    def _retry_after(self, response):
+        value = response.headers.get("Retry-After")
+        if value and value.isdigit():
+            return float(value)
+        return None
+
+    # Envia mensagem (texto, template, etc) através do endpoint /{ID_TEL}/messages
+    # max_retries=0 quando as novas tentativas são controladas pelo chamador (ex.: OutboundDispatcher)
+    # sender: número remetente (messages_url/json_headers próprios, ex.: Tenant). None = número informado na criação do cliente
+    def send_message(self, data, max_retries=None, sender=None):
+        sender = sender or self
+        return self.request("POST", sender.messages_url, max_retries=max_retries, endpoint="messages", headers=sender.json_headers, json=data)
+
+    # Marca mensagem recebida como lida (confirmação de leitura), exibindo opcionalmente o indicador "digitando..."
+    def mark_read(self, message_id, typing=True, sender=None):
+        sender = sender or self
+        data = {
+            "messaging_product": "whatsapp",
+            "status": "read",
+            "message_id": message_id
+        }
+        if typing:
+            data["typing_indicator"] = {"type": "text"}
+        return self.request("POST", sender.messages_url, endpoint="mark_read", headers=sender.json_headers, json=data)
+
+    # Obtem URL e mime_type de uma mídia a partir de seu ID
+    def get_media_info(self, id_media, sender=None):
+        return self.request("GET", f"{self.url_base}/{id_media}", endpoint="media_info", headers=(sender or self).auth_headers)
+
+    # Realiza o download de uma mídia (protegida por token)
+    def download(self, url_media, stream=False, sender=None):
+        return self.request("GET", url_media, endpoint="media_download", headers=(sender or self).auth_headers, stream=stream)
@@ -0,0 +1,8 @@
+# Configuração do gunicorn (carregada automaticamente do diretório de trabalho)
+# As threads em segundo plano do webhook (gravação em lote, ACKs, respostas pendentes, pool de workers, recarga do cadastro) e a
+# pré-carga dos clientes são iniciadas em cada worker após o fork, nunca no processo mestre (inclusive com --preload)
+
+
+def post_worker_init(worker):
+    import lazy_init
+    lazy_init.start()
@@ -0,0 +1,328 @@
+# Histórico de conversas (Firestore) utilizado para contextualizar a IA
+# Carrega somente a janela mais recente da conversa (limite de turnos e de tokens) e mantém um resumo incremental dos turnos mais antigos
+# A janela de cada contato fica em cache (LRU/TTL) atualizado a cada gravação (write-through); o Firestore só é lido em caso de falha no cache
+# Armazenamento em blocos: os turnos de cada contato são agrupados em documentos "history/{tel}/chunks/{bloco}" com até chunk_size turnos
+# numerados (seq) e até chunk_max_bytes (estimados) por bloco, mantendo cada documento abaixo do limite de 1 MiB do Firestore. A gravação acrescenta o turno ao último bloco (ArrayUnion, sem leitura) e a janela recente é lida numa única consulta
+# (últimos blocos), independente do tamanho do histórico.
+# Históricos no formato anterior (coleção "message_history_{tel}", um documento por turno) são migrados na primeira leitura do contato
+# ou em lote (migrate_all)
+import threading
+import time
+from concurrent.futures import Future
+
+from ttl_cache import TTLCache
+
+SUMMARY_COLLECTION = "history_summaries"
+HISTORY_COLLECTION = "history"
+CHUNKS_COLLECTION = "chunks"
+LEGACY_COLLECTION = "message_history_"             # Formato anterior: uma coleção por contato, um documento por turno
+MIGRATION_COLLECTION = "history_migration"         # Documento "legacy": {"done": True} após migrate_all (dispensa a verificação do formato anterior)
+MIGRATION_BATCH = 400                               # Operações por commit na migração (máx. 500)
+TURN_OVERHEAD_BYTES = 64                            # Estimativa dos campos fixos de um turno (seq, timestamp, role) no documento
+CHARS_PER_TOKEN = 4                                 # Estimativa de caracteres por token (evita chamar count_tokens a cada mensagem)
+
+
+class ConversationHistory:
+    def __init__(self, db, max_turns=40, token_budget=8000, summary_batch=20, summarize=None, schedule=None,
+                 cache_items=2000, cache_ttl=900, cache_max_chars=50_000_000, writer=None, cache=None, chunk_size=50,
+                 chunk_max_bytes=512_000, prune_legacy=False, max_unsummarized=None, on_error=None):
+        self.db = db
+        self.writer = writer                        # BufferedWriter (write-behind). None = grava imediatamente
+        self.chunk_size = chunk_size                # Turnos por documento (bloco)
+        self.chunk_max_bytes = chunk_max_bytes      # Tamanho estimado por documento (bloco). Limite de 1 MiB por documento do Firestore
+        self.prune_legacy = prune_legacy            # Exclui o histórico no formato anterior após a migração
+        self.max_turns = max_turns                  # Turnos mais recentes enviados à IA
+        self.token_budget = token_budget            # Limite (estimado) de tokens do histórico enviado à IA
+        self.summary_batch = summary_batch          # Turnos antigos acumulados antes de atualizar o resumo
+        self.summarize = summarize                  # Função (resumo_anterior, turnos) => novo resumo. None = sem resumo
+        self.schedule = schedule                    # Função para executar a atualização do resumo em segundo plano. None = executa na própria thread
+        self.on_error = on_error                    # Função (tel, erro) chamada quando a atualização do resumo falha. None = imprime o erro
+        # Turnos ainda não resumidos mantidos no cache e na leitura: enquanto o resumo falha, os turnos excedentes à janela continuam
+        # disponíveis para a próxima tentativa (o limite protege a memória caso a falha persista)
+        self.max_unsummarized = max_unsummarized or max_turns + summary_batch * (4 if summarize else 1)
+        self._refreshing = set()
+        self._fetching = {}                         # tel => Future da leitura em andamento
+        self._writes = {}                           # tel => futures das gravações ainda não confirmadas (BufferedWriter)
+        self._legacy = None                         # Históricos no formato anterior ainda não migrados (None = não verificado)
+        self._lock = threading.Lock()
+        # Cache por contato: {"summary": {...}, "turns": [...], "last_seq": n, "tail": (bloco, turnos no bloco, bytes no bloco)}
+        # TTL limita a defasagem caso outra instância grave no mesmo histórico
+        # Um cache informado (ex.: ScopedCache de um cache compartilhado entre números) substitui o cache próprio
+        self.cache = cache if cache is not None else new_cache(cache_items, cache_ttl, cache_max_chars)
+
+    def chunks(self, tel):
+        return self.db.collection(HISTORY_COLLECTION).document(tel).collection(CHUNKS_COLLECTION)
+
+    def legacy_collection(self, tel):
+        return self.db.collection(f"{LEGACY_COLLECTION}{tel}")
+
+    # Salva turno da conversa (Firestore + cache): acrescentado ao último bloco do contato, sem leitura caso o histórico esteja em cache
+    def append(self, tel, role, message):
+        entry = self._entry(tel)                    # Próximo seq e último bloco
+        with self._lock:
+            entry = self.cache.get(tel) or entry
+            chunk, count, size = entry["tail"]
+            turn = {
+                "seq": entry["last_seq"] + 1,
+                "timestamp": int(time.time()),
+                "role": role,
+                "parts": [message]
+            }
+            turn_size = _turn_bytes(turn)
+            if count and self._chunk_full(count, size + turn_size):
+                chunk, count, size = chunk + 1, 0, 0
+            turns = entry["turns"] + [turn]
+            self.cache.set(tel, {"summary": entry["summary"], "turns": turns[-self.max_unsummarized:],
+                                 "last_seq": turn["seq"], "tail": (chunk, count + 1, size + turn_size)})
+        from google.cloud.firestore_v1 import ArrayUnion
+        data = {"chunk": chunk, "turns": ArrayUnion([turn]), "timestamp": turn["timestamp"]}
+        doc_ref = self.chunks(tel).document(f"{chunk:08d}")
+        if not self.writer:
+            doc_ref.set(data, merge=True)
+            return
+        future = self.writer.set(doc_ref, data, merge=True)
+        with self._lock:
+            self._writes.setdefault(tel, []).append(future)
+        future.add_done_callback(lambda done: self._forget(tel, done))
+
+    # Bloco excede o limite de turnos ou de tamanho (novo turno vai para o próximo bloco)
+    def _chunk_full(self, count, size):
+        return count >= self.chunk_size or (self.chunk_max_bytes and size > self.chunk_max_bytes)
+
+    def _forget(self, tel, future):
+        with self._lock:
+            writes = self._writes.get(tel, [])
+            if future in writes:
+                writes.remove(future)
+            if not writes:
+                self._writes.pop(tel, None)
+
+    # Ponto de durabilidade do contato: confirma somente as gravações pendentes do histórico do contato (lança WriteError em caso de falha)
+    def flush(self, tel):
+        with self._lock:
+            writes = list(self._writes.get(tel, []))
+        if writes:
+            self.writer.wait(writes)
+
+    # Obtem histórico para a IA: resumo dos turnos antigos + janela de turnos recentes ainda não resumidos
+    def load(self, tel):
+        entry = self._entry(tel)
+        summary = entry["summary"]
+        turns = entry["turns"]
+
+        # Turnos excedentes à janela formam um lote completo => atualiza o resumo (inclui turnos de tentativas anteriores que falharam)
+        overflow = turns[:-self.max_turns] if len(turns) > self.max_turns else []
+        if self.summarize and len(overflow) >= self.summary_batch:
+            self._schedule_refresh(tel, summary.get("summary", ""), overflow)
+
+        history = [{"role": turn["role"], "parts": turn["parts"]} for turn in turns[-(self.max_turns + self.summary_batch):]]
+        history = self._apply_token_budget(history)
+
+        if summary.get("summary"):
+            history = [
+                {"role": "user", "parts": [f"Resumo da nossa conversa até aqui: {summary['summary']}"]},
+                {"role": "model", "parts": ["Ok, vou considerar este resumo."]},
+            ] + history
+        return history
+
+    # Entrada do contato (cache ou Firestore). Leituras simultâneas do mesmo contato (ex.: load e append em paralelo) compartilham a consulta
+    def _entry(self, tel):
+        entry = self.cache.get(tel)
+        if entry is not None:
+            return entry
+        with self._lock:
+            future = self._fetching.get(tel)
+            owner = future is None
+            if owner:
+                future = self._fetching[tel] = Future()
+        if not owner:
+            return future.result()
+        try:
+            entry = self._fetch(tel)
+            with self._lock:
+                self.cache.add(tel, entry)          # Não sobrescreve entrada gravada por append concorrente
+            future.set_result(entry)
+            return entry
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._fetching.pop(tel, None)
+
+    # Lê do Firestore o resumo e os turnos mais recentes ainda não resumidos (até max_unsummarized)
+    # Duas leituras: documento do resumo + consulta aos últimos blocos (o bloco final pode estar incompleto)
+    # Blocos encerrados pelo tamanho têm menos turnos: a janela lida pode ser menor, mas turnos desse porte já excedem o limite de tokens
+    def _fetch(self, tel):
+        summary = self._get_summary(tel)
+        limit = self.max_unsummarized
+        docs = self.chunks(tel).order_by("chunk", direction="DESCENDING").limit(limit // self.chunk_size + 2).stream()
+        chunks = [doc.to_dict() for doc in docs]
+        if not chunks and self._legacy_pending():
+            chunks = self._migrate(tel)
+        chunks.sort(key=lambda chunk: chunk["chunk"])
+
+        turns = sorted((turn for chunk in chunks for turn in chunk["turns"]), key=lambda turn: (turn["seq"], turn["timestamp"]))
+        last_seq = turns[-1]["seq"] if turns else -1
+        tail = (chunks[-1]["chunk"], len(chunks[-1]["turns"]), sum(map(_turn_bytes, chunks[-1]["turns"]))) if chunks else (0, 0, 0)
+        return {"summary": summary, "turns": _unsummarized(summary, turns)[-limit:], "last_seq": last_seq, "tail": tail}
+
+    # Verifica (uma vez por instância) se a migração em lote já foi concluída
+    def _legacy_pending(self):
+        if self._legacy is None:
+            doc = self.db.collection(MIGRATION_COLLECTION).document("legacy").get()
+            self._legacy = not (doc.exists and doc.get("done"))
+        return self._legacy
+
+    # Migração do formato anterior (um documento por turno): turnos numerados em ordem cronológica e gravados em blocos
+    # Os blocos são criados (create) em lote: caso outra instância já tenha migrado o contato, o lote falha e os blocos existentes são lidos
+    # Retorna os blocos do contato (vazio = sem histórico)
+    def _migrate(self, tel):
+        from google.api_core.exceptions import AlreadyExists
+        docs = list(self.legacy_collection(tel).order_by("timestamp").stream())
+        if not docs:
+            return []
+        turns = []
+        for seq, doc in enumerate(docs):
+            message_dict = doc.to_dict()
+            turns.append({"seq": seq, "timestamp": message_dict["timestamp"], "role": message_dict["role"], "parts": message_dict["parts"]})
+        chunks = []
+        chunk_turns, size = [], 0
+        for turn in turns:
+            turn_size = _turn_bytes(turn)
+            if chunk_turns and self._chunk_full(len(chunk_turns), size + turn_size):
+                chunks.append({"chunk": len(chunks), "turns": chunk_turns, "timestamp": chunk_turns[-1]["timestamp"]})
+                chunk_turns, size = [], 0
+            chunk_turns.append(turn)
+            size += turn_size
+        chunks.append({"chunk": len(chunks), "turns": chunk_turns, "timestamp": chunk_turns[-1]["timestamp"]})
+        try:
+            for start in range(0, len(chunks), MIGRATION_BATCH):
+                batch = self.db.batch()
+                for chunk in chunks[start:start + MIGRATION_BATCH]:
+                    batch.create(self.chunks(tel).document(f"{chunk['chunk']:08d}"), chunk)
+                batch.commit()
+        except AlreadyExists:
+            return [doc.to_dict() for doc in self.chunks(tel).stream()]
+        if self.prune_legacy:
+            for start in range(0, len(docs), MIGRATION_BATCH):
+                batch = self.db.batch()
+                for doc in docs[start:start + MIGRATION_BATCH]:
+                    batch.delete(doc.reference)
+                batch.commit()
+        return chunks
+
+    # Migra todos os contatos ainda no formato anterior (ex.: em segundo plano após a implantação). Retorna a quantidade migrada
+    # Ao final, registra a conclusão: instâncias iniciadas depois deixam de consultar o formato anterior para contatos sem blocos
+    def migrate_all(self):
+        prefix = self.legacy_collection("").id      # Nome da coleção com o prefixo do número (multi-tenant)
+        migrated = 0
+        for collection in self.db.collections():
+            if not collection.id.startswith(prefix):
+                continue
+            tel = collection.id[len(prefix):]
+            if tel and not list(self.chunks(tel).limit(1).stream()) and self._migrate(tel):
+                migrated += 1
+        self.db.collection(MIGRATION_COLLECTION).document("legacy").set({"done": True, "migrated": migrated, "timestamp": int(time.time())})
+        self._legacy = False
+        return migrated
+
+    def _apply_token_budget(self, history):
+        return apply_token_budget(history, self.token_budget)
+
+    def _get_summary(self, tel):
+        doc = self.db.collection(SUMMARY_COLLECTION).document(tel).get()
+        if doc.exists:
+            return doc.to_dict()
+        return {}
+
+    def _schedule_refresh(self, tel, previous_summary, turns):
+        with self._lock:
+            if tel in self._refreshing:             # Atualização já em andamento para este contato
+                return
+            self._refreshing.add(tel)
+        if not self.schedule:
+            self._refresh_summary(tel, previous_summary, turns)
+            return
+        try:
+            self.schedule(self._refresh_summary, tel, previous_summary, turns)
+        except Exception as e:                      # Ex.: executor encerrado. Nova tentativa na próxima leitura
+            with self._lock:
+                self._refreshing.discard(tel)
+            self._report(tel, e)
+
+    # Atualiza o resumo incrementalmente: resumo anterior + turnos antigos => novo resumo
+    # Em caso de falha, os turnos permanecem no cache (não resumidos) e a atualização é tentada novamente na próxima leitura
+    def _refresh_summary(self, tel, previous_summary, turns):
+        try:
+            summary = {
+                "summary": self.summarize(previous_summary, turns),
+                "summarized_until": turns[-1]["timestamp"],
+                "summarized_seq": turns[-1]["seq"],
+                "timestamp": int(time.time())
+            }
+            self.db.collection(SUMMARY_COLLECTION).document(tel).set(summary)
+            with self._lock:
+                entry = self.cache.get(tel)
+                if entry is not None:
+                    self.cache.set(tel, {**entry, "summary": summary, "turns": _unsummarized(summary, entry["turns"])})
+        except Exception as e:
+            self._report(tel, e)
+        finally:
+            with self._lock:
+                self._refreshing.discard(tel)
+
+    def _report(self, tel, error):
+        if self.on_error:
+            self.on_error(tel, error)
+        else:
+            print(f"Erro ao atualizar o resumo do histórico ({tel}): {error}")
+
+    # Métricas do cache de históricos
+    def cache_stats(self):
+        return self.cache.stats()
+
+
+# Cache de históricos limitado por quantidade de contatos e caracteres (pode ser compartilhado entre números via ScopedCache)
+def new_cache(cache_items=2000, cache_ttl=900, cache_max_chars=50_000_000):
+    return TTLCache(max_items=cache_items, ttl=cache_ttl, max_weight=cache_max_chars, weigh=_entry_chars)
+
+
+# Turnos posteriores ao resumo. Resumos anteriores aos blocos (sem summarized_seq) são comparados pelo timestamp
+# (turnos do mesmo segundo do fim do resumo são mantidos, evitando perda)
+def _unsummarized(summary, turns):
+    if "summarized_seq" in summary:
+        return [turn for turn in turns if turn["seq"] > summary["summarized_seq"]]
+    summarized_until = summary.get("summarized_until", 0)
+    return [turn for turn in turns if turn["timestamp"] >= summarized_until]
+
+
+# Remove os turnos mais antigos até que o histórico caiba no limite de tokens (0 = sem limite)
+# Aceita turnos em dicionário ({"role", "parts"}) ou o histórico de uma sessão de chat do Gemini (Content)
+def apply_token_budget(history, token_budget):
+    if not token_budget:
+        return history
+    sizes = [sum(len(str(part)) for part in _parts(turn)) // CHARS_PER_TOKEN + 1 for turn in history]
+    total = sum(sizes)
+    start = 0
+    while total > token_budget and start < len(history) - 1:
+        total -= sizes[start]
+        start += 1
+    return history[start:]
+
+
+def _parts(turn):
+    return turn["parts"] if isinstance(turn, dict) else turn.parts
+
+
+# Tamanho estimado (bytes UTF-8) de um turno gravado no bloco
+def _turn_bytes(turn):
+    return sum(len(str(part).encode()) for part in turn["parts"]) + TURN_OVERHEAD_BYTES
+
+
+# Peso (em caracteres) de uma entrada do cache, para limitar a memória ocupada
+def _entry_chars(entry):
+    chars = len(entry["summary"].get("summary", ""))
+    for turn in entry["turns"]:
+        chars += sum(len(str(part)) for part in turn["parts"]) + 64
+    return chars
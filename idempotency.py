@@ -0,0 +1,47 @@
+# Controle de duplicidade (idempotência) das mensagens e mídias recebidas da WhatsApp Cloud API
+# O documento é identificado pelo próprio ID da mensagem/mídia e reservado com create() atômico (falha caso já exista):
+# verificação + gravação numa única chamada, sem janela de concorrência. IDs recentes ficam em cache local (zero chamadas)
+# Expiração no Firestore: configurar política de TTL no campo "expire_at" da coleção, ex.:
+#   gcloud firestore fields ttls update expire_at --collection-group=id_text --enable-ttl
+import datetime
+
+
+from ttl_cache import TTLCache
+
+
+class IdempotencyStore:
+    def __init__(self, db, collection, field, ttl=7 * 24 * 3600, cache_items=50000, cache_ttl=3600):
+        self.db = db
+        self.collection = collection
+        self.field = field                          # Nome do campo com o ID original (mantém o formato dos documentos existentes)
+        self.ttl = ttl                              # Segundos até a expiração do registro no Firestore
+        self.recent = TTLCache(max_items=cache_items, ttl=cache_ttl)
+
+    # Reserva o ID. Retorna True caso seja a primeira ocorrência (deve ser processado) e False caso seja duplicado
+    def claim(self, key):
+        from google.api_core.exceptions import AlreadyExists
+        if not self.recent.add(key, True):
+            return False
+        now = datetime.datetime.now(datetime.timezone.utc)
+        try:
+            self.db.collection(self.collection).document(_doc_id(key)).create({
+                "timestamp": int(now.timestamp()),
+                self.field: key,
+                "expire_at": now + datetime.timedelta(seconds=self.ttl)
+            })
+            return True
+        except AlreadyExists:
+            return False
+        except Exception:
+            self.recent.pop(key)                    # Falha na gravação: permite nova tentativa
+            raise
+
+    # Libera o ID reservado (ex.: falha no processamento), permitindo que um reenvio da WhatsApp Cloud API seja processado
+    def release(self, key):
+        self.recent.pop(key)
+        self.db.collection(self.collection).document(_doc_id(key)).delete()
+
+
+# IDs da WhatsApp Cloud API (base64) podem conter "/", caractere não permitido em IDs de documento
+def _doc_id(key):
+    return key.replace("/", "_")
@@ -0,0 +1,125 @@
+# Inicialização preguiçosa (lazy) dos clientes de maior custo (Gemini, Firebase, Cloud Storage) e ciclo de vida do processo
+# O cliente só é construído no primeiro uso (uma única vez, mesmo com várias threads) e, após fork do processo
+# (ex.: gunicorn --preload), é reconstruído no processo filho: conexões gRPC/HTTP não são compartilhadas entre processos.
+# Bibliotecas de maior custo de importação (google.cloud.*, google.api_core, google.generativeai) são importadas dentro das
+# funções que as utilizam, fora da inicialização.
+# Threads em segundo plano (gravação em lote, recarga do cadastro, pré-carga...) são registradas em on_start e iniciadas por start(),
+# uma vez por processo: após o fork (gunicorn post_worker_init) ou na primeira requisição. O processo mestre (gunicorn --preload)
+# não inicia threads nem executores, que não sobrevivem ao fork. on_fork registra a limpeza do estado herdado pelo processo filho
+import os
+import threading
+import time
+
+_UNSET = object()
+_instances = []                                     # Instâncias registradas (reiniciadas no processo filho após fork)
+_fork_callbacks = []                                # Executados no processo filho após fork
+_start_callbacks = []                               # Executados uma vez por processo, em start()
+_start_lock = threading.RLock()
+_started_pid = None                                 # Processo em que start() já foi executado
+build_times = {}                                    # Nome => segundos gastos na construção (relatório de inicialização)
+
+
+class Lazy:
+    def __init__(self, name, factory):
+        self._name = name
+        self._factory = factory                     # Função sem argumentos que constrói o cliente
+        self._value = _UNSET
+        self._lock = threading.Lock()
+        _instances.append(self)
+
+    # Retorna o cliente, construindo-o no primeiro acesso
+    def get(self):
+        value = self._value
+        if value is not _UNSET:
+            return value
+        with self._lock:
+            if self._value is _UNSET:
+                start = time.perf_counter()
+                self._value = self._factory()
+                build_times[self._name] = time.perf_counter() - start
+            return self._value
+
+    def initialized(self):
+        return self._value is not _UNSET
+
+    # Descarta o cliente (o próximo acesso constrói novamente)
+    def reset(self):
+        self._lock = threading.Lock()               # Lock possivelmente herdado em uso por outra thread do processo pai
+        self._value = _UNSET
+
+    # Substitui o cliente por uma instância já construída (ex.: substitutos locais no benchmark)
+    def set(self, value):
+        with self._lock:
+            self._value = value
+
+    # Acesso transparente aos atributos do cliente (ex.: db.collection(...), model.generate_content(...))
+    def __getattr__(self, attr):
+        return getattr(self.get(), attr)
+
+    def __repr__(self):
+        return f"<Lazy {self._name} ({'pronto' if self.initialized() else 'pendente'})>"
+
+
+# Registra callback executado no processo filho após fork (ex.: descartar locks, filas e threads herdados do processo pai)
+def on_fork(callback):
+    _fork_callbacks.append(callback)
+
+
+# Registra callback executado uma vez por processo em start(). Processo já iniciado: executado imediatamente
+def on_start(callback):
+    with _start_lock:
+        _start_callbacks.append(callback)
+        started = _started_pid == os.getpid()
+    if started:
+        callback()
+
+
+# Inicia as threads em segundo plano do processo atual (somente na primeira chamada de cada processo)
+def start():
+    global _started_pid
+    if _started_pid == os.getpid():
+        return
+    with _start_lock:
+        if _started_pid == os.getpid():
+            return
+        index = 0
+        while index < len(_start_callbacks):       # Callbacks registrados durante a execução também são executados
+            _start_callbacks[index]()
+            index += 1
+        _started_pid = os.getpid()
+
+
+# Constrói os clientes em segundo plano (ao iniciar o processo), sem bloquear a inicialização do servidor
+def warm_up(*lazies, on_error=None, on_done=None):
+    on_start(lambda: _start_warm_up(lazies, on_error, on_done))
+
+
+def _start_warm_up(lazies, on_error=None, on_done=None):
+    def run():
+        for lazy in lazies:
+            try:
+                lazy.get()
+            except Exception as e:
+                if on_error:
+                    on_error(lazy, e)
+                else:
+                    print(f"Falha na pré-carga de {lazy!r}. Detalhes: {e}")
+        if on_done:
+            on_done()
+
+    threading.Thread(target=run, name="lazy-warm-up", daemon=True).start()
+
+
+# Processo filho (fork): descarta os clientes herdados e o estado registrado pelos módulos (on_fork)
+# As threads são iniciadas novamente por start() no processo filho
+def _after_fork():
+    global _start_lock
+    _start_lock = threading.RLock()
+    for lazy in _instances:
+        lazy.reset()
+    for callback in _fork_callbacks:
+        callback()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork)
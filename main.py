@@ -1,13 +1,38 @@
 # Carrega bibliotecas 
+import startup_profile                                      # Deve ser o primeiro import (mede o custo de importação dos demais módulos)
 from flask import Flask, request, jsonify
 import os
+import tempfile
+import atexit
 import requests
 import time
-import google.generativeai as genai
-from google.cloud import storage 
-import firebase_admin
-from firebase_admin import credentials, firestore
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
 from dotenv import load_dotenv
+from worker_pool import WorkerPool
+from contact_lanes import ContactLanes
+from graph_api import GraphApiClient
+from media_store import read_media
+from media_index import MediaIndex, content_hash, new_cache as new_media_cache
+from audio_segments import split_opus
+from history import ConversationHistory, new_cache as new_history_cache
+from idempotency import IdempotencyStore
+from firestore_writer import BufferedWriter
+from chat_sessions import ChatSessionManager, ContextCachedModel
+from reply_stream import reply_segments
+from dispatcher import OutboundDispatcher, PRIORITY_REPLY
+from broadcast import CampaignBroadcaster, pause_on_quality_drop
+from status_pipeline import StatusPipeline
+from contacts import ContactRepository
+from fanout import FanOut, StageTimeoutError
+from circuit_breaker import CircuitBreaker, CircuitOpenError, CLOSED
+from pending_replies import PendingReplies
+from tenants import TenantRegistry, TenantsFile, current_tenant, use_tenant
+from ttl_cache import TTLCache, ScopedCache
+import telemetry
+from lazy_init import Lazy, warm_up, build_times, on_fork, on_start, start as start_process
+from payload_parser import PayloadRouter, loads, MessageEvent, StatusEvent, TemplateStatusEvent, TemplateQualityEvent
 load_dotenv()  
 
 #region - Variáveis de ambiente
@@ -15,11 +40,98 @@ my_api_key = os.environ.get("API_KEY")                        # Gemini - API_KEY
 system_instruction = os.environ.get("SYSTEM_INSTRUCTIONS")    # Gemini - Instruções do Sistema / Informa as caracteristicas do Assistente.
 url_base = os.environ.get("URL_BASE")                         # WhatsApp Cloud API - URL base da API (incluindo versão)
 token = os.environ.get("TOKEN")                               # WhatsApp Cloud API - Token de segurança para acesso às mensagens 
+id_tel = os.environ.get("ID_TEL")                             # WhatsApp Cloud API - ID do número de telefone (phone_number_id) atendido por este webhook
 audio_bucket_name = os.environ.get("AUDIO_BUCKET_NAME")       # Google Cloud Storage - Nome do Bucket para armazenamento de AUDIOS
 image_bucket_name = os.environ.get("IMAGE_BUCKET_NAME")       # Google Cloud Storage - Nome do Bucket para armazenamento de IMAGENS
 path_credential = os.environ.get("PATH_FB_CREDENTIAL")        # Path para JSON contendo Google Firebase Admin SDK - Credencial acesso
 path_audio_messages = os.environ.get("PATH_AUDIO_MESSAGES")   # Path para armazenamento de arquivos de audio
 path_image_messages = os.environ.get("PATH_IMAGE_MESSAGES")   # Path para armazenamento de imagens
+processing_mode = os.environ.get("PROCESSING_MODE", "sync")   # "sync" = processa dentro da requisição / "async" = enfileira e responde 200 imediatamente (exige CPU sempre alocada no Cloud Run)
+worker_pool_size = int(os.environ.get("WORKER_POOL_SIZE", 32))        # Quantidade de workers em segundo plano (modo async)
+worker_queue_limit = int(os.environ.get("WORKER_QUEUE_LIMIT", 1000))  # Profundidade máxima da fila de notificações (modo async)
+worker_drain_timeout = int(os.environ.get("WORKER_DRAIN_TIMEOUT", 30))  # Segundos aguardando esvaziamento da fila no encerramento
+graph_pool_size = int(os.environ.get("GRAPH_POOL_SIZE", 0))          # WhatsApp Cloud API - Conexões keep-alive mantidas no pool HTTP (0 = OUTBOUND_WORKERS por número + FANOUT_WORKERS + CONTACT_LANE_WORKERS)
+graph_timeout = float(os.environ.get("GRAPH_TIMEOUT", 20))            # WhatsApp Cloud API - Timeout (segundos) de leitura por chamada
+graph_max_retries = int(os.environ.get("GRAPH_MAX_RETRIES", 3))       # WhatsApp Cloud API - Novas tentativas em caso de 429/5xx
+history_max_turns = int(os.environ.get("HISTORY_MAX_TURNS", 40))         # Histórico - Turnos mais recentes enviados à IA
+history_token_budget = int(os.environ.get("HISTORY_TOKEN_BUDGET", 8000))  # Histórico - Limite (estimado) de tokens do histórico enviado à IA (0 = sem limite)
+history_summary_batch = int(os.environ.get("HISTORY_SUMMARY_BATCH", 20))  # Histórico - Turnos antigos acumulados antes de atualizar o resumo da conversa (0 = sem resumo)
+history_cache_items = int(os.environ.get("HISTORY_CACHE_ITEMS", 2000))  # Histórico - Contatos mantidos no cache em memória (LRU)
+history_cache_ttl = int(os.environ.get("HISTORY_CACHE_TTL", 900))       # Histórico - Segundos até expirar o histórico em cache
+history_chunk_size = int(os.environ.get("HISTORY_CHUNK_SIZE", 50))      # Histórico - Turnos por documento (bloco) do histórico no Firestore
+history_chunk_max_bytes = int(os.environ.get("HISTORY_CHUNK_MAX_BYTES", 512_000))  # Histórico - Tamanho estimado por bloco antes de iniciar outro (limite de 1 MiB por documento)
+history_migrate_on_start = os.environ.get("HISTORY_MIGRATE_ON_START", "0") == "1"  # Histórico - Migra em segundo plano os históricos no formato anterior (message_history_{tel}) ao iniciar
+history_prune_legacy = os.environ.get("HISTORY_PRUNE_LEGACY", "0") == "1"          # Histórico - Exclui o histórico no formato anterior após a migração
+idempotency_ttl = int(os.environ.get("IDEMPOTENCY_TTL", 7 * 24 * 3600))  # Segundos até expirar (TTL do Firestore) os IDs de mensagens/mídias recebidas
+contact_cache_items = int(os.environ.get("CONTACT_CACHE_ITEMS", 5000))  # Contatos - Quantidade mantida no cache em memória (LRU)
+contact_cache_ttl = int(os.environ.get("CONTACT_CACHE_TTL", 900))       # Contatos - Segundos até expirar o contato em cache
+firestore_batch_size = int(os.environ.get("FIRESTORE_BATCH_SIZE", 400))          # Firestore - Gravações por commit em lote (máx. 500)
+firestore_flush_interval = float(os.environ.get("FIRESTORE_FLUSH_INTERVAL", 0.5)) # Firestore - Segundos entre commits em lote (0 = grava imediatamente)
+chat_max_sessions = int(os.environ.get("CHAT_MAX_SESSIONS", 1000))      # Gemini - Sessões de chat mantidas em memória (LRU)
+chat_idle_ttl = int(os.environ.get("CHAT_IDLE_TTL", 1800))              # Gemini - Segundos de inatividade até descartar a sessão do contato
+context_cache_model = os.environ.get("CONTEXT_CACHE_MODEL", "")         # Gemini - Modelo com versão fixa para cache de contexto das instruções do sistema (ex.: models/gemini-1.5-pro-001). Vazio = desabilitado
+context_cache_ttl = int(os.environ.get("CONTEXT_CACHE_TTL", 3600))      # Gemini - Segundos de validade do cache de contexto (renovado automaticamente)
+reply_streaming = os.environ.get("REPLY_STREAMING", "0") == "1"       # Gemini - Envia a resposta em partes (parágrafos/frases) conforme é gerada
+typing_indicator = os.environ.get("TYPING_INDICATOR", "0") == "1"     # WhatsApp Cloud API - Confirma leitura e exibe "digitando..." ao receber mensagens
+media_max_bytes = int(os.environ.get("MEDIA_MAX_BYTES", 16 * 1024 * 1024))   # Tamanho máximo de mídia aceito (bytes). Também é o pico de memória por mídia (lida inteira para a memória)
+outbound_rate = float(os.environ.get("OUTBOUND_RATE", 80))            # WhatsApp Cloud API - Mensagens por segundo (limite do número)
+outbound_burst = int(os.environ.get("OUTBOUND_BURST", 80))            # WhatsApp Cloud API - Rajada máxima de mensagens
+recipient_rate = float(os.environ.get("RECIPIENT_RATE", 1))           # WhatsApp Cloud API - Mensagens por segundo para um mesmo destinatário
+recipient_burst = int(os.environ.get("RECIPIENT_BURST", 5))           # WhatsApp Cloud API - Rajada máxima para um mesmo destinatário
+outbound_queue_limit = int(os.environ.get("OUTBOUND_QUEUE_LIMIT", 10000))   # WhatsApp Cloud API - Mensagens aguardando envio (fila de prioridade)
+outbound_workers = int(os.environ.get("OUTBOUND_WORKERS", 16))        # WhatsApp Cloud API - Threads de envio
+outbound_send_timeout = float(os.environ.get("OUTBOUND_SEND_TIMEOUT", 120))   # WhatsApp Cloud API - Segundos aguardando o envio de uma resposta
+broadcast_token = os.environ.get("BROADCAST_TOKEN")                     # Campanhas - Token (Bearer) exigido nos endpoints de envio/pausa de campanhas
+broadcast_page_size = int(os.environ.get("BROADCAST_PAGE_SIZE", 500))   # Campanhas - Contatos lidos por página (checkpoint a cada página)
+broadcast_in_flight = int(os.environ.get("BROADCAST_IN_FLIGHT", 500))   # Campanhas - Envios simultâneos aguardando confirmação
+status_flush_interval = float(os.environ.get("STATUS_FLUSH_INTERVAL", 5))   # ACKs - Segundos entre gravações em lote dos status consolidados
+status_counter_shards = int(os.environ.get("STATUS_COUNTER_SHARDS", 10))    # ACKs - Shards por contador agregado (campanha/dia)
+status_known_items = int(os.environ.get("STATUS_KNOWN_ITEMS", 100_000))   # ACKs - Mensagens com o status registrado mantido em memória (ordem e ACKs reenviados)
+status_known_ttl = int(os.environ.get("STATUS_KNOWN_TTL", 24 * 3600))     # ACKs - Segundos mantendo o status registrado de cada mensagem
+media_cache_items = int(os.environ.get("MEDIA_CACHE_ITEMS", 2000))     # Mídias - Registros do índice (hash => arquivo/transcrição) mantidos em cache local (LRU)
+media_cache_chars = int(os.environ.get("MEDIA_CACHE_CHARS", 2000000)) # Mídias - Limite de caracteres das análises (transcrições) mantidas em cache local
+media_cache_ttl = int(os.environ.get("MEDIA_CACHE_TTL", 3600))        # Mídias - Segundos até expirar o registro em cache
+audio_segment_seconds = int(os.environ.get("AUDIO_SEGMENT_SECONDS", 120))  # Gemini - Duração máxima (segundos) de cada trecho de audio transcrito em paralelo (0 = sem divisão)
+transcription_workers = int(os.environ.get("TRANSCRIPTION_WORKERS", 8))     # Gemini - Trechos de audio transcritos simultaneamente
+inline_audio_max_bytes = int(os.environ.get("INLINE_AUDIO_MAX_BYTES", 14 * 1024 * 1024))   # Gemini - Tamanho máximo de audio enviado inline (acima disso, File API). O base64 aumenta o tamanho em 4/3; a requisição é limitada a 20 MB
+fanout_workers = int(os.environ.get("FANOUT_WORKERS", 64))            # Threads para etapas de I/O executadas em paralelo no processamento de cada mensagem
+stage_timeout = float(os.environ.get("STAGE_TIMEOUT", 15))            # Segundos aguardando cada etapa de consulta (duplicidade, contato, histórico, URL da mídia)
+media_stage_timeout = float(os.environ.get("MEDIA_STAGE_TIMEOUT", 120)) # Segundos aguardando cada etapa de mídia (upload para o Cloud Storage, transcrição)
+trace_sample_rate = float(os.environ.get("TRACE_SAMPLE_RATE", 0))     # Telemetria - Parcela das requisições com log de trace por etapa (0 a 1; 0 = desabilitado)
+metrics_token = os.environ.get("METRICS_TOKEN")                        # Telemetria - Token (Bearer) exigido na rota /metrics (vazio = rota desabilitada)
+startup_warm_up = os.environ.get("STARTUP_WARM_UP", "1") == "1"       # Inicialização - Constrói os clientes (Gemini/Firebase/Storage) em segundo plano logo após iniciar (0 = somente no primeiro uso)
+contact_lane_workers = int(os.environ.get("CONTACT_LANE_WORKERS", 32))  # Contatos processados simultaneamente (filas por contato)
+coalesce_window = float(os.environ.get("COALESCE_WINDOW", 0))         # Segundos para agrupar rajadas de textos de um mesmo contato numa única resposta da IA (0 = desabilitado)
+gemini_timeout = float(os.environ.get("GEMINI_TIMEOUT", 60))          # Gemini - Timeout (segundos) por chamada à IA
+gemini_slow_seconds = float(os.environ.get("GEMINI_SLOW_SECONDS", 20))  # Circuit breaker - Chamadas ao Gemini acima deste tempo contam como lentas
+breaker_failure_rate = float(os.environ.get("BREAKER_FAILURE_RATE", 0.5))   # Circuit breaker - Parcela de falhas (ou de chamadas lentas) na janela que abre o circuito
+breaker_min_calls = int(os.environ.get("BREAKER_MIN_CALLS", 10))      # Circuit breaker - Mínimo de chamadas na janela para avaliar o circuito
+breaker_window = int(os.environ.get("BREAKER_WINDOW", 60))            # Circuit breaker - Segundos considerados na avaliação
+breaker_open_seconds = int(os.environ.get("BREAKER_OPEN_SECONDS", 30))  # Circuit breaker - Segundos com o circuito aberto até a chamada de teste
+pending_reply_interval = int(os.environ.get("PENDING_REPLY_INTERVAL", 60))   # Segundos entre verificações das respostas pendentes (IA indisponível)
+tenants_file = os.environ.get("TENANTS_FILE")                           # Números atendidos - Arquivo JSON com phone_number_id, token, instruções, buckets e prefixo das coleções de cada número (vazio = somente ID_TEL)
+tenants_reload_interval = int(os.environ.get("TENANTS_RELOAD_INTERVAL", 30))   # Números atendidos - Segundos entre verificações de alteração do arquivo (0 = sem recarga)
+fallback_reply = os.environ.get("FALLBACK_REPLY", "Recebi sua mensagem, mas estou com instabilidade no momento. Assim que possível, te respondo por aqui.")   # Resposta enviada enquanto a IA está indisponível
+#endregion
+
+telemetry.configure(trace_sample_rate)
+
+#region - Circuit breakers (Gemini, Graph API, Cloud Storage): dependência instável => falha imediata, sem ocupar os workers
+def breaker_state_change(name, previous, state):
+    telemetry.set_breaker_state(name, state)
+    print(f"Circuito {name}: {previous} => {state}")
+    if name == "gemini" and state == CLOSED:
+        pending_replies.wake()                              # IA disponível: responde as mensagens pendentes
+
+def circuit_breaker(name, slow_call_seconds=None):
+    return CircuitBreaker(name, failure_rate=breaker_failure_rate, slow_call_seconds=slow_call_seconds,
+            slow_call_rate=breaker_failure_rate, min_calls=breaker_min_calls, window=breaker_window,
+            open_seconds=breaker_open_seconds, on_state_change=breaker_state_change)
+
+gemini_breaker = circuit_breaker("gemini", slow_call_seconds=gemini_slow_seconds)
+graph_breaker = circuit_breaker("graph_api")
+gcs_breaker = circuit_breaker("cloud_storage")
+gemini_request_options = {"timeout": gemini_timeout}
 #endregion
 
 #region - Inicia modelos Google Generative AI
@@ -39,6 +151,11 @@ image_generation_config = {
   "top_p": 0.95,
   "top_k": 0,
 }
+summary_generation_config = {                   # Resumo do histórico: fiel à conversa e de tamanho limitado (enviado a cada mensagem)
+  "temperature": 0.2,
+  "top_p": 0.95,
+  "max_output_tokens": 1024,
+}
 safety_settings = [
   {
     "category": "HARM_CATEGORY_HARASSMENT",
@@ -57,318 +174,744 @@ safety_settings = [
     "threshold": "BLOCK_NONE"
   },
 ]
-genai.configure(api_key=my_api_key)
-model = genai.GenerativeModel(model_name="models/gemini-1.5-pro-latest",
+# Os modelos (e a própria biblioteca) só são carregados no primeiro uso ou na pré-carga em segundo plano
+def load_genai():
+    import google.generativeai as genai
+    genai.configure(api_key=my_api_key)
+    return genai
+
+def gemini_model(model_name, generation_config, system_instruction=None):
+    return lambda: genai.GenerativeModel(model_name=model_name,
         generation_config=generation_config,
         system_instruction=system_instruction,
         safety_settings=safety_settings)
-audio_model = genai.GenerativeModel(model_name="models/gemini-1.5-pro-latest",
-        generation_config=audio_generation_config,
-        safety_settings=safety_settings)
-image_model = genai.GenerativeModel(model_name="models/gemini-1.5-pro-latest",
-        generation_config=image_generation_config,
-        safety_settings=safety_settings)
+
+genai = Lazy("genai", load_genai)
+audio_model = Lazy("audio_model", gemini_model("models/gemini-1.5-pro-latest", audio_generation_config))
+image_model = Lazy("image_model", gemini_model("models/gemini-1.5-pro-latest", image_generation_config))
+summary_model = Lazy("summary_model", gemini_model("models/gemini-1.5-flash-latest", summary_generation_config))
 #endregion
 
 #region - Inicializa o Firebase app (Gestão de Banco No-SQL ref. histórico de mensagens)
-cred = credentials.Certificate(path_credential)             # Volume criado dentro do container, na console do Google Cloud Run
-firebase_admin.initialize_app(cred)
-db = firestore.client()
+# Conexão criada no primeiro uso. O app recebe o PID no nome: após fork (gunicorn --preload) o processo filho cria app/conexão próprios
+def connect_firestore():
+    import firebase_admin
+    from firebase_admin import credentials, firestore
+    cred = credentials.Certificate(path_credential)         # Volume criado dentro do container, na console do Google Cloud Run
+    app = firebase_admin.initialize_app(cred, name=f"webhook-{os.getpid()}")
+    telemetry.instrument_firestore()                        # Contagem de leituras/gravações (métricas)
+    return firestore.client(app)
+
+db = Lazy("firestore", connect_firestore)
+
+# Gravações de histórico, erros, alertas e chamados são agrupadas em commits em lote (write-behind) e gravadas no encerramento
+firestore_writer = BufferedWriter(db, max_batch=firestore_batch_size, flush_interval=firestore_flush_interval)
+atexit.register(firestore_writer.close)
+
+# ACKs: status consolidados em memória e gravados em lote, com contadores por campanha/dia distribuídos em shards
+status_pipeline = StatusPipeline(db, flush_interval=status_flush_interval, shards=status_counter_shards,
+                                 known_items=status_known_items, known_ttl=status_known_ttl)
+atexit.register(status_pipeline.close)
+#endregion
+
+#region - Números atendidos (tenants): configuração por phone_number_id, recarregada quando o arquivo TENANTS_FILE é alterado
+def tenants_reloaded(registry):
+    global payload_router
+    payload_router = PayloadRouter(registry.ids())          # Novos números passam a ser aceitos (e removidos, descartados) sem reiniciar
+
+def tenants_error(e):
+    insert_internal_error("tenants", f"Exception - {e}", "")
+
+tenants = TenantRegistry(TenantsFile(tenants_file, url_base, db, defaults={
+            "phone_number_id": id_tel,
+            "token": token,
+            "system_instructions": system_instruction,
+            "audio_bucket_name": audio_bucket_name,
+            "image_bucket_name": image_bucket_name,
+        }), reload_interval=tenants_reload_interval if tenants_file else 0, on_reload=tenants_reloaded, on_error=tenants_error)
+
+# Número em atendimento (contexto da thread) ou número padrão
+def active_tenant():
+    return current_tenant() or tenants.default
+#endregion
+
+#region - Sessões de chat por contato (modelo e cache de contexto com as instruções do sistema de cada número)
+model = tenants.resource("model", lambda tenant: gemini_model("models/gemini-1.5-pro-latest", generation_config, tenant.system_instruction)())
+
+def tenant_chat_model(tenant):
+    tenant_model = model.for_tenant(tenant)
+    if not context_cache_model:
+        return lambda: tenant_model
+    context_cached_model = ContextCachedModel(context_cache_model, tenant.system_instruction, tenant_model,
+            generation_config=generation_config, safety_settings=safety_settings, ttl=context_cache_ttl)
+
+    def chat_model():
+        genai.get()                                         # Garante a biblioteca configurada (API_KEY) antes de criar o cache de contexto
+        return context_cached_model.get()
+    return chat_model
+
+chat_session_cache = TTLCache(max_items=chat_max_sessions, ttl=chat_idle_ttl)     # Compartilhado entre os números (limite único de memória)
+chat_sessions = tenants.resource("chat_sessions", lambda tenant: ChatSessionManager(tenant_chat_model(tenant),
+        max_history=history_max_turns + 2, token_budget=history_token_budget,      # + 2: turnos do resumo da conversa
+        cache=ScopedCache(chat_session_cache, tenant.phone_number_id)))
+#endregion
+
+#region - Controle de duplicidade de mensagens e mídias (ID do documento = ID da WhatsApp Cloud API)
+id_texts = IdempotencyStore(db, "id_text", "id_text", ttl=idempotency_ttl)
+id_medias = IdempotencyStore(db, "id_medias", "id_media", ttl=idempotency_ttl)
+#endregion
+
+#region - Repositório de contatos (documento identificado pelo telefone + cache)
+contact_cache = TTLCache(max_items=contact_cache_items, ttl=contact_cache_ttl)
+contacts = tenants.resource("contacts", lambda tenant: ContactRepository(tenant.db, cache=ScopedCache(contact_cache, tenant.phone_number_id)))
+#endregion
+
+#region - Índice de mídias endereçadas por conteúdo (hash): upload e transcrição de mídias repetidas uma única vez
+media_cache = new_media_cache(media_cache_items, media_cache_chars, media_cache_ttl)
+media_index = tenants.resource("media_index", lambda tenant: MediaIndex(tenant.db, firestore_writer,
+        cache=ScopedCache(media_cache, tenant.phone_number_id)))
+#endregion
+
+#region - Histórico de conversas (janela recente + resumo incremental dos turnos antigos)
+# Resume turnos antigos da conversa, incorporando o resumo anterior
+def summarize_history(previous_summary, turns):
+    conversation = "\n".join(f"{turn['role']}: {' '.join(str(part) for part in turn['parts'])}" for turn in turns)
+    prompt = ("Atualize o resumo da conversa abaixo entre um usuário (user) e um assistente (model). "
+              "Mantenha nomes, dados informados pelo usuário, pedidos em aberto e decisões tomadas. Responda somente com o resumo.\n\n"
+              f"Resumo anterior: {previous_summary or '(vazio)'}\n\nNovos trechos da conversa:\n{conversation}")
+    with gemini_breaker.guard():
+        response = summary_model.generate_content(prompt, request_options=gemini_request_options)
+    telemetry.count_tokens("summary", response)
+    return response.text
+
+history_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="history-summary")
+
+# Falha na atualização do resumo (executada fora da requisição): registrada no número do contato
+def history_error(tenant, tel, e):
+    with use_tenant(tenant):
+        insert_internal_error("history_summary", f"Exception - {e}", tel)
+
+history_cache = new_history_cache(history_cache_items, history_cache_ttl)
+history = tenants.resource("history", lambda tenant: ConversationHistory(tenant.db, max_turns=history_max_turns,
+        token_budget=history_token_budget, summary_batch=history_summary_batch,
+        summarize=summarize_history if history_summary_batch > 0 else None,
+        schedule=lambda *args: history_executor.submit(*args),          # Executor atual (substituído no processo filho após fork)
+        on_error=lambda tel, e: history_error(tenant, tel, e),
+        writer=firestore_writer, cache=ScopedCache(history_cache, tenant.phone_number_id),
+        chunk_size=history_chunk_size, chunk_max_bytes=history_chunk_max_bytes, prune_legacy=history_prune_legacy))
+
+# Migração dos históricos no formato anterior (todos os números). Contatos não migrados aqui são migrados na primeira leitura
+def migrate_histories():
+    for tenant in tenants:
+        try:
+            migrated = history.for_tenant(tenant).migrate_all()
+            print(f"Históricos migrados para o armazenamento em blocos ({tenant.name}): {migrated}")
+        except Exception as e:
+            print(f"Falha na migração dos históricos do número {tenant.name}. Detalhes: {e}")
+
+if history_migrate_on_start:
+    on_start(lambda: threading.Thread(target=migrate_histories, name="history-migration", daemon=True).start())
+#endregion
+
+#region - Cliente HTTP compartilhado da WhatsApp Cloud API
+# Pool dimensionado pelas threads que chamam a API simultaneamente: envios (por número), etapas paralelas e filas por contato
+# Um pool menor que a concorrência descarta conexões excedentes a cada chamada (pool_block=False), perdendo o keep-alive
+graph_pool_size = graph_pool_size or outbound_workers * max(len(tenants.ids()), 1) + fanout_workers + contact_lane_workers
+graph_api = GraphApiClient(url_base, id_tel, token, pool_size=graph_pool_size, read_timeout=graph_timeout, max_retries=graph_max_retries,
+        breaker=graph_breaker)
+
+# Despachante de envios por número (limites de vazão da WhatsApp Cloud API são por número), sobre o mesmo pool de conexões
+# Respostas de conversa têm prioridade sobre envios em massa; 429 => nova tentativa com backoff
+def tenant_outbound(tenant):
+    return OutboundDispatcher(lambda data: graph_api.send_message(data, max_retries=0, sender=tenant), rate=outbound_rate,
+            burst=outbound_burst, recipient_rate=recipient_rate, recipient_burst=recipient_burst,
+            max_queue=outbound_queue_limit, workers=outbound_workers)
+
+outbound = tenants.resource("outbound", tenant_outbound, close=lambda dispatcher: dispatcher.shutdown())
+atexit.register(lambda: [dispatcher.shutdown() for dispatcher in outbound.instances()])
 #endregion
 
 app = Flask(__name__)
 
+# Threads em segundo plano e pré-carga são iniciadas no processo que atende as requisições (gunicorn: post_worker_init em
+# gunicorn.conf.py; demais servidores: primeira requisição). O processo mestre do gunicorn --preload não inicia threads
+@app.before_request
+def start_background():
+    start_process()
+
+#region - Pré-carga dos clientes em segundo plano (inicialização rápida: o servidor atende enquanto os clientes são construídos)
+if startup_warm_up:
+    # Modelos de conversa (por número) são objetos leves, construídos no primeiro uso sobre a biblioteca já carregada
+    warm_up(genai, db, audio_model, image_model, on_done=lambda: startup_profile.report(build_times))
+#endregion
+
+#region - Envio de campanhas (templates) aos contatos ativos
+def broadcast_error(campaign_id, e):
+    insert_internal_error("broadcast", f"Campanha {campaign_id} - Exception - {e}", "")
+
+broadcaster = tenants.resource("broadcaster", lambda tenant: CampaignBroadcaster(tenant.db, outbound.for_tenant(tenant), firestore_writer,
+        page_size=broadcast_page_size, max_in_flight=broadcast_in_flight, on_error=broadcast_error))
+#endregion
+
+#region - Roteamento das notificações (tabela pré-calculada por phone_number_id e tipo de alteração)
+payload_router = PayloadRouter(tenants.ids())
+#endregion
+
+#region - Pool de workers (modo async) e filas por contato
+def worker_error(e):
+    insert_internal_error("worker_pool", f"Exception - {e}", "")
+
+contact_lanes = ContactLanes(coalesce_window, on_error=worker_error, workers=contact_lane_workers)   # Execução ordenada por contato
+atexit.register(contact_lanes.shutdown)
+
+def stage_error(name, e):
+    insert_internal_error(name, f"Exception - {e}", "")
+
+transcription_executor = ThreadPoolExecutor(max_workers=transcription_workers, thread_name_prefix="transcription")    # Trechos de audios longos
+
+# Processo filho (fork): executores já utilizados no processo pai não criam novas threads no filho
+def reset_executors():
+    global history_executor, transcription_executor
+    history_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="history-summary")
+    transcription_executor = ThreadPoolExecutor(max_workers=transcription_workers, thread_name_prefix="transcription")
+
+on_fork(reset_executors)
+
+fanout = FanOut(fanout_workers, default_timeout=stage_timeout, on_error=stage_error)   # Etapas de I/O independentes em paralelo
+
+# Mensagens recebidas com o circuito do Gemini aberto: respondidas (na fila do contato) quando o circuito fecha
+def replay_pending_reply(tel, texts, phone_number_id):
+    tenant = tenants.get(phone_number_id) or tenants.default
+    contact_lanes.submit(f"{tenant.phone_number_id}:{tel}", retry_pending_reply, tenant, tel, texts)
+
+def pending_reply_error(e):
+    insert_internal_error("pending_replies", f"Exception - {e}", "")
+
+pending_replies = PendingReplies(db, gemini_breaker, replay_pending_reply, interval=pending_reply_interval, on_error=pending_reply_error)
+atexit.register(pending_replies.close)
+
+worker_pool = None
+if processing_mode == "async":
+    worker_pool = WorkerPool("webhook-worker", worker_pool_size, worker_queue_limit, on_error=worker_error)
+    on_start(worker_pool.start)
+    worker_pool.drain_on_exit(worker_drain_timeout)
+#endregion
+
+#region - Métricas dos componentes (stats() lidos na coleta da rota /metrics)
+shared_caches = {"chat_sessions": chat_session_cache, "contacts": contact_cache, "media": media_cache, "history": history_cache,
+                 "id_text": id_texts.recent, "id_medias": id_medias.recent}
+telemetry.register_stats("webhook_cache", ["cache"], lambda: [((name,), cache.stats()) for name, cache in shared_caches.items()],
+        gauges={"size": ("items", "Itens no cache"), "weight": ("weight", "Peso ocupado no cache (ex.: caracteres)")},
+        counters={"hits": ("hits", "Leituras encontradas no cache"), "misses": ("misses", "Leituras não encontradas no cache"),
+                  "evictions": ("evictions", "Itens removidos por limite de itens/peso (LRU)"), "expirations": ("expirations", "Itens expirados (TTL)")})
+telemetry.register_stats("outbound", ["phone_number_id"],
+        lambda: [((tenant.phone_number_id,), tenant.built("outbound").stats()) for tenant in tenants if tenant.built("outbound")],
+        gauges={"queue_depth": ("queue_depth", "Envios aguardando na fila do despachante"),
+                "wait_avg": ("wait_avg_seconds", "Espera média (fila + novas tentativas) dos envios concluídos"),
+                "wait_max": ("wait_max_seconds", "Maior espera (fila + novas tentativas) de um envio concluído")},
+        counters={"sent": ("sent", "Envios concluídos com sucesso"), "failed": ("failed", "Envios concluídos com falha"),
+                  "retried": ("retried", "Novas tentativas de envio"), "rejected": ("rejected", "Envios rejeitados (fila cheia)"),
+                  "wait_total": ("wait_seconds", "Espera acumulada dos envios concluídos")})
+telemetry.register_stats("firestore_writer", [], lambda: [((), firestore_writer.stats())],
+        gauges={"pending": ("pending", "Gravações aguardando commit no buffer")},
+        counters={"commits": ("commits", "Commits em lote"), "writes": ("writes", "Gravações confirmadas"),
+                  "failures": ("failures", "Gravações com falha"), "dropped": ("dropped", "Gravações descartadas após a última tentativa")})
+telemetry.register_stats("webhook", [], lambda: [((), {"lanes": contact_lanes.active(), "acks": status_pipeline.pending()})],
+        gauges={"lanes": ("active_contacts", "Contatos com processamento em andamento"),
+                "acks": ("pending_acks", "ACKs consolidados aguardando gravação")})
+if worker_pool:
+    telemetry.register_stats("worker_pool", [], lambda: [((), worker_pool.stats())],
+            gauges={"queue_depth": ("queue_depth", "Notificações aguardando na fila (modo async)"),
+                    "in_flight": ("in_flight", "Notificações em processamento")},
+            counters={"processed": ("processed", "Notificações processadas"), "rejected": ("rejected", "Notificações rejeitadas (fila cheia => 503)"),
+                      "failed": ("failed", "Notificações com falha")})
+#endregion
+
 # Endpoint POST para recebimento de notificações da WhatsApp Cloud API
 @app.route("/webhook", methods=["POST"])
+@telemetry.traced("webhook")
 def webhook():   
-    data = request.json    
-    handled = False
+    raw = request.get_data()
+    if not raw:
+        return jsonify({"status": "Invalid request"}), 400
 
-    # Verifica destinatário.
-    if data.get("entry") and data["entry"][0].get("changes"):
-        change = data["entry"][0]["changes"][0]
-        if change.get("value") and change["value"].get("metadata"):            
-            
-            metadata = change["value"]["metadata"]
-            phone_number_id = metadata.get("phone_number_id")
-            id_tel = os.environ.get("ID_TEL") 
-
-            if phone_number_id != id_tel:
-                return jsonify({"status": "Ok"}), 200
-
-    # Tratamento de mensagens recebidas
-    if data.get("entry") and data["entry"][0].get("changes"):
-        change = data["entry"][0]["changes"][0]
-        if change.get("value") and change["value"].get("messages"):
-            
-            message = change["value"]["messages"][0]
-            tel = message.get("from")
-            type_message = message.get("type")
-            id_text = message.get("id")
-
-            # Verifica se contato já existe na base de dados
-            contact = exist_contact(tel)
-            if contact == False:
-                store_contact(tel)
-                message_history = []
-            else:
-                message_history = get_menssages(tel)                # Obtem histórico de mensagens
-
-            # Tratamento de Mensagens de TEXTO
-            if type_message == "text":
-                if exist_idText(id_text):                           # Validação para evitar duplicidade de lançamentos, caso a WhatsApp Cloud API envie a mesma mensagem repetidamente
-                    return 
-                
-                body_message = message.get("text").get("body")      # Texto da mensagem digitada pelo usuário      
-                role = "user"                                       # role=user => mensagem enviada pelo usuário
-                store_message(tel, role, body_message)              # Salva mensagem em banco NO-SQL. 
-                store_idText(id_text)                               # Salva ID do texto para posterior validação de duplicidade
-                handled = True
+    # Filtro rápido: payloads de outros números (sem eventos de modelos) são descartados sem decodificar o JSON
+    if not payload_router.may_concern(raw):
+        return jsonify({"status": "Ok"}), 200
 
-                if body_message.upper() == "PARAR MENSAGENS":
-                    contact_update_status(tel, "Inativos")
-                    treated_response = "Ok, *não iremos lhe enviar novas mensagens*. Caso tenha solicitado por engano, digite a palavra *ATIVAR CADASTRO*."
-                    send_message = send_text_message(tel, treated_response)     # Envia resposta de volta para o usuário através da WhatsApp Cloud API                
-                    if send_message:
-                        role = "model"                                          # role=model => mensagem enviada pela IA
-                        store_message(tel, role, treated_response)              # Salva mensagem em banco NO-SQL. 
-                    return
-                elif body_message.upper() == "ATIVAR CADASTRO":
-                    contact_update_status(tel, "Ativos")
-                    treated_response = "Ok, *cadastro ATIVADO*."
-                    send_message = send_text_message(tel, treated_response)     # Envia resposta de volta para o usuário através da WhatsApp Cloud API                
-                    if send_message:
-                        role = "model"                                          # role=model => mensagem enviada pela IA
-                        store_message(tel, role, treated_response)              # Salva mensagem em banco NO-SQL. 
-                    return
-
-                convo = model.start_chat(history = message_history) # Inicia chat, contextualizando a IA com o histórico da conversação
-                convo.send_message(body_message)                    # envia nova mensagem para ser processada pela IA
-                response = convo.last.text                          # Obtem resposta da IA
-
-                treated_response, instruction = response_treatment(response)    # Verifica se existem instruções ou comandos enviados pela IA e faz a devida separação da mensagem
-
-                send_message = send_text_message(tel, treated_response)     # Envia resposta de volta para o usuário através da WhatsApp Cloud API                
-                if send_message:
-                    role = "model"                                          # role=model => mensagem enviada pela IA
-                    store_message(tel, role, treated_response)              # Salva mensagem em banco NO-SQL. 
-                
-                if instruction != "":                                       # Caso exista alguma instrução, analisa a mesma e dá o tratamento devido
-                    handle_instruction(instruction, tel)
-            
-            # Tratamento de Mensagens de AUDIO
-            elif type_message == "audio":                
-                id_media = message.get("audio").get("id")   
-                if exist_idMedia(id_media):                         # Validação para evitar duplicidade de lançamentos, caso a WhatsApp Cloud API envie a mesma mensagem repetidamente
-                    return                 
-                url_media, mime_type = get_url_media(id_media)                 # obtem URL do audio (Midia protegida por token - WhastApp Cloud API)
-                if url_media:               
-                    media = download_media(url_media, tel)          # faz o download do audio em formato binário 
-                    if media:
-                        handled = True
-                        file_name = store_audio(media, tel, mime_type)         # Salva audio em bucket do Google Cloud Storage 
-                        if file_name:
-                            store_idMedia(id_media)
-                            try:    
-                                # Realiza a transcrição de Audio para Texto (Speech-to-Text) utilizando Google Gemini / multimodal prompt
-                                path_media = f"/{path_audio_messages}/{file_name}"                          
-                                audio_media = genai.upload_file(path=path_media, mime_type=mime_type)
-                                audio_analysis = audio_model.generate_content(["Transcreva este audio", audio_media])  
-                                audio_transcript = audio_analysis.text  
-
-                                role = "user"                                       # role=user => mensagem enviada pelo usuário
-                                store_message(tel, role, audio_transcript)          # Salva mensagem em banco NO-SQL.                                            
-
-                                convo = model.start_chat(history = message_history) # Inicia chat, contextualizando a IA com o histórico da conversação                                
-                                convo.send_message(audio_transcript)                # envia mensagem recebida para ser processada pela IA
-                                response = convo.last.text                          # Obtem resposta da IA
-
-                                treated_response, instruction = response_treatment(response)    # Verifica se existem instruções ou comandos enviados pela IA e faz a devida separação da mensagem
-                                
-                                send_message = send_text_message(tel, treated_response)         # Envia resposta de volta para o usuário através da WhatsApp Cloud API                
-                                if send_message:
-                                    role = "model"                                              # role=model => mensagem enviada pela IA
-                                    store_message(tel, role, treated_response)                  # Salva mensagem em banco NO-SQL. 
-
-                                if instruction != "":                                           # Caso exista alguma instrução, analisa a mesma e dá o tratamento devido
-                                    handle_instruction(instruction, tel)
-                            except Exception as e:
-                                response = "Opa, algo deu errado e não consegui analisar sua mensagem. Tente novamente"
-                                send_message = send_text_message(tel, response)
-                                if send_message:
-                                    role = "model"                                  # role=model => mensagem enviada pela IA
-                                    store_message(tel, role, response)              # Salva mensagem em banco NO-SQL. 
-                                insert_internal_error("audio_analysis", f"Exception - {e}", tel)                          
-                        else:
-                            send_text_message(tel, "Não foi possível salvar o Audio na Nuvem. Tente Novamente") 
-                            insert_internal_error("audio_store", "Não foi possível salvar o Audio na Nuvem.", tel)
-                    else:
-                        send_text_message(tel, "Não foi possível obter o Audio. Tente Novamente") 
-                        insert_internal_error("audio_get", "Não foi possível obter o Audio junto a WhatsApp Cloud API", tel)
-                else:
-                    send_text_message(tel, "Não foi possível obter a URL do Audio. Tente Novamente") 
-                    insert_internal_error("audio_get", "Não foi possível obter a URL do Audio junto a WhatsApp Cloud API", tel)
-
-            # Tratamento de Mensagens com Imagem
-            elif type_message == "image":                
-                id_media = message.get("image").get("id")   
-                if exist_idMedia(id_media):                         # Validação para evitar duplicidade de lançamentos, caso a WhatsApp Cloud API envie a mesma mensagem repetidamente
-                    return                 
-                url_media, mime_type = get_url_media(id_media)      # obtem URL da Imagem (Midia protegida por token - WhastApp Cloud API)
-                if url_media:               
-                    media = download_media(url_media, tel)          # faz o download da imagem em formato binário 
-                    if media:
-                        handled = True
-                        file_name = store_image(media, tel, mime_type)              # Salva imagem em bucket do Google Cloud Storage 
-                        if file_name:
-                            store_idMedia(id_media)
-                            try:    
-                                path_media = f"/{path_image_messages}/{file_name}"                          
-                                role = "user"                                       # role=user => mensagem enviada pelo usuário
-                                describe = f"Imagem recebida. Path: {path_media}"
-                                store_message(tel, role, describe)                  # Salva mensagem com descrição da imagem em banco NO-SQL.   
-                                update_contact_last_media(tel, file_name)           # Atualiza Contato com File_Name da ultima imagem recebida                                   
-
-                                convo = model.start_chat(history = message_history) # Inicia chat, contextualizando a IA com o histórico da conversação                                
-                                convo.send_message(describe)                        # envia mensagem recebida para ser processada pela IA
-                                response = convo.last.text                          # Obtem resposta da IA
-
-                                treated_response, instruction = response_treatment(response)    # Verifica se existem instruções ou comandos enviados pela IA e faz a devida separação da mensagem
-                                
-                                send_message = send_text_message(tel, treated_response)         # Envia resposta de volta para o usuário através da WhatsApp Cloud API                
-                                if send_message:
-                                    role = "model"                                              # role=model => mensagem enviada pela IA
-                                    store_message(tel, role, treated_response)                  # Salva mensagem em banco NO-SQL. 
-
-                                if instruction != "":                                           # Caso exista alguma instrução, analisa a mesma e dá o tratamento devido
-                                    handle_instruction(instruction, tel)
-                            except Exception as e:
-                                response = "Opa, algo deu errado e não consegui analisar sua imagem. Tente novamente"
-                                send_message = send_text_message(tel, response)
-                                if send_message:
-                                    role = "model"                                  # role=model => mensagem enviada pela IA
-                                    store_message(tel, role, response)              # Salva mensagem em banco NO-SQL. 
-                                insert_internal_error("image_analysis", f"Exception - {e}", tel)                          
-                        else:
-                            send_text_message(tel, "Não foi possível salvar a Imagem na Nuvem. Tente Novamente") 
-                            insert_internal_error("image_store", "Não foi possível salvar a Imagem na Nuvem.", tel)
-                    else:
-                        send_text_message(tel, "Não foi possível obter a Imagem. Tente Novamente") 
-                        insert_internal_error("image_get", "Não foi possível obter a Imagem junto a WhatsApp Cloud API", tel)
-                else:
-                    send_text_message(tel, "Não foi possível obter a URL da Imagem. Tente Novamente") 
-                    insert_internal_error("image_get", "Não foi possível obter a URL da Imagem junto a WhatsApp Cloud API", tel)
-            
-            elif type_message == "button":
-                if exist_idText(id_text):                           # Validação para evitar duplicidade de lançamentos, caso a WhatsApp Cloud API envie a mesma mensagem repetidamente
-                    return 
-                
-                body_message = message.get("button").get("text")    # Texto do botão
-                role = "user"                                       # role=user => mensagem enviada pelo usuário
-                store_message(tel, role, body_message)              # Salva mensagem em banco NO-SQL. 
-                store_idText(id_text)                               # Salva ID do texto para posterior validação de duplicidade
-                handled = True
+    try:
+        data = loads(raw)
+    except ValueError:
+        return jsonify({"status": "Invalid request"}), 400
+    if not data or not isinstance(data, dict):
+        return jsonify({"status": "Invalid request"}), 400
 
-                if body_message.upper() == "PARAR MENSAGENS":
-                    contact_update_status(tel, "Inativos")
-                    treated_response = "Ok, *não iremos lhe enviar novas mensagens*. Caso tenha solicitado por engano, digite a palavra *ATIVAR CADASTRO*."
-                    send_message = send_text_message(tel, treated_response)     # Envia resposta de volta para o usuário através da WhatsApp Cloud API                
-                    if send_message:
-                        role = "model"                                          # role=model => mensagem enviada pela IA
-                        store_message(tel, role, treated_response)              # Salva mensagem em banco NO-SQL. 
-                    return
-                elif body_message.upper() == "ATIVAR CADASTRO":
-                    contact_update_status(tel, "Ativos")
-                    treated_response = "Ok, *cadastro ATIVADO*."
-                    send_message = send_text_message(tel, treated_response)     # Envia resposta de volta para o usuário através da WhatsApp Cloud API                
-                    if send_message:
-                        role = "model"                                          # role=model => mensagem enviada pela IA
-                        store_message(tel, role, treated_response)              # Salva mensagem em banco NO-SQL. 
-                    return
+    try:
+        events = payload_router.parse(data)             # Interpreta todas as entradas/alterações do payload, descartando outros destinatários
+    except (AttributeError, TypeError):                 # Estrutura inválida (ex.: entry/changes que não são objetos)
+        return jsonify({"status": "Invalid request"}), 400
+    if not events:
+        return jsonify({"status": "Ok"}), 200
+
+    # Caminho rápido: notificações só com ACKs são acumuladas em memória (sem fila, Firestore ou IA)
+    if all(type(event) is StatusEvent for event in events):
+        status_pipeline.add(events)
+        return jsonify({"status": "Ok"}), 200
+
+    # Modo async: enfileira eventos e responde imediatamente. Fila cheia => 503 para que a WhatsApp Cloud API reenvie depois
+    if worker_pool:
+        if not worker_pool.submit(process_events, events, data):
+            return jsonify({"status": "Busy"}), 503
+        return jsonify({"status": "Ok"}), 200
+
+    process_events(events, data)
+    return jsonify({"status": "Ok"}), 200
+
+# Despacha eventos de uma notificação da WhatsApp Cloud API (mensagens, ACKs e atualizações de campanhas)
+# As gravações de campanhas, alertas e notificações não tratadas do lote são agrupadas num único commit do Firestore
+def process_events(events, data):
+    batch = db.batch()
+    batch_used = False
+    untreated = []                              # Números (tenants) com alterações não tratadas
+    statuses = []
+    lanes = []
+
+    for event in events:
+        # Tratamento de mensagens recebidas
+        if isinstance(event, MessageEvent):
+            tenant = tenants.get(event.phone_number_id)
+            if tenant is None:
+                continue                                # Número removido do cadastro (recarga) após a leitura do payload
+            # Mensagens de um mesmo contato (em cada número) são processadas em ordem de chegada; textos de uma mesma rajada podem ser agrupados
+            lanes.append(contact_lanes.submit(f"{tenant.phone_number_id}:{event.tel}", treat_message, tenant, event.message, data,
+                    batch_fn=text_batch_fn(event.message)))
+
+        # Tratamento de ACK (status da mensagem: aceita, enviada, entregue,lida)
+        elif isinstance(event, StatusEvent):
+            statuses.append(event)
+
+        # Atualização de Status de Modelos 
+        elif isinstance(event, TemplateStatusEvent):
+            batch_used = True
+            update_campaign_status(event.event, event.message_template_id, event.reason, batch)     # Atualiza Status da Campanha
+            if event.other_info != "": 
+                campaign_name = get_campaign_name(event.message_template_id)
+                alert = f"Mudança de STATUS da campanha {campaign_name}. Novo status = {event.other_info}"     # Salva Alerta
+                store_campaign_alert(alert, batch)
+
+        # Atualização de Score de Qualidade de Modelos 
+        elif isinstance(event, TemplateQualityEvent):
+            batch_used = True
+            update_campaign_score(event.message_template_id, event.previous, event.new, batch)     # Atualiza Score da Campanha
+            for tenant in tenants:                      # Queda de qualidade => pausa envios da campanha (modelos são da conta: todos os números)
+                running = tenant.built("broadcaster")   # Despachante não construído => somente o Firestore (a instância que envia pausa no checkpoint)
+                if running:
+                    running.on_quality_update(event.message_template_id, event.previous, event.new)
                 else:
-                    contact_update_status(tel, "Ativos")            # Altera status do contato de NOVOS para ATIVOS
+                    pause_on_quality_drop(tenant.db, event.message_template_id, event.previous, event.new)
+            campaign_name = get_campaign_name(event.message_template_id)
+            alert = f"Mudança de SCORE da campanha {campaign_name}. Novo score = {event.new}"     # Salva Alerta
+            store_campaign_alert(alert, batch)
+
+        else:
+            tenant = tenants.get(event.phone_number_id) or tenants.default    # Alterações da conta (sem número) => número padrão
+            if tenant not in untreated:
+                untreated.append(tenant)
+
+    # Salva notificação não analisada (no número que a recebeu)
+    for tenant in untreated:
+        batch_used = True
+        with use_tenant(tenant):
+            untreated_notification(data, batch)    # Salva notificação não analisada- Atenção!!! Somente em ambiente de Desenvolvimento para eventuais análises. Desabilitar em ambiente de Produção    
+
+    if batch_used:
+        batch.commit()
+
+    if statuses:
+        status_pipeline.add(statuses)           # ACKs são consolidados em memória e gravados em lote (status por mensagem + contadores)
+
+    # Mensagens de contatos diferentes são processadas em paralelo; a notificação é concluída (worker liberado ou resposta HTTP no modo sync)
+    # quando todas terminam, mantendo o limite de notificações em processamento
+    for lane in lanes:
+        lane.result()
+
+# Processa mensagem recebida (no contexto do número que a recebeu) e salva a notificação caso a mensagem não tenha sido tratada
+@telemetry.traced("message")
+def treat_message(tenant, message, data):
+    with use_tenant(tenant):
+        try:
+            if not handle_message(message):
+                untreated_notification(data)    # Salva notificação não analisada- Atenção!!! Somente em ambiente de Desenvolvimento para eventuais análises. Desabilitar em ambiente de Produção
+        finally:
+            contacts.flush(message.get("from"))     # Grava numa única escrita as alterações do contato feitas durante o evento
+
+# Trata mensagem recebida. Etapa que excede o prazo (StageTimeoutError) => resposta de erro ao usuário e o ID é liberado
+# (após a conclusão da reserva), para que um reenvio da WhatsApp Cloud API seja processado
+def handle_message(message):
+    claims = []                                         # (etapa de reserva do ID, função de liberação)
+    try:
+        return receive_message(message, claims)
+    except StageTimeoutError as e:
+        for stage, release in claims:
+            stage.future.add_done_callback(lambda future, release=release: release_claimed(future, release))
+        send_text_message(message.get("from"), "Opa, algo deu errado e não consegui analisar sua mensagem. Tente novamente")
+        insert_internal_error("stage_timeout", f"Exception - {e}", message.get("from"))
+        return True
+
+# Libera o ID somente se a reserva foi concluída por esta mensagem (ID de outra entrega em processamento é mantido)
+def release_claimed(future, release):
+    if future.exception() is None and future.result():
+        release()
+
+# Trata mensagem recebida (texto, audio, imagem, botão, reação). Retorna False caso a mensagem não tenha sido tratada
+# Etapas independentes (controle de duplicidade, contato + histórico, URL da mídia) são executadas em paralelo
+def receive_message(message, claims):
+    tel = message.get("from")
+    type_message = message.get("type")
+    id_text = message.get("id")
+    handled = False
 
-                convo = model.start_chat(history = message_history) # Inicia chat, contextualizando a IA com o histórico da conversação
-                convo.send_message(body_message)                    # envia nova mensagem para ser processada pela IA
-                response = convo.last.text                          # Obtem resposta da IA
+    if typing_indicator and type_message in ("text", "audio", "image", "button"):
+        fanout.detach("typing_indicator", send_typing_indicator, id_text)     # Confirmação de leitura + "digitando..." imediatamente
 
-                treated_response, instruction = response_treatment(response)    # Verifica se existem instruções ou comandos enviados pela IA e faz a devida separação da mensagem
+    if type_message in ("text", "button"):
+        claim = fanout.submit("claim_idText", claim_idText, id_text)
+        claims.append((claim, lambda: release_idText(id_text)))
+    elif type_message in ("audio", "image"):
+        id_media = message.get(type_message).get("id")
+        claim = fanout.submit("claim_idMedia", claim_idMedia, id_media)
+        claims.append((claim, lambda: release_idMedia(id_media)))
+        media_url = fanout.submit("get_url_media", get_url_media, id_media)     # obtem URL da mídia (Midia protegida por token - WhastApp Cloud API)
 
-                send_message = send_text_message(tel, treated_response)     # Envia resposta de volta para o usuário através da WhatsApp Cloud API                
-                if send_message:
-                    role = "model"                                          # role=model => mensagem enviada pela IA
-                    store_message(tel, role, treated_response)              # Salva mensagem em banco NO-SQL. 
-                
-                if instruction != "":                                       # Caso exista alguma instrução, analisa a mesma e dá o tratamento devido
-                    handle_instruction(instruction, tel)
+    convo = open_contact_chat(tel)                      # Verifica se contato já existe na base de dados e obtém sessão de chat (contextualizada com o histórico)
 
-            elif type_message == "reaction":
+    # Tratamento de Mensagens de TEXTO
+    if type_message == "text":
+        if not claim.result():                              # Validação para evitar duplicidade de lançamentos, caso a WhatsApp Cloud API envie a mesma mensagem repetidamente
+            return True
+        
+        body_message = message.get("text").get("body")      # Texto da mensagem digitada pelo usuário      
+        role = "user"                                       # role=user => mensagem enviada pelo usuário
+        store_message(tel, role, body_message)              # Salva mensagem em banco NO-SQL. 
+        handled = True
+
+        if handle_command(tel, body_message):               # Comandos PARAR MENSAGENS / ATIVAR CADASTRO
+            return True
+
+        answer_message(tel, convo, body_message)            # Envia mensagem para a IA e devolve resposta ao usuário
+    
+    # Tratamento de Mensagens de AUDIO
+    elif type_message == "audio":                
+        if not claim.result():                              # Validação para evitar duplicidade de lançamentos, caso a WhatsApp Cloud API envie a mesma mensagem repetidamente
+            return True
+        url_media, mime_type = media_url.result()
+        if url_media:               
+            media = download_media_content(url_media, tel)  # Download do audio (em memória, usado em paralelo pelo upload e pela transcrição)
+            if media:
                 handled = True
-                # ... my code => trata Reactions
-                return
-            
-            # Outros tipos de mensagens (imagens, figurinhas, localização, contato, etc)                                             
-            else:               
-                resposta = f"Desculpe ainda não fui programado para analisar mensagens do tipo: *{type_message}*. Envie somente Texto, Áudio ou Imagens"
-                send_text_message(tel, resposta)    # envia resposta de volta para o usuário através da WhatsApp Cloud API       
-
-    # Tratamento de ACK (status da mensagem: aceita, enviada, entregue,lida)
-    if data.get("entry") and data["entry"][0].get("changes"):
-        change = data["entry"][0]["changes"][0]
-        if change.get("value") and change["value"].get("statuses"):
-            statuses = data["entry"][0]["changes"][0]["value"]["statuses"][0]
-            if statuses.get("id"):
-                id_message = data["entry"][0]["changes"][0]["value"]["statuses"][0]["id"]
-                timestamp = data["entry"][0]["changes"][0]["value"]["statuses"][0]["timestamp"]
-                status = data["entry"][0]["changes"][0]["value"]["statuses"][0]["status"]        
+                digest = content_hash(media)               # Identificador da mídia (audios idênticos são armazenados e transcritos uma única vez)
+                # Upload para o Cloud Storage e transcrição de Audio para Texto (Speech-to-Text) com Google Gemini em paralelo
+                stored = fanout.submit("store_audio", store_audio, media, digest, tel, mime_type, timeout=media_stage_timeout)
+                transcription = fanout.submit("audio_analysis", transcribe_audio, media, digest, mime_type, timeout=media_stage_timeout)
+                file_name = stored.result()                 # Salva audio em bucket do Google Cloud Storage 
+                if file_name:
+                    try:    
+                        audio_transcript = transcription.result()
+
+                        role = "user"                                       # role=user => mensagem enviada pelo usuário
+                        store_message(tel, role, audio_transcript)          # Salva mensagem em banco NO-SQL.                                            
+
+                        answer_message(tel, convo, audio_transcript)        # Envia transcrição para a IA e devolve resposta ao usuário
+                    except StageTimeoutError:
+                        raise                                               # Transcrição excedeu o prazo: ID liberado em handle_message
+                    except CircuitOpenError:
+                        send_text_message(tel, "No momento não consigo ouvir audios. Tente novamente em alguns minutos ou envie sua mensagem por texto")
+                        release_idMedia(id_media)                          # IA indisponível: um reenvio do audio será processado
+                    except Exception as e:
+                        send_reply(tel, "Opa, algo deu errado e não consegui analisar sua mensagem. Tente novamente")
+                        insert_internal_error("audio_analysis", f"Exception - {e}", tel)                          
+                else:
+                    send_text_message(tel, "Não foi possível salvar o Audio na Nuvem. Tente Novamente") 
+                    insert_internal_error("audio_store", "Não foi possível salvar o Audio na Nuvem.", tel)
+                    release_idMedia(id_media)                          # Libera o ID para que um reenvio da mídia seja processado
+            else:
+                send_text_message(tel, "Não foi possível obter o Audio. Tente Novamente") 
+                insert_internal_error("audio_get", "Não foi possível obter o Audio junto a WhatsApp Cloud API", tel)
+                release_idMedia(id_media)                          # Libera o ID para que um reenvio da mídia seja processado
+        else:
+            send_text_message(tel, "Não foi possível obter a URL do Audio. Tente Novamente") 
+            insert_internal_error("audio_get", "Não foi possível obter a URL do Audio junto a WhatsApp Cloud API", tel)
+            release_idMedia(id_media)                          # Libera o ID para que um reenvio da mídia seja processado
+
+    # Tratamento de Mensagens com Imagem
+    elif type_message == "image":                
+        if not claim.result():                              # Validação para evitar duplicidade de lançamentos, caso a WhatsApp Cloud API envie a mesma mensagem repetidamente
+            return True
+        url_media, mime_type = media_url.result()           # URL da Imagem (Midia protegida por token - WhastApp Cloud API)
+        if url_media:               
+            media = download_media(url_media, tel)          # Download da imagem (em stream, transferido em blocos para o Cloud Storage)
+            if media:
                 handled = True
-                # ... my code => trata ACK   
+                file_name = store_image(media, tel, mime_type)  # Salva imagem em bucket do Google Cloud Storage (imagens idênticas uma única vez)
+                if file_name:
+                    try:    
+                        path_media = f"/{path_image_messages}/{file_name}"                          
+                        role = "user"                                       # role=user => mensagem enviada pelo usuário
+                        describe = f"Imagem recebida. Path: {path_media}"
+                        store_message(tel, role, describe)                  # Salva mensagem com descrição da imagem em banco NO-SQL.   
+                        update_contact_last_media(tel, file_name)           # Atualiza Contato com File_Name da ultima imagem recebida                                   
+
+                        answer_message(tel, convo, describe)                # Envia descrição da imagem para a IA e devolve resposta ao usuário
+                    except Exception as e:
+                        send_reply(tel, "Opa, algo deu errado e não consegui analisar sua imagem. Tente novamente")
+                        insert_internal_error("image_analysis", f"Exception - {e}", tel)                          
+                else:
+                    send_text_message(tel, "Não foi possível salvar a Imagem na Nuvem. Tente Novamente") 
+                    insert_internal_error("image_store", "Não foi possível salvar a Imagem na Nuvem.", tel)
+                    release_idMedia(id_media)                          # Libera o ID para que um reenvio da mídia seja processado
+            else:
+                send_text_message(tel, "Não foi possível obter a Imagem. Tente Novamente") 
+                insert_internal_error("image_get", "Não foi possível obter a Imagem junto a WhatsApp Cloud API", tel)
+                release_idMedia(id_media)                          # Libera o ID para que um reenvio da mídia seja processado
+        else:
+            send_text_message(tel, "Não foi possível obter a URL da Imagem. Tente Novamente") 
+            insert_internal_error("image_get", "Não foi possível obter a URL da Imagem junto a WhatsApp Cloud API", tel)
+            release_idMedia(id_media)                          # Libera o ID para que um reenvio da mídia seja processado
+    
+    elif type_message == "button":
+        if not claim.result():                       # Validação para evitar duplicidade de lançamentos, caso a WhatsApp Cloud API envie a mesma mensagem repetidamente
+            return True
+        
+        body_message = message.get("button").get("text")    # Texto do botão
+        role = "user"                                       # role=user => mensagem enviada pelo usuário
+        store_message(tel, role, body_message)              # Salva mensagem em banco NO-SQL. 
+        handled = True
+
+        if handle_command(tel, body_message):               # Comandos PARAR MENSAGENS / ATIVAR CADASTRO
+            return True
+        else:
+            contact_update_status(tel, "Ativos")            # Altera status do contato de NOVOS para ATIVOS
+
+        answer_message(tel, convo, body_message)            # Envia texto do botão para a IA e devolve resposta ao usuário
+
+    elif type_message == "reaction":
+        handled = True
+        # ... my code => trata Reactions
     
-    # Atualização de Status de Modelos 
-    if data.get("entry") and data["entry"][0].get("changes"):
-        change = data["entry"][0]["changes"][0]
-        if change.get("field") == "message_template_status_update":
-            event = data["entry"][0]["changes"][0]["value"]["event"] 
-            message_template_id = data["entry"][0]["changes"][0]["value"]["message_template_id"]
-            reason = data["entry"][0]["changes"][0]["value"]["reason"]
-
-            other_info = ""
-            if "other_info" in data["entry"][0]["changes"][0]["value"]:
-                other_info_dict = data["entry"][0]["changes"][0]["value"]["other_info"]
-                if other_info_dict:  
-                    title = other_info_dict.get("title", "")  
-                    description = other_info_dict.get("description", "")  
-                    other_info = f"{title} - {description}"  
-
-            handled = True
-            update_campaign_status(event, message_template_id, reason)                          # Atualiza Status da Campanha
-            
-            if other_info != "": 
-                campaign_name = get_campaign_name(message_template_id)
-                alert = f"Mudança de STATUS da campanha {campaign_name}. Novo status = {other_info}"         # Salva Alerta
-                store_campaign_alert(alert)
-
-    # Atualização de Score de Qualidade de Modelos 
-    if data.get("entry") and data["entry"][0].get("changes"):
-        change = data["entry"][0]["changes"][0]
-        if change.get("field") == "message_template_quality_update":
-            previus = data["entry"][0]["changes"][0]["value"]["previous_quality_score"] 
-            new = data["entry"][0]["changes"][0]["value"]["new_quality_score"]   
-            message_template_id = data["entry"][0]["changes"][0]["value"]["message_template_id"]
-
-            handled = True
-            update_campaign_score(message_template_id, previus, new)            # Atualiza Score da Campanha
-            
-            campaign_name = get_campaign_name(message_template_id)
-            alert = f"Mudança de SCORE da campanha {campaign_name}. Novo score = {new}"     # Salva Alerta
-            store_campaign_alert(alert)
-
-    # Salva notificação não analisada
-    if handled == False:    
-        untreated_notification(data)    # Salva notificação não analisada- Atenção!!! Somente em ambiente de Desenvolvimento para eventuais análises. Desabilitar em ambiente de Produção    
+    # Outros tipos de mensagens (imagens, figurinhas, localização, contato, etc)                                             
+    else:               
+        resposta = f"Desculpe ainda não fui programado para analisar mensagens do tipo: *{type_message}*. Envie somente Texto, Áudio ou Imagens"
+        send_text_message(tel, resposta)    # envia resposta de volta para o usuário através da WhatsApp Cloud API       
+
+    return handled
+
+# Define se a mensagem pode ser agrupada com outras mensagens de TEXTO da mesma rajada (comandos nunca são agrupados)
+def text_batch_fn(message):
+    if coalesce_window <= 0 or message.get("type") != "text":
+        return None
+    body_message = message.get("text").get("body")
+    if body_message.upper() in ("PARAR MENSAGENS", "ATIVAR CADASTRO"):
+        return None
+    return treat_text_batch
+
+# Trata rajada de mensagens de TEXTO de um mesmo contato, enviando-as à IA numa única interação
+@telemetry.traced("text_batch")
+def treat_text_batch(items):
+    tenant, first_message, _ = items[0]
+    tel = first_message.get("from")
+    with use_tenant(tenant):
+        try:
+            try:
+                convo = open_contact_chat(tel)              # Sessão obtida antes de salvar as novas mensagens (igual ao fluxo individual)
+            except StageTimeoutError as e:                  # IDs ainda não reservados: reenvios da WhatsApp Cloud API serão processados
+                send_text_message(tel, "Opa, algo deu errado e não consegui analisar sua mensagem. Tente novamente")
+                insert_internal_error("stage_timeout", f"Exception - {e}", tel)
+                return
+
+            bodies = []
+            for _, message, data in items:
+                id_text = message.get("id")
+                if not claim_idText(id_text):               # Validação para evitar duplicidade de lançamentos
+                    continue
+                body_message = message.get("text").get("body")
+                store_message(tel, "user", body_message)    # Salva mensagem em banco NO-SQL. 
+                bodies.append(body_message)
+
+            if bodies:
+                answer_message(tel, convo, "\n".join(bodies))
+        finally:
+            contacts.flush(tel)                             # Grava numa única escrita as alterações do contato feitas durante o evento
+
+# Verifica se contato já existe na base de dados (cadastrando-o, se necessário) e obtém a sessão de chat do contato
+# Sessões em memória são reaproveitadas; caso contrário, a sessão é iniciada a partir do histórico de mensagens (carregado em paralelo à consulta do contato)
+def open_contact_chat(tel):
+    history_stage = None
+    if not chat_sessions.has(tel):
+        history_stage = fanout.submit("get_menssages", get_menssages, tel)
+    contact = exist_contact(tel)
+    if contact == False:
+        store_contact(tel)
+        return chat_sessions.get(tel, lambda: [])
+    return chat_sessions.get(tel, lambda: history_stage.result() if history_stage else get_menssages(tel))
+
+# Trata comandos enviados pelo usuário. Retorna True caso a mensagem seja um comando
+def handle_command(tel, body_message):
+    if body_message.upper() == "PARAR MENSAGENS":
+        contact_update_status(tel, "Inativos")
+        send_reply(tel, "Ok, *não iremos lhe enviar novas mensagens*. Caso tenha solicitado por engano, digite a palavra *ATIVAR CADASTRO*.")
+        return True
+    elif body_message.upper() == "ATIVAR CADASTRO":
+        contact_update_status(tel, "Ativos")
+        send_reply(tel, "Ok, *cadastro ATIVADO*.")
+        return True
+    return False
+
+# Envia mensagem para a IA (sessão contextualizada com o histórico), devolve a resposta ao usuário e trata eventuais instruções
+# Com o circuito do Gemini aberto, a mensagem é enfileirada para resposta posterior (replay=True: já é uma nova tentativa)
+def answer_message(tel, convo, text, replay=False):
+    history.flush(tel)                                  # Ponto de durabilidade: mensagem do usuário gravada antes da chamada à IA (somente as gravações do contato)
+    send_message = False
+    try:
+        with telemetry.span("gemini_reply"):
+            if reply_streaming:
+                # Resposta em stream: cada parágrafo/frase completo é enviado ao usuário assim que gerado
+                # O circuito do Gemini mede somente a leitura do stream (envios pela WhatsApp Cloud API ficam fora da medição)
+                stream = gemini_breaker.stream(convo.send_message, text, stream=True, request_options=gemini_request_options)
+                with closing(stream):                   # Falha no envio: o resultado é registrado no circuito sem aguardar a coleta do stream
+                    for segment in reply_segments(stream_texts(stream)):
+                        if send_text_message(tel, segment):
+                            send_message = True
+            else:
+                with gemini_breaker.guard():
+                    convo.send_message(text, request_options=gemini_request_options)    # envia nova mensagem para ser processada pela IA
+    except CircuitOpenError:
+        defer_reply(tel, text, notify=not replay)       # IA indisponível: falha imediata, resposta posterior
+        return
+    except Exception:
+        chat_sessions.discard(tel)                      # Sessão pode ter ficado inconsistente: será reconstruída a partir do banco
+        raise
+    telemetry.count_tokens("chat", convo.last)
+    response = convo.last.text                          # Obtem resposta da IA (texto completo)
+
+    treated_response, instruction = response_treatment(response)    # Verifica se existem instruções ou comandos enviados pela IA e faz a devida separação da mensagem
+
+    if not reply_streaming:
+        send_message = send_text_message(tel, treated_response) # Envia resposta de volta para o usuário através da WhatsApp Cloud API                
+    if send_message:
+        role = "model"                                          # role=model => mensagem enviada pela IA
+        store_message(tel, role, treated_response)              # Salva mensagem em banco NO-SQL. 
+    else:
+        chat_sessions.discard(tel)                              # Resposta não entregue/salva: sessão diverge do histórico
     
+    if instruction != "":                               # Caso exista alguma instrução, analisa a mesma e dá o tratamento devido
+        handle_instruction(instruction, tel)
+
+# Enfileira mensagem para resposta quando o circuito do Gemini fechar e avisa o contato (uma única vez por pendência)
+# O aviso não é salvo no histórico: a conversa segue com a resposta da IA à mensagem pendente
+def defer_reply(tel, text, notify=True):
+    first = pending_replies.add(tel, text, active_tenant().phone_number_id)
+    if first and notify:
+        send_text_message(tel, fallback_reply)
+
+# Responde mensagens pendentes do contato (já salvas no histórico) numa única interação com a IA
+@telemetry.traced("pending_reply")
+def retry_pending_reply(tenant, tel, texts):
+    if not texts:
+        return
+    with use_tenant(tenant):
+        try:
+            chat_sessions.discard(tel)
+            convo = chat_sessions.get(tel, lambda: pending_history(tel))
+            answer_message(tel, convo, "\n".join(texts), replay=True)
+        except Exception:
+            defer_reply(tel, "\n".join(texts), notify=False)     # Nova falha da IA: mensagens voltam para a fila
+            raise
+        finally:
+            contacts.flush(tel)
+
+# Histórico do contato sem os turnos do usuário ainda não respondidos (reenviados à IA junto com a nova tentativa)
+def pending_history(tel):
+    turns = get_menssages(tel)
+    while turns and turns[-1]["role"] == "user":
+        turns = turns[:-1]
+    return turns
+
+# Extrai o texto de cada trecho da resposta em stream da IA (trechos sem texto são ignorados)
+def stream_texts(stream):
+    for chunk in stream:
+        try:
+            text = chunk.text
+        except ValueError:
+            continue
+        if text:
+            yield text
+
+# Confirma leitura da mensagem recebida e exibe o indicador "digitando..." enquanto a resposta é preparada
+@telemetry.timed("send_typing_indicator")
+def send_typing_indicator(id_message):
+    try:
+        graph_api.mark_read(id_message, typing=True, sender=active_tenant())
+    except requests.exceptions.RequestException:
+        pass
+
+# Envia resposta fixa (fora da IA) de volta para o usuário através da WhatsApp Cloud API e, em caso de sucesso, salva no histórico
+def send_reply(tel, text_response):
+    chat_sessions.discard(tel)                          # Histórico passa a ter turnos fora da sessão: será reconstruída a partir do banco
+    send_message = send_text_message(tel, text_response)
+    if send_message:
+        role = "model"                                  # role=model => mensagem enviada pela IA
+        store_message(tel, role, text_response)         # Salva mensagem em banco NO-SQL. 
+    return send_message
+
+# Endpoint POST para iniciar (ou retomar) o envio de uma campanha aos contatos ativos
+# O número remetente é informado no parâmetro phone_number_id (ausente = número padrão)
+@app.route("/campaigns/<campaign_id>/broadcast", methods=["POST"])
+def start_broadcast(campaign_id):
+    if not broadcast_authorized():
+        return jsonify({"status": "Unauthorized"}), 401
+    tenant = request_tenant()
+    if tenant is None:
+        return jsonify({"status": "Número não cadastrado"}), 404
+    try:
+        started = broadcaster.for_tenant(tenant).start(campaign_id)
+    except ValueError as e:
+        return jsonify({"status": f"{e}"}), 404
+    if not started:
+        return jsonify({"status": "Campanha já está em andamento"}), 409
+    return jsonify({"status": "Ok"}), 202
+
+# Endpoint POST para pausar o envio de uma campanha
+@app.route("/campaigns/<campaign_id>/pause", methods=["POST"])
+def pause_broadcast(campaign_id):
+    if not broadcast_authorized():
+        return jsonify({"status": "Unauthorized"}), 401
+    tenant = request_tenant()
+    if tenant is None:
+        return jsonify({"status": "Número não cadastrado"}), 404
+    broadcaster.for_tenant(tenant).pause(campaign_id, "Pausa manual")
     return jsonify({"status": "Ok"}), 200
 
+# Número informado no parâmetro phone_number_id da requisição (ausente = número padrão). Retorna None caso não esteja cadastrado
+def request_tenant():
+    phone_number_id = request.args.get("phone_number_id")
+    return tenants.get(phone_number_id) if phone_number_id else tenants.default
+
+# Valida token de acesso aos endpoints de campanhas
+def broadcast_authorized():
+    return bool(broadcast_token) and request.headers.get("Authorization") == f"Bearer {broadcast_token}"
+
+# Valida token de acesso às métricas (sem METRICS_TOKEN configurado, a rota é negada)
+def metrics_authorized():
+    return bool(metrics_token) and request.headers.get("Authorization") == f"Bearer {metrics_token}"
+
+# Endpoint GET com as métricas no formato Prometheus (etapas, Firestore, Gemini, Graph API)
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    if not metrics_authorized():
+        return jsonify({"status": "Unauthorized"}), 401
+    body, content_type = telemetry.metrics_response()
+    return body, 200, {"Content-Type": content_type}
+
 # Endpoint GET para validação do webhook junto a WhatsApp Cloud API
 @app.route("/webhook", methods=["GET"])
 def verify_webhook():
@@ -385,13 +928,9 @@ def verify_webhook():
     else:
         return "Invalid request", 400
 
-# Envia mensagem de texto para a WhatsApp Cloud API
-def send_text_message(tel, text_response):
-    
-    url_base = os.environ.get("URL_BASE") 
-    id_tel = os.environ.get("ID_TEL") 
-    token = os.environ.get("TOKEN") 
-
+# Envia mensagem de texto para a WhatsApp Cloud API (através do despachante: fila de prioridade + controle de vazão)
+@telemetry.timed("send_text_message")
+def send_text_message(tel, text_response, priority=PRIORITY_REPLY):
     data = {
         "messaging_product": "whatsapp",
         "recipient_type": "individual",
@@ -403,44 +942,39 @@ def send_text_message(tel, text_response):
         }
     }
 
-    url = f"{url_base}/{id_tel}/messages"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {token}"
-    }
-
-    response = requests.post(url, headers=headers, json=data)
+    try:
+        response = outbound.submit(tel, data, priority).result(timeout=outbound_send_timeout)
+    except Exception as e:
+        insert_internal_error("send_text_message", f"Exception - {e}", tel)
+        return False  # Indica falha
 
     if response.status_code == 200:
         json_response = response.json()
         if json_response.get("messages") and json_response["messages"][0].get("id"):            
             return True  # Indica sucesso
-    else:
-        return False  # Indica falha        
+    return False  # Indica falha        
 
 # Obtem URL do audio enviado pela WhatsApp Cloud API
+@telemetry.timed("get_url_media")
 def get_url_media(id_media):    
-    url = f"{url_base}/{id_media}"
-    headers = {
-        "Authorization": f"Bearer {token}"
-    }
-    response = requests.get(url, headers=headers)
+    try:
+        response = graph_api.get_media_info(id_media, sender=active_tenant())
+    except requests.exceptions.RequestException:
+        return False, False
     if response.status_code == 200:
-        url_response = response.json().get("url")
-        mime_type = response.json().get("mime_type")
+        json_response = response.json()
+        url_response = json_response.get("url")
+        mime_type = json_response.get("mime_type")
         return url_response, mime_type
     else:
         return False, False
 
-# Realiza o Download de midia (audio/video) 
+# Inicia o Download de midia (audio/video) 
 def download_media(url_media, tel):    
-    headers = {
-        "Authorization": f"Bearer {token}"
-    }
     try:
-        response = requests.get(url_media, headers=headers, stream=True)
+        response = graph_api.download(url_media, stream=True, sender=active_tenant())
         response.raise_for_status()  
-        return response.content
+        return response                                     # Resposta em stream: o conteúdo é lido em blocos por download_media_content
     except requests.exceptions.RequestException as e:
         error_message = f"Erro ao baixar o arquivo de áudio: {e}"
         insert_internal_error("download_media", error_message, tel)
@@ -450,137 +984,134 @@ def download_media(url_media, tel):
         insert_internal_error("download_media", error_message, tel)
         return False
     
-# Salva Audio em Bucket do Google Cloud Storage e retorna seu nome
-def store_audio(media, tel, mime_type):
-    storage_client = storage.Client()           
-    bucket = storage_client.bucket(audio_bucket_name)         # Bucket em que será salvo a midia
-
-    if mime_type == "audio/aac":
-        extension = "aac"
-    elif mime_type == "audio/amr":
-        extension = "amr"
-    elif mime_type == "audio/mpeg":
-        extension = "mp3"
-    elif mime_type == "audio/mp4":
-        extension = "m4a"        
-    elif mime_type == "audio/ogg":
-        extension = "ogg"        
-
-    file_name = f"{tel}_{int(time.time())}.{extension}"         # Nome do arquivo a ser salvo (concatena número do telefone + timestamp)
-    blob = bucket.blob(file_name)               
+# Download completo da mídia para a memória. Retorna o conteúdo ou False em caso de falha (inclusive mídia acima do limite)
+@telemetry.timed("download_media")
+def download_media_content(url_media, tel):
+    media = download_media(url_media, tel)
+    if not media:
+        return False
+    try:
+        return read_media(media, max_bytes=media_max_bytes)
+    except Exception as e:
+        insert_internal_error("download_media", f"Erro ao baixar o arquivo de mídia: {e}", tel)
+        return False
+
+# Transcrição de Audio para Texto (Speech-to-Text) utilizando Google Gemini / multimodal prompt
+# A transcrição fica associada ao hash do conteúdo: audios repetidos (ex.: encaminhados) não são enviados novamente à IA
+@telemetry.timed("transcribe_audio")
+def transcribe_audio(media, digest, mime_type):
+    audio_transcript = media_index.get_analysis(digest, "transcript")
+    if audio_transcript is not None:
+        return audio_transcript
+    # Audios longos são divididos em trechos transcritos em paralelo e unidos na ordem original
+    segments = split_opus(media, audio_segment_seconds) if mime_type.startswith("audio/ogg") else [media]
+    if len(segments) == 1:
+        audio_transcript = transcribe_segment(media, mime_type)
+    else:
+        trace = telemetry.current_trace()
+
+        def transcribe_in_trace(segment):
+            with telemetry.use_trace(trace):
+                return transcribe_segment(segment, mime_type)
+
+        transcripts = transcription_executor.map(transcribe_in_trace, segments, timeout=media_stage_timeout)
+        audio_transcript = " ".join(text.strip() for text in transcripts)
+    media_index.set_analysis(digest, "transcript", audio_transcript)
+    return audio_transcript
+
+# Transcreve audio (ou trecho) enviando o conteúdo diretamente da memória (inline), sem upload prévio à File API do Gemini
+@telemetry.timed("transcribe_segment")
+def transcribe_segment(media, mime_type):
+    if len(media) > inline_audio_max_bytes:
+        with telemetry.span("gemini_upload_file"):
+            audio_media = upload_audio_file(media, mime_type)                           # Acima do limite da requisição: File API
+    else:
+        audio_media = {"mime_type": mime_type.split(";")[0].strip(), "data": media}    # Sem parâmetros (ex.: "audio/ogg; codecs=opus")
+    with gemini_breaker.guard():
+        audio_analysis = audio_model.generate_content(["Transcreva este audio", audio_media], request_options=gemini_request_options)
+    telemetry.count_tokens("audio", audio_analysis)
+    return audio_analysis.text
+
+# Envia audio à File API do Gemini. upload_file aceita somente caminho de arquivo: o conteúdo é gravado em arquivo temporário
+# (removido ao final do upload)
+def upload_audio_file(media, mime_type):
+    with tempfile.NamedTemporaryFile(prefix="audio-") as file:
+        file.write(media)
+        file.flush()
+        return genai.upload_file(path=file.name, mime_type=mime_type.split(";")[0].strip())
+
+# Salva Audio (conteúdo em memória) em Bucket do Google Cloud Storage e retorna seu nome (hash do conteúdo + extensão)
+@telemetry.timed("store_audio")
+def store_audio(media, digest, tel, mime_type):
     try:
-        blob.upload_from_string(media, content_type=mime_type)  # Realiza o Upload do arquivo para o Cloud Storage      
-        return file_name        
+        return gcs_breaker.call(media_index.store, media, digest, active_tenant().audio_bucket_name, mime_type)     # Conteúdo já armazenado não é enviado novamente
     except Exception as e:
         error_message = f"Erro ao tentar salvar Áudio no Bucket da Google Cloud Storage. Detalhes: {e}"
         insert_internal_error("store_audio", error_message, tel)
         return False
 
-# Salva Imagem em Bucket do Google Cloud Storage e retorna seu nome
-def store_image(media, tel, mime_type):
-    storage_client = storage.Client()           
-    bucket = storage_client.bucket(image_bucket_name)           # Bucket em que será salvo a midia
-    
-    if mime_type == "image/jpeg":
-        extension = "jpeg"
-    elif mime_type == "image/png":
-        extension = "png"
-    elif mime_type == "image/webp":
-        extension = "webp"
-
-    file_name = f"{tel}_{int(time.time())}.{extension}"             # Nome do arquivo a ser salvo (concatena número do telefone + timestamp)
-    blob = bucket.blob(file_name)               
+# Transfere Imagem (download em stream) para Bucket do Google Cloud Storage e retorna seu nome (hash do conteúdo + extensão)
+@telemetry.timed("store_image")
+def store_image(response, tel, mime_type):
     try:
-        blob.upload_from_string(media, content_type=mime_type)    # Realiza o Upload do arquivo para o Cloud Storage      
-        return file_name        
+        _, file_name = gcs_breaker.call(media_index.store_stream, response, active_tenant().image_bucket_name, mime_type, media_max_bytes)
+        return file_name                                    # Conteúdo já armazenado não é copiado novamente
     except Exception as e:
         error_message = f"Erro ao tentar salvar IMAGEM no Bucket da Google Cloud Storage. Detalhes: {e}"
         insert_internal_error("store_image", error_message, tel)
         return False
+    finally:
+        response.close()                                    # Circuito aberto: a transferência não chegou a ser iniciada
 
 # Salva mensagem em banco No-SQL para recuperação de histórico de conversa
+@telemetry.timed("store_message")
 def store_message(tel, role, message):
     try:
-        doc_ref = db.collection(f"message_history_{tel}").document()
-        doc_ref.set({
-            "timestamp": int(time.time()),
-            "role": role,
-            "parts": [message]
-        })    
+        history.append(tel, role, message)
     except Exception as e:
         print(f"Erro ao salvar mensagem no Firebase/FireStore. Detalhes: {e}")
         return False
     
-# Salva id da Midia recebida 
-def store_idMedia(id_media):
-    doc_ref = db.collection("id_medias").document()
-    doc_ref.set({
-            "timestamp": int(time.time()),
-            "id_media": id_media
-        })    
-
-# Verifica se mídia já foi recebida - para evitar duplicidades
-def exist_idMedia(id_media):
-    mensagens_ref = db.collection("id_medias").where("id_media", "==", id_media)
-    mensagens = mensagens_ref.stream()
-    response = False
-    for mensagem in mensagens:
-        response = True    
-    return response
-
-# Salva id do texto recebido
-def store_idText(id_text):
-    doc_ref = db.collection("id_text").document()
-    doc_ref.set({
-            "timestamp": int(time.time()),
-            "id_text": id_text
-        })   
-    
-# Verifica se texto já foi recebido - para evitar duplicidades
-def exist_idText(id_text):
-    mensagens_ref = db.collection("id_text").where("id_text", "==", id_text)
-    mensagens = mensagens_ref.stream()
-    response = False
-    for mensagem in mensagens:
-        response = True    
-    return response
+# Reserva id da Midia recebida. Retorna False caso a mídia já tenha sido recebida - para evitar duplicidades
+@telemetry.timed("claim_idMedia")
+def claim_idMedia(id_media):
+    return id_medias.claim(id_media)
+
+# Libera id da Midia (falha no processamento), permitindo o reprocessamento em caso de reenvio
+def release_idMedia(id_media):
+    id_medias.release(id_media)
+
+# Reserva id do texto recebido. Retorna False caso o texto já tenha sido recebido - para evitar duplicidades
+@telemetry.timed("claim_idText")
+def claim_idText(id_text):
+    return id_texts.claim(id_text)
+
+# Libera id do texto (falha no processamento), permitindo o reprocessamento em caso de reenvio
+def release_idText(id_text):
+    id_texts.release(id_text)
 
 # Obtem histórico de mensagens do telefone, a partir de Banco No-SQL hospedado na Google Cloud FireStore/Firebase
+# Somente a janela mais recente é carregada; turnos antigos são representados pelo resumo da conversa
+@telemetry.timed("get_menssages")
 def get_menssages(tel):
-    mensagens_ref = db.collection(f"message_history_{tel}").order_by("timestamp")
-    mensagens = mensagens_ref.stream()
-
-    # Lista para armazenar as mensagens formatadas
-    messages_array = []
-
-    for mensagem in mensagens:
-        message_dict = mensagem.to_dict()
-        # Cria o formato desejado para cada mensagem
-        formatted_message = {
-            "role": message_dict["role"],
-            "parts": message_dict["parts"]
-        }
-        messages_array.append(formatted_message)
-
-    return messages_array
+    return history.load(tel)
 
 # Salvar notificações da WhatsApp Cloud API recebidas e não analisada 
-def untreated_notification(doc):
-    doc_ref = db.collection("notifications").document()
-    doc_ref.set(doc)
+def untreated_notification(doc, batch=None):
+    doc_ref = active_tenant().db.collection("notifications").document()
+    if batch:
+        batch.set(doc_ref, doc)
+    else:
+        firestore_writer.set(doc_ref, doc)
 
 # Verifica se contato existe
+@telemetry.timed("exist_contact")
 def exist_contact(tel):
-    response = False
-    docs = db.collection("contacts").where("Telefone", "==", tel).stream()
-    for doc in docs:
-        response = True
-    return response    
+    return contacts.get(tel) is not None
 
-# Salva contato
+# Salva contato (gravado junto com as demais alterações do evento, no flush do contato)
 def store_contact(tel):    
-    doc_ref = db.collection("contacts").document()
-    doc_ref.set({
+    contacts.update(tel, {
             "Telefone": tel,
             "Nome": "",
             "Nascimento": "",
@@ -593,26 +1124,20 @@ def store_contact(tel):
 
 #  Atualiza Contato
 def update_contact(tel, nome, bairro, nascimento, sexo, ocupacao):
-    doc_ref = db.collection("contacts").where("Telefone", "==", tel).get()    
     new_doc = {'Nome': nome, 'Nascimento' : nascimento, 'Sexo': sexo, 'Ocupacao': ocupacao, 'Bairro': bairro}  
-    if doc_ref:
-        doc_ref[0].reference.update(new_doc)
+    if exist_contact(tel):
+        contacts.update(tel, new_doc)
 
 #  Atualiza Contato com File_Name da ultima imagem recebida 
 def update_contact_last_media(tel, file_name):
-    doc_ref = db.collection("contacts").where("Telefone", "==", tel).get()    
     update_doc = {'last_media': file_name}  
-    if doc_ref:
-        doc_ref[0].reference.update(update_doc)
+    if exist_contact(tel):
+        contacts.update(tel, update_doc)
 
 # Obtem file_name da ultima imagem recebida, referente ao novo chamado
 def get_contact_last_media(tel):
-    last_media = ""
-    doc_ref = db.collection("contacts").where("Telefone", "==", tel).get()    
-    if doc_ref:
-        media_dict = doc_ref[0].to_dict()
-        last_media = media_dict["last_media"]
-    return last_media
+    contact = contacts.get(tel) or {}
+    return contact.get("last_media", "")
 
 # Verifica se existem instruções ou comandos enviados pela IA e faz a devida separação da mensagem
 def response_treatment(message: str):
@@ -629,6 +1154,7 @@ def response_treatment(message: str):
 
 # Analisa instrução e dá o devido tratamento
 # Para acréscimos de novas instruções devem ser implementados ajustes no Prompt e no código
+@telemetry.timed("handle_instruction")
 def handle_instruction(instruction: str, tel):
     details = instruction.split("#")
     instruction_type = details[2]
@@ -663,14 +1189,14 @@ def handle_instruction(instruction: str, tel):
             insert_request(colection, data)      
             update_contact(tel, nome, bairro, nascimento, sexo, ocupacao)  
         except Exception as e:
-            insert_internal_error("requests", e, tel)        
+            insert_internal_error("requests", f"Exception - {e}", tel)
     else:
         insert_internal_error("requests", f"Instrução desconhecida - {instruction}", tel)
         
 # Insere Chamado em Banco de Dados
 def insert_request(colection, data):
-    doc_ref = db.collection(colection).document()
-    doc_ref.set(data)
+    doc_ref = active_tenant().db.collection(colection).document()
+    firestore_writer.set(doc_ref, data)
 
 # Insere eventuais registros de erro em banco NoSQL
 def insert_internal_error(operation, error_message, tel):
@@ -680,16 +1206,19 @@ def insert_internal_error(operation, error_message, tel):
         "error": error_message,
         "timestamp": int(time.time()),
     }
-    doc_ref = db.collection("internal_error").document()
-    doc_ref.set(data)
+    doc_ref = active_tenant().db.collection("internal_error").document()
+    firestore_writer.set(doc_ref, data)
 
 #  Atualiza Status de Campanhas Promocionais
-def update_campaign_status(event, message_template_id, reason):
+def update_campaign_status(event, message_template_id, reason, batch=None):
     if reason == None: reason = ""
     doc_ref = db.collection("campaigns").where("ID_Modelo", "==", f"{message_template_id}").get()    
     new_doc = {'Status': event, "Obs": reason}    
     if doc_ref:        
-        doc_ref[0].reference.update(new_doc)
+        if batch:
+            batch.update(doc_ref[0].reference, new_doc)
+        else:
+            doc_ref[0].reference.update(new_doc)
 
 def get_campaign_name(message_template_id):
     response = ""
@@ -700,31 +1229,41 @@ def get_campaign_name(message_template_id):
     return response 
 
 # Salva Alertas relativos a Campanhas Promocionais
-def store_campaign_alert(alert):
+def store_campaign_alert(alert, batch=None):
     doc_ref = db.collection("alerts").document()
-    doc_ref.set({
+    doc = {
             "Descricao": alert,
             "timestamp": int(time.time())
-        })
+        }
+    if batch:
+        batch.set(doc_ref, doc)
+    else:
+        firestore_writer.set(doc_ref, doc)
 
 # Salva json de requisição recebida. Para efeito de depuração
 def store_json(data):
-    doc_ref = db.collection("log_messages").document()
-    doc_ref.set(data)
+    doc_ref = active_tenant().db.collection("log_messages").document()
+    firestore_writer.set(doc_ref, data)
 
 # Inativar Cadastro
 def contact_update_status(tel, new_status):
-    doc_ref = db.collection("contacts").where("Telefone", "==", tel).get()    
     new_doc = {'Tipo_Contato': new_status}  
-    if doc_ref:
-        doc_ref[0].reference.update(new_doc)
+    if exist_contact(tel):
+        contacts.update(tel, new_doc)
 
 # Atualiza Score de Campanhas Promocionais
-def update_campaign_score(message_template_id, previus, new):
+def update_campaign_score(message_template_id, previus, new, batch=None):
     doc_ref = db.collection("campaigns").where("ID_Modelo", "==", f"{message_template_id}").get()    
     new_doc = {'Score_qualidade_atual': new, "Score_qualidade_anterior": previus}    
     if doc_ref:        
-        doc_ref[0].reference.update(new_doc)
+        if batch:
+            batch.update(doc_ref[0].reference, new_doc)
+        else:
+            doc_ref[0].reference.update(new_doc)
+
+if not startup_warm_up:
+    startup_profile.report(build_times)         # STARTUP_PROFILE=1: custo de importação por pacote (com pré-carga, relatado ao final dela)
 
 if __name__ == "__main__":
+    start_process()
     app.run(debug=True, host="0.0.0.0", port=int(os.environ.get("PORT", 8080)))
\ No newline at end of file
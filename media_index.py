@@ -0,0 +1,113 @@
+# Índice de mídias endereçadas por conteúdo (Firestore - coleção "media_index", ID do documento = SHA-256 do conteúdo)
+# Bytes idênticos (ex.: audio/imagem encaminhado várias vezes) são gravados uma única vez no Cloud Storage e
+# o resultado das análises da IA (ex.: transcrição) fica associado ao hash, dispensando nova chamada ao Gemini.
+# Os registros mais acessados ficam em cache local limitado por quantidade e tamanho (LRU/TTL)
+# Mídias transferidas em stream (hash conhecido só ao final) são gravadas num arquivo temporário (TEMP_PREFIX) e copiadas para o nome
+# definitivo. Arquivos temporários órfãos (ex.: processo encerrado durante a transferência) devem ser removidos por regra de ciclo
+# de vida do bucket (prefixo TEMP_PREFIX)
+import hashlib
+import time
+import uuid
+
+from media_store import copy_in_bucket, delete_from_bucket, stream_to_bucket, upload_to_bucket
+from ttl_cache import TTLCache
+
+COLLECTION = "media_index"
+TEMP_PREFIX = "tmp/"
+_MISSING = object()
+
+EXTENSIONS = {
+    "audio/aac": "aac",
+    "audio/amr": "amr",
+    "audio/mpeg": "mp3",
+    "audio/mp4": "m4a",
+    "audio/ogg": "ogg",
+    "image/jpeg": "jpeg",
+    "image/png": "png",
+    "image/webp": "webp",
+}
+
+
+# Hash do conteúdo (identificador da mídia)
+def content_hash(content):
+    return hashlib.sha256(content).hexdigest()
+
+
+class MediaIndex:
+    def __init__(self, db, writer, cache_items=2000, cache_chars=2_000_000, cache_ttl=3600, cache=None):
+        self.db = db
+        self.writer = writer                        # BufferedWriter (gravação dos registros do índice)
+        self.cache = cache if cache is not None else new_cache(cache_items, cache_chars, cache_ttl)   # hash => registro (ou None, quando não existe)
+
+    def doc_ref(self, digest):
+        return self.db.collection(COLLECTION).document(digest)
+
+    # Registro da mídia (cache => Firestore). Retorna None caso a mídia ainda não tenha sido recebida
+    def get(self, digest):
+        record = self.cache.get(digest, _MISSING)
+        if record is not _MISSING:
+            return record
+        doc = self.doc_ref(digest).get()
+        record = doc.to_dict() if doc.exists else None
+        self.cache.add(digest, record)
+        return self.cache.get(digest, record)
+
+    # Grava a mídia no bucket (somente se ainda não existir) e retorna o nome do arquivo (hash + extensão)
+    def store(self, content, digest, bucket_name, mime_type):
+        return self._store(digest, bucket_name, mime_type, len(content),
+                lambda file_name: upload_to_bucket(content, bucket_name, file_name, mime_type, create_only=True))
+
+    # Transfere a mídia (resposta HTTP em stream) para o bucket sem mantê-la em memória. Retorna (hash, nome do arquivo)
+    # O conteúdo é gravado num arquivo temporário e copiado para o nome definitivo somente se ainda não existir
+    def store_stream(self, response, bucket_name, mime_type, max_bytes=None):
+        temp_name = f"{TEMP_PREFIX}{uuid.uuid4().hex}"
+        size, digest = stream_to_bucket(response, bucket_name, temp_name, mime_type, max_bytes=max_bytes)
+        try:
+            file_name = self._store(digest, bucket_name, mime_type, size,
+                    lambda file_name: copy_in_bucket(bucket_name, temp_name, file_name, create_only=True))
+        finally:
+            try:
+                delete_from_bucket(bucket_name, temp_name)
+            except Exception as e:
+                print(f"Falha ao remover o arquivo temporário {temp_name} do bucket {bucket_name}. Detalhes: {e}")
+        return digest, file_name
+
+    def _store(self, digest, bucket_name, mime_type, size, upload):
+        record = self.get(digest)
+        if record and record.get("bucket") == bucket_name:
+            return record["file_name"]                  # Conteúdo já armazenado: dispensa o upload
+
+        file_name = f"{digest}.{EXTENSIONS.get(mime_type, 'bin')}"
+        upload(file_name)
+        record = dict(record or {}, bucket=bucket_name, file_name=file_name, mime_type=mime_type,
+                size=size, created=int(time.time()))
+        self.writer.set(self.doc_ref(digest), record, merge=True)
+        self.cache.set(digest, record)
+        return file_name
+
+    # Resultado de análise da IA associado à mídia (ex.: "transcript"). Retorna None caso ainda não exista
+    def get_analysis(self, digest, kind):
+        record = self.get(digest)
+        return (record or {}).get("analysis", {}).get(kind)
+
+    def set_analysis(self, digest, kind, result):
+        self.writer.set(self.doc_ref(digest), {"analysis": {kind: result}}, merge=True)
+        record = dict(self.get(digest) or {})
+        record["analysis"] = dict(record.get("analysis", {}), **{kind: result})
+        self.cache.set(digest, record)
+
+    # Métricas do cache local
+    def cache_stats(self):
+        return self.cache.stats()
+
+
+# Cache de registros limitado por quantidade e caracteres das análises (pode ser compartilhado entre números via ScopedCache)
+def new_cache(cache_items=2000, cache_chars=2_000_000, cache_ttl=3600):
+    return TTLCache(max_items=cache_items, ttl=cache_ttl, max_weight=cache_chars, weigh=_record_chars)
+
+
+# Peso do registro no cache (caracteres das análises armazenadas)
+def _record_chars(record):
+    if not record:
+        return 1
+    return 1 + sum(len(f"{result}") for result in record.get("analysis", {}).values())
@@ -0,0 +1,134 @@
+# Armazenamento de mídias (audio/imagem) no Google Cloud Storage
+# Imagens: o download da WhatsApp Cloud API é transferido em blocos diretamente para um upload resumable (stream_to_bucket),
+# com o hash calculado durante a transferência; memória por transferência = um bloco, independente do tamanho da mídia.
+# Audios: o conteúdo é necessário em memória para a transcrição (read_media), limitado por MEDIA_MAX_BYTES
+import hashlib
+import io
+import threading
+
+from lazy_init import Lazy, on_fork
+
+CHUNK_SIZE = 1024 * 1024                    # Tamanho de cada bloco (múltiplo de 256 KB, exigido pelo upload resumable)
+
+_buckets = {}
+_lock = threading.Lock()
+
+
+class MediaTooLargeError(Exception):
+    pass
+
+
+def _new_storage_client():
+    from google.cloud import storage
+    return storage.Client()
+
+
+_storage_client = Lazy("storage", _new_storage_client)
+
+
+# Processo filho (fork): os handles de bucket referenciam o cliente do processo pai
+def _after_fork():
+    global _lock
+    _lock = threading.Lock()
+    _buckets.clear()
+
+
+on_fork(_after_fork)
+
+
+# Cliente do Cloud Storage compartilhado pelo processo
+def get_storage_client():
+    return _storage_client.get()
+
+
+# Handle de bucket reutilizado entre chamadas
+def get_bucket(bucket_name):
+    bucket = _buckets.get(bucket_name)
+    if bucket is None:
+        with _lock:
+            bucket = _buckets.get(bucket_name)
+            if bucket is None:
+                bucket = get_storage_client().bucket(bucket_name)
+                _buckets[bucket_name] = bucket
+    return bucket
+
+
+# Rejeita antecipadamente mídias cujo tamanho informado (Content-Length) ultrapasse max_bytes
+def _check_length(response, max_bytes):
+    content_length = response.headers.get("Content-Length")
+    if max_bytes and content_length and content_length.isdigit() and int(content_length) > max_bytes:
+        response.close()
+        raise MediaTooLargeError(f"Mídia excede o limite de {max_bytes} bytes")
+
+
+# Transfere resposta HTTP (stream=True) para o bucket, bloco a bloco. Memória máxima por transferência = chunk_size
+# Retorna (bytes gravados, SHA-256 do conteúdo). Lança MediaTooLargeError caso a mídia ultrapasse max_bytes
+def stream_to_bucket(response, bucket_name, file_name, mime_type, chunk_size=CHUNK_SIZE, max_bytes=None):
+    _check_length(response, max_bytes)
+
+    blob = get_bucket(bucket_name).blob(file_name, chunk_size=chunk_size)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with blob.open("wb", content_type=mime_type, ignore_flush=True) as writer:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                if not chunk:
+                    continue
+                size += len(chunk)
+                if max_bytes and size > max_bytes:
+                    raise MediaTooLargeError(f"Mídia excede o limite de {max_bytes} bytes")
+                digest.update(chunk)
+                writer.write(chunk)
+    except Exception:
+        blob.delete()                       # Remove o upload parcial finalizado ao fechar o writer
+        raise
+    finally:
+        response.close()
+    return size, digest.hexdigest()
+
+
+# Lê resposta HTTP (stream=True) para a memória, permitindo usar o conteúdo em etapas paralelas (upload e análise pela IA)
+# O BytesIO devolve o próprio buffer em getvalue() (sem a cópia final): pico de memória ~ tamanho da mídia
+# Lança MediaTooLargeError caso a mídia ultrapasse max_bytes
+def read_media(response, chunk_size=CHUNK_SIZE, max_bytes=None):
+    _check_length(response, max_bytes)
+    content = io.BytesIO()
+    try:
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            content.write(chunk)
+            if max_bytes and content.tell() > max_bytes:
+                raise MediaTooLargeError(f"Mídia excede o limite de {max_bytes} bytes")
+    finally:
+        response.close()
+    return content.getvalue()
+
+
+# Grava no bucket conteúdo já em memória. create_only=True: não sobrescreve arquivo existente (retorna False nesse caso)
+def upload_to_bucket(content, bucket_name, file_name, mime_type, create_only=False):
+    from google.api_core.exceptions import PreconditionFailed
+
+    blob = get_bucket(bucket_name).blob(file_name)
+    try:
+        if create_only:
+            blob.upload_from_string(content, content_type=mime_type, if_generation_match=0)
+        else:
+            blob.upload_from_string(content, content_type=mime_type)
+    except PreconditionFailed:
+        return False                                # Arquivo já existente (mesmo conteúdo, quando o nome é o hash)
+    return len(content)
+
+
+# Copia arquivo dentro do bucket (sem trafegar o conteúdo). create_only=True: não sobrescreve arquivo existente (retorna False nesse caso)
+def copy_in_bucket(bucket_name, source_name, file_name, create_only=False):
+    from google.api_core.exceptions import PreconditionFailed
+
+    bucket = get_bucket(bucket_name)
+    try:
+        bucket.copy_blob(bucket.blob(source_name), bucket, file_name, if_generation_match=0 if create_only else None)
+    except PreconditionFailed:
+        return False                                # Arquivo já existente (mesmo conteúdo, quando o nome é o hash)
+    return True
+
+
+def delete_from_bucket(bucket_name, file_name):
+    get_bucket(bucket_name).blob(file_name).delete()
@@ -0,0 +1,137 @@
+# Interpretação das notificações da WhatsApp Cloud API
+# Percorre, numa única passagem, todas as entradas (entry), alterações (changes), mensagens e status do payload,
+# gerando eventos compactos que são despachados em conjunto
+try:
+    from orjson import loads as _loads
+except ImportError:
+    from json import loads as _loads
+
+
+# Mensagem recebida de um contato
+class MessageEvent:
+    __slots__ = ("phone_number_id", "tel", "type", "id", "message")
+
+    def __init__(self, phone_number_id, message):
+        self.phone_number_id = phone_number_id
+        self.tel = message.get("from")
+        self.type = message.get("type")
+        self.id = message.get("id")
+        self.message = message                  # Mensagem original (texto, audio, imagem, botão, etc)
+
+
+# ACK - status de mensagem enviada (sent, delivered, read, failed)
+class StatusEvent:
+    __slots__ = ("phone_number_id", "id", "status", "timestamp", "recipient_id", "campaign_id", "errors")
+
+    def __init__(self, phone_number_id, status):
+        self.phone_number_id = phone_number_id
+        self.id = status.get("id")
+        self.status = status.get("status")
+        self.timestamp = status.get("timestamp")
+        self.recipient_id = status.get("recipient_id")
+        self.campaign_id = status.get("biz_opaque_callback_data")      # Informado no envio das campanhas
+        self.errors = status.get("errors")
+
+
+# Atualização de Status de Modelos (campanhas)
+class TemplateStatusEvent:
+    __slots__ = ("event", "message_template_id", "reason", "other_info")
+
+    def __init__(self, value):
+        self.event = value.get("event")
+        self.message_template_id = value.get("message_template_id")
+        self.reason = value.get("reason")
+        self.other_info = ""
+        other_info_dict = value.get("other_info")
+        if other_info_dict:
+            title = other_info_dict.get("title", "")
+            description = other_info_dict.get("description", "")
+            self.other_info = f"{title} - {description}"
+
+
+# Atualização de Score de Qualidade de Modelos (campanhas)
+class TemplateQualityEvent:
+    __slots__ = ("message_template_id", "previous", "new")
+
+    def __init__(self, value):
+        self.message_template_id = value.get("message_template_id")
+        self.previous = value.get("previous_quality_score")
+        self.new = value.get("new_quality_score")
+
+
+# Alteração não tratada (salva para eventuais análises)
+class UnhandledEvent:
+    __slots__ = ("phone_number_id", "field", "value")
+
+    def __init__(self, phone_number_id, field, value):
+        self.phone_number_id = phone_number_id      # None = alteração da conta (sem número)
+        self.field = field
+        self.value = value
+
+
+# Alteração de mensagens (field "messages"): mensagens recebidas e ACKs
+def _route_messages(phone_number_id, field, value, events):
+    handled = False
+    for message in value.get("messages") or ():
+        events.append(MessageEvent(phone_number_id, message))
+        handled = True
+    for status in value.get("statuses") or ():
+        if status.get("id"):
+            events.append(StatusEvent(phone_number_id, status))
+            handled = True
+    if not handled:
+        events.append(UnhandledEvent(phone_number_id, field, value))
+
+
+def _route_template_status(phone_number_id, field, value, events):
+    events.append(TemplateStatusEvent(value))
+
+
+def _route_template_quality(phone_number_id, field, value, events):
+    events.append(TemplateQualityEvent(value))
+
+
+def _route_unhandled(phone_number_id, field, value, events):
+    events.append(UnhandledEvent(phone_number_id, field, value))
+
+
+# Roteamento pré-calculado por (phone_number_id, field). Alterações de outros números são descartadas sem processamento
+class PayloadRouter:
+    def __init__(self, phone_number_ids):
+        self.phone_number_ids = frozenset(phone_number_ids)
+        self.routes = {
+            (None, "message_template_status_update"): _route_template_status,      # Eventos da conta (sem metadata/número)
+            (None, "message_template_quality_update"): _route_template_quality,
+        }
+        for phone_number_id in self.phone_number_ids:
+            self.routes[(phone_number_id, "messages")] = _route_messages
+        # Filtro rápido sobre o corpo bruto: payloads que não citam nenhum número atendido nem eventos de modelos são descartados sem decodificar
+        self._markers = tuple(f'"{phone_number_id}"'.encode() for phone_number_id in self.phone_number_ids) + (b"message_template_",)
+
+    # Verifica (sem decodificar o JSON) se o payload pode conter eventos de interesse
+    def may_concern(self, raw):
+        return any(marker in raw for marker in self._markers)
+
+    # Converte payload em lista de eventos, numa única passagem por todas as entradas (entry) e alterações (changes)
+    def parse(self, data):
+        events = []
+        routes = self.routes
+        for entry in data.get("entry") or ():
+            for change in entry.get("changes") or ():
+                field = change.get("field")
+                value = change.get("value") or {}
+                metadata = value.get("metadata")
+                phone_number_id = metadata.get("phone_number_id") if metadata else None
+
+                route = routes.get((phone_number_id, field))
+                if route is None:
+                    if phone_number_id is not None and phone_number_id not in self.phone_number_ids:
+                        continue                        # Verifica destinatário
+                    route = _route_messages if field == "messages" else _route_unhandled
+                route(phone_number_id, field, value, events)
+        return events
+
+
+# Decodifica o corpo da requisição (orjson, quando disponível, é bem mais rápido que o json da biblioteca padrão)
+def loads(raw):
+    return _loads(raw)
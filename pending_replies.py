@@ -0,0 +1,83 @@
+# Fila de respostas pendentes (Firestore - coleção "pending_replies", um documento por contato)
+# Mensagens recebidas enquanto a IA está indisponível (circuito aberto) aguardam aqui e são respondidas quando o circuito fecha
+# (no estado semiaberto, a primeira resposta retomada é a chamada de teste do circuito).
+# A fila é verificada periodicamente por todas as instâncias; cada documento é retirado com pré-condição (update_time),
+# de modo que apenas uma instância responde ao contato
+import threading
+import time
+
+from circuit_breaker import CLOSED, OPEN
+from lazy_init import on_fork, on_start
+
+COLLECTION = "pending_replies"
+
+
+class PendingReplies:
+    def __init__(self, db, breaker, replay, interval=60, batch_size=50, on_error=None):
+        self.db = db
+        self.breaker = breaker                      # Circuito da dependência (respostas não são retomadas com o circuito aberto)
+        self.replay = replay                        # Função (tel, textos, phone_number_id) que responde ao contato
+        self.interval = interval
+        self.batch_size = batch_size
+        self.on_error = on_error                    # Callback (exception)
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        on_fork(self._after_fork)
+        on_start(self.start)                        # Verificação periódica iniciada com o processo (após o fork)
+
+    def start(self):
+        if self._stop.is_set():
+            return
+        self._thread = threading.Thread(target=self._run, name="pending-replies", daemon=True)
+        self._thread.start()
+
+    # Enfileira texto do contato. Retorna True caso seja a primeira pendência do contato (ex.: para enviar aviso uma única vez)
+    # phone_number_id: número que recebeu a mensagem (a resposta é enviada pelo mesmo número)
+    def add(self, tel, text, phone_number_id=""):
+        from google.cloud.firestore_v1 import ArrayUnion
+        doc_ref = self.db.collection(COLLECTION).document(f"{phone_number_id}_{tel}" if phone_number_id else tel)
+        first = not doc_ref.get().exists
+        doc_ref.set({"tel": tel, "phone_number_id": phone_number_id, "texts": ArrayUnion([text]), "timestamp": int(time.time())}, merge=True)
+        return first
+
+    # Antecipa a verificação da fila (ex.: circuito fechado)
+    def wake(self):
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stop.is_set():
+                return
+            try:
+                self.process()
+            except Exception as e:
+                if self.on_error:
+                    self.on_error(e)
+
+    # Retira e responde as pendências. Com o circuito semiaberto, somente uma leitura da fila (a chamada de teste decide o estado)
+    def process(self):
+        while self.breaker.state != OPEN:
+            docs = self.db.collection(COLLECTION).order_by("timestamp").limit(self.batch_size).get()
+            replayed = 0
+            for doc in docs:
+                if self.breaker.state == OPEN:
+                    return
+                try:
+                    doc.reference.delete(option=self.db.write_option(last_update_time=doc.update_time))
+                except Exception:
+                    continue                        # Retirada por outra instância (ou alterada após a leitura: próxima verificação)
+                pending = doc.to_dict()
+                self.replay(pending.get("tel") or doc.id, pending.get("texts", []), pending.get("phone_number_id", ""))
+                replayed += 1
+            if not replayed or self.breaker.state != CLOSED:
+                return
+
+    def close(self):
+        self._stop.set()
+        self._wake.set()
+
+    # Processo filho (fork): a thread de verificação não existe no filho (iniciada novamente com o processo)
+    def _after_fork(self):
+        self._wake = threading.Event()
@@ -0,0 +1,51 @@
+# Divisão da resposta da IA (recebida em stream) em mensagens enviadas ao usuário conforme ficam prontas
+# Os cortes são feitos em fim de parágrafo ou, para blocos longos, em fim de frase
+import re
+
+WHATSAPP_MAX_CHARS = 4096                   # Limite de caracteres de uma mensagem de texto da WhatsApp Cloud API
+SENTENCE_END = re.compile(r"[.!?…][)\"'*_~]*\s+|\n")
+
+
+# Recebe os trechos de texto do stream e gera segmentos completos (parágrafos/frases) prontos para envio
+# O primeiro segmento é liberado no primeiro fim de frase após first_min_chars (resposta visível o quanto antes);
+# os demais, em fim de parágrafo após min_chars
+def reply_segments(text_chunks, first_min_chars=80, min_chars=300, max_chars=1500):
+    max_chars = min(max_chars, WHATSAPP_MAX_CHARS)
+    buffer = ""
+    first = True
+    for chunk in text_chunks:
+        buffer += chunk
+        while True:
+            cut = _find_cut(buffer, first_min_chars if first else min_chars, max_chars, first)
+            if cut <= 0:
+                break
+            segment = buffer[:cut].strip()
+            buffer = buffer[cut:]
+            if segment:
+                yield segment
+                first = False
+    if buffer.strip():
+        yield buffer.strip()
+
+
+# Posição de corte do próximo segmento (-1 = aguardar mais texto)
+def _find_cut(buffer, minimum, max_chars, first):
+    # Fim de parágrafo após o mínimo
+    paragraph = buffer.rfind("\n\n", minimum, max_chars)
+    if paragraph != -1:
+        return paragraph + 2
+
+    # Primeiro segmento ou bloco acima do máximo: último fim de frase após o mínimo
+    if first or len(buffer) >= max_chars:
+        sentence = -1
+        for match in SENTENCE_END.finditer(buffer, 0, max_chars):
+            if match.end() >= minimum:
+                sentence = match.end()
+        if sentence != -1:
+            return sentence
+
+    # Bloco acima do máximo sem fim de frase: corta no último espaço (ou no limite)
+    if len(buffer) >= max_chars:
+        space = buffer.rfind(" ", minimum, max_chars)
+        return space + 1 if space != -1 else max_chars
+    return -1
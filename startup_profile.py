@@ -0,0 +1,79 @@
+# Relatório do tempo de inicialização (STARTUP_PROFILE=1)
+# Mede o custo de importação de cada módulo (tempo próprio, descontados os submódulos importados por ele), agrupado por pacote,
+# e o tempo de construção dos clientes lazy. Deve ser importado antes de qualquer outro módulo em main.py
+import importlib.abc
+import os
+import sys
+import time
+
+enabled = os.environ.get("STARTUP_PROFILE", "0") == "1"     # Lido do ambiente (o .env ainda não foi carregado neste ponto)
+started_at = time.perf_counter()
+import_times = {}                                   # Módulo => segundos (tempo próprio de execução do módulo)
+_stack = []                                         # Tempo acumulado dos submódulos em importação (para cálculo do tempo próprio)
+
+
+# Loader que mede o tempo de execução do módulo, delegando todo o restante ao loader original
+class _TimedLoader(importlib.abc.Loader):
+    def __init__(self, loader):
+        self._loader = loader
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        _stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            self._loader.exec_module(module)
+        finally:
+            elapsed = time.perf_counter() - start
+            children = _stack.pop()
+            import_times[module.__name__] = elapsed - children
+            if _stack:
+                _stack[-1] += elapsed
+
+    def __getattr__(self, attr):
+        return getattr(self._loader, attr)
+
+
+# Localizador posicionado no início de sys.meta_path: encontra o módulo pelos demais localizadores e envolve o loader
+class _TimedFinder(importlib.abc.MetaPathFinder):
+    def find_spec(self, name, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(name, path, target)
+            if spec is not None:
+                if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+                    spec.loader = _TimedLoader(spec.loader)
+                return spec
+        return None
+
+
+# Pacote usado no agrupamento (namespaces como google.* são agrupados no segundo nível)
+def _package(module_name):
+    parts = module_name.split(".")
+    if parts[0] == "google" and len(parts) > 1:
+        return ".".join(parts[:3] if parts[1] == "cloud" and len(parts) > 2 else parts[:2])
+    return parts[0]
+
+
+# Imprime o relatório: tempo total, custo de importação por pacote e tempo de construção dos clientes
+def report(build_times=None, top=20):
+    if not enabled:
+        return
+    total = time.perf_counter() - started_at
+    packages = {}
+    for module_name, seconds in import_times.items():
+        package = _package(module_name)
+        packages[package] = packages.get(package, 0.0) + seconds
+    lines = [f"Inicialização: {total * 1000:.0f} ms (importações: {sum(import_times.values()) * 1000:.0f} ms)"]
+    for package, seconds in sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]:
+        lines.append(f"  import {package:<40} {seconds * 1000:8.1f} ms")
+    for name, seconds in sorted((build_times or {}).items(), key=lambda item: item[1], reverse=True):
+        lines.append(f"  build  {name:<40} {seconds * 1000:8.1f} ms")
+    print("\n".join(lines))
+
+
+if enabled:
+    sys.meta_path.insert(0, _TimedFinder())
@@ -0,0 +1,154 @@
+# Processamento dos ACKs (status das mensagens enviadas: sent, delivered, read, failed)
+# Os status são acumulados em memória e gravados periodicamente em lote: status atual por mensagem + contadores
+# agregados por campanha e por dia. Os contadores são distribuídos em shards para evitar disputa no mesmo documento
+# O status mais avançado já registrado por mensagem é mantido entre gravações (cache LRU/TTL): um ACK atrasado de status inferior
+# (ex.: delivered após read) não sobrescreve o status gravado, e ACKs reenviados pela Meta (mesma mensagem e status) não são recontados
+import datetime
+import random
+import threading
+
+from lazy_init import on_fork, on_start
+from ttl_cache import TTLCache
+
+STATUS_COLLECTION = "message_status"
+COUNTER_COLLECTION = "status_counters"
+STATUS_RANK = {"sent": 1, "delivered": 2, "read": 3, "failed": 4}      # Status mais avançado prevalece na consolidação
+MAX_BATCH_WRITES = 500
+
+
+class StatusPipeline:
+    def __init__(self, db, flush_interval=5, shards=10, known_items=100_000, known_ttl=24 * 3600, max_backoff=300):
+        self.db = db
+        self.flush_interval = flush_interval
+        self.max_backoff = max_backoff              # Intervalo máximo (segundos) entre tentativas enquanto a gravação falha
+        self.shards = shards                        # Quantidade de shards por contador
+        self.known_items = known_items              # Mensagens cujo status já registrado é mantido em memória
+        self.known_ttl = known_ttl                  # Segundos mantendo o status registrado de cada mensagem
+        self._known = TTLCache(max_items=known_items, ttl=known_ttl)   # message_id => (maior rank registrado, status já contados)
+        self._messages = {}                         # message_id => dados consolidados do status
+        self._counters = {}                         # id do contador => {status: quantidade}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self.flushed = 0
+        on_fork(self._after_fork)
+        on_start(self.start)                        # Gravação periódica iniciada com o processo (após o fork)
+
+    def start(self):
+        if self._stop.is_set():
+            return
+        self._thread = threading.Thread(target=self._run, name="status-pipeline", daemon=True)
+        self._thread.start()
+
+    # Acumula ACKs (StatusEvent) em memória. Não acessa o banco
+    def add(self, events):
+        with self._lock:
+            for event in events:
+                rank = STATUS_RANK.get(event.status, 0)
+                best, counted = self._known.get(event.id) or (0, frozenset())
+                if event.status in counted:
+                    continue                        # ACK reenviado: status já registrado e contado
+                self._known.set(event.id, (max(best, rank), counted | {event.status}))
+                if rank >= best:
+                    record = {"status": event.status, "timestamp": event.timestamp, "recipient_id": event.recipient_id}
+                    if event.campaign_id:
+                        record["campaign_id"] = event.campaign_id
+                    if event.errors:
+                        record["errors"] = event.errors
+                    self._messages[event.id] = record
+
+                day = _day(event.timestamp)
+                self._count(f"day_{day}", event.status)
+                if event.campaign_id:
+                    self._count(f"campaign_{event.campaign_id}", event.status)
+
+    def _count(self, counter_id, status):
+        counter = self._counters.setdefault(counter_id, {})
+        counter[status] = counter.get(status, 0) + 1
+
+    # Gravação periódica. Em caso de falha, os dados não gravados voltam ao acumulado e o intervalo dobra até max_backoff
+    def _run(self):
+        interval = self.flush_interval
+        while not self._stop.wait(interval):
+            try:
+                self.flush()
+                interval = self.flush_interval
+            except Exception as e:
+                interval = min(interval * 2, max(self.max_backoff, self.flush_interval))
+                print(f"Erro ao gravar ACKs no Firebase/FireStore (nova tentativa em {interval}s). Detalhes: {e}")
+
+    # Grava os status e contadores acumulados (commits em lote)
+    # Falha em um lote: os lotes seguintes (e o que falhou) voltam ao acumulado para a próxima gravação; os lotes já confirmados não são regravados
+    def flush(self):
+        from google.cloud.firestore_v1 import Increment
+        with self._flush_lock:
+            with self._lock:
+                messages, self._messages = self._messages, {}
+                counters, self._counters = self._counters, {}
+            writes = []                             # (documento, dados, mensagem ou contador de origem)
+            for message_id, record in messages.items():
+                writes.append((self.db.collection(STATUS_COLLECTION).document(message_id), record, (message_id, None)))
+            for counter_id, counts in counters.items():
+                shard = self.db.collection(COUNTER_COLLECTION).document(counter_id).collection("shards").document(f"{random.randrange(self.shards)}")
+                writes.append((shard, {status: Increment(count) for status, count in counts.items()}, (None, counter_id)))
+            for start in range(0, len(writes), MAX_BATCH_WRITES):
+                try:
+                    batch = self.db.batch()
+                    for doc_ref, data, _ in writes[start:start + MAX_BATCH_WRITES]:
+                        batch.set(doc_ref, data, merge=True)
+                    batch.commit()
+                except Exception:
+                    self._restore(messages, counters, [source for _, _, source in writes[start:]])
+                    raise
+            self.flushed += len(messages)
+
+    # Devolve ao acumulado os dados não gravados: prevalece o status mais avançado (ou o mais recente, se empatado) e os contadores são somados
+    def _restore(self, messages, counters, sources):
+        with self._lock:
+            for message_id, counter_id in sources:
+                if message_id is not None:
+                    record = messages[message_id]
+                    current = self._messages.get(message_id)
+                    if current is None or STATUS_RANK.get(record["status"], 0) > STATUS_RANK.get(current["status"], 0):
+                        self._messages[message_id] = record
+                else:
+                    for status, count in counters[counter_id].items():
+                        counter = self._counters.setdefault(counter_id, {})
+                        counter[status] = counter.get(status, 0) + count
+
+    # Soma os shards de um contador (ex.: "campaign_<id>" ou "day_20240101")
+    def read_counter(self, counter_id):
+        totals = {}
+        for shard in self.db.collection(COUNTER_COLLECTION).document(counter_id).collection("shards").stream():
+            for status, count in (shard.to_dict() or {}).items():
+                totals[status] = totals.get(status, 0) + count
+        return totals
+
+    # Encerramento: grava o que estiver pendente
+    def close(self):
+        self._stop.set()
+        self.flush()
+
+    # Processo filho (fork): ACKs acumulados pertencem ao processo pai (gravados por ele); a thread de gravação é iniciada com o processo
+    def _after_fork(self):
+        self._messages = {}
+        self._counters = {}
+        self._known = TTLCache(max_items=self.known_items, ttl=self.known_ttl)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        if not self._stop.is_set():
+            self._stop = threading.Event()
+
+    def pending(self):
+        with self._lock:
+            return len(self._messages)
+
+
+# Dia (UTC) do ACK, no formato AAAAMMDD
+def _day(timestamp):
+    try:
+        moment = datetime.datetime.fromtimestamp(int(timestamp), datetime.timezone.utc)
+    except (TypeError, ValueError):
+        moment = datetime.datetime.now(datetime.timezone.utc)
+    return moment.strftime("%Y%m%d")
+
@@ -0,0 +1,217 @@
+# Telemetria do webhook: duração de cada etapa do processamento (spans) e contadores de Firestore, Gemini e Graph API,
+# além dos stats() dos componentes (filas, caches, buffers de gravação), expostos no formato Prometheus (rota /metrics). Opcionalmente, uma amostra das requisições gera log de trace
+# (JSON com as etapas executadas, início relativo e duração de cada uma)
+import functools
+import itertools
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+STAGE_SECONDS = Histogram("webhook_stage_seconds", "Duração de cada etapa do processamento", ["stage"], buckets=BUCKETS)
+STAGE_ERRORS = Counter("webhook_stage_errors_total", "Etapas finalizadas com exceção", ["stage"])
+FIRESTORE_RPCS = Counter("firestore_rpcs_total", "RPCs do Firestore por operação", ["operation"])
+FIRESTORE_WRITES = Counter("firestore_writes_total", "Documentos gravados no Firestore (inclusive em lote)")
+GEMINI_TOKENS = Counter("gemini_tokens_total", "Tokens consumidos no Gemini", ["model", "type"])
+GRAPH_REQUESTS = Counter("graph_api_requests_total", "Chamadas à Graph API por status HTTP", ["endpoint", "status"])
+GRAPH_SECONDS = Histogram("graph_api_request_seconds", "Duração das chamadas à Graph API", ["endpoint"], buckets=BUCKETS)
+CIRCUIT_STATE = Gauge("circuit_breaker_state", "Estado do circuito por dependência (0 = fechado, 1 = semiaberto, 2 = aberto)",
+                      ["dependency"], multiprocess_mode="max")
+
+CIRCUIT_STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+sample_rate = 0.0                                   # Parcela das requisições com log de trace (0 = desabilitado)
+_stats_sources = []                                 # (prefixo, labels, leitura, gauges, contadores) - ver register_stats
+_local = threading.local()
+_trace_ids = itertools.count(1)
+_instrumented = False
+
+
+def configure(trace_sample_rate=0.0):
+    global sample_rate
+    sample_rate = trace_sample_rate
+
+
+# Trace de uma requisição/mensagem: etapas executadas (inclusive em outras threads do FanOut)
+class Trace:
+    def __init__(self, name):
+        self.name = name
+        self.trace_id = f"{os.getpid()}-{next(_trace_ids)}"
+        self.started = time.perf_counter()
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, stage, start, elapsed, error):
+        with self._lock:
+            self.spans.append({"stage": stage, "start_ms": round((start - self.started) * 1000, 1),
+                               "ms": round(elapsed * 1000, 1), "error": error})
+
+    def log(self):
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span["start_ms"])
+        print(json.dumps({"trace": self.trace_id, "name": self.name,
+                          "ms": round((time.perf_counter() - self.started) * 1000, 1), "spans": spans}, ensure_ascii=False))
+
+
+def current_trace():
+    return getattr(_local, "trace", None)
+
+
+# Associa o trace à thread atual (propagação para etapas executadas em outras threads)
+@contextmanager
+def use_trace(trace):
+    previous = current_trace()
+    _local.trace = trace
+    try:
+        yield
+    finally:
+        _local.trace = previous
+
+
+# Inicia trace amostrado (sem efeito caso já exista trace ativo na thread ou a requisição não seja sorteada)
+@contextmanager
+def trace(name):
+    if current_trace() is not None or not sample_rate or random.random() >= sample_rate:
+        yield None
+        return
+    new_trace = Trace(name)
+    with use_trace(new_trace):
+        try:
+            yield new_trace
+        finally:
+            new_trace.log()
+
+
+# Mede a duração de uma etapa (histograma + trace ativo)
+@contextmanager
+def span(stage):
+    start = time.perf_counter()
+    error = False
+    try:
+        yield
+    except Exception:
+        error = True
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.labels(stage).observe(elapsed)
+        if error:
+            STAGE_ERRORS.labels(stage).inc()
+        active = current_trace()
+        if active is not None:
+            active.add(stage, start, elapsed, error)
+
+
+# Decorador: mede a duração da função como etapa
+def timed(stage):
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# Decorador: ponto de entrada (requisição/mensagem) - inicia trace amostrado e mede a duração total
+def traced(stage):
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with trace(stage), span(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# Tokens consumidos (usage_metadata da resposta do Gemini)
+def count_tokens(model, response):
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return
+    GEMINI_TOKENS.labels(model, "prompt").inc(getattr(usage, "prompt_token_count", 0) or 0)
+    GEMINI_TOKENS.labels(model, "candidates").inc(getattr(usage, "candidates_token_count", 0) or 0)
+    GEMINI_TOKENS.labels(model, "cached").inc(getattr(usage, "cached_content_token_count", 0) or 0)
+
+
+def count_graph_request(endpoint, status, elapsed):
+    GRAPH_REQUESTS.labels(endpoint, f"{status}").inc()
+    GRAPH_SECONDS.labels(endpoint).observe(elapsed)
+
+
+def set_breaker_state(dependency, state):
+    CIRCUIT_STATE.labels(dependency).set(CIRCUIT_STATES[state])
+
+
+# Registra métricas lidas dos stats() de um componente no momento da coleta (/metrics), sem instrumentar o componente
+# read: função sem argumentos que retorna [(valores dos labels, stats)]; gauges/counters: {chave do stats: (nome, descrição)}
+def register_stats(prefix, labels, read, gauges=None, counters=None):
+    _stats_sources.append((prefix, tuple(labels), read, gauges or {}, counters or {}))
+
+
+class _StatsCollector:
+    def collect(self):
+        for prefix, labels, read, gauges, counters in _stats_sources:
+            try:
+                rows = list(read())
+            except Exception:
+                continue                            # Componente indisponível (ex.: encerrando): métricas omitidas nesta coleta
+            for metrics, family_type in ((gauges, GaugeMetricFamily), (counters, CounterMetricFamily)):
+                for key, (name, documentation) in metrics.items():
+                    family = family_type(f"{prefix}_{name}", documentation, labels=labels)
+                    for label_values, stats in rows:
+                        if key in stats:
+                            family.add_metric(list(label_values), stats[key])
+                    yield family
+
+
+_stats_collector = _StatsCollector()
+REGISTRY.register(_stats_collector)
+
+
+def _counting(fn, operation, writes=None):
+    @functools.wraps(fn)
+    def wrapper(self, *args, **kwargs):
+        FIRESTORE_RPCS.labels(operation).inc()
+        if writes:
+            FIRESTORE_WRITES.inc(writes(self))
+        return fn(self, *args, **kwargs)
+    return wrapper
+
+
+# Contagem das RPCs do Firestore na fronteira do cliente (leituras de documento, consultas, get_all, commits e exclusões)
+# As gravações individuais (set/update/create) do cliente são executadas como commit de lote com uma escrita
+def instrument_firestore():
+    global _instrumented
+    if _instrumented:
+        return
+    from google.cloud.firestore_v1.batch import WriteBatch
+    from google.cloud.firestore_v1.client import Client
+    from google.cloud.firestore_v1.document import DocumentReference
+    from google.cloud.firestore_v1.query import Query
+
+    DocumentReference.get = _counting(DocumentReference.get, "get")
+    DocumentReference.delete = _counting(DocumentReference.delete, "delete", writes=lambda ref: 1)
+    Query.stream = _counting(Query.stream, "query")
+    Client.get_all = _counting(Client.get_all, "batch_get")
+    WriteBatch.commit = _counting(WriteBatch.commit, "commit", writes=lambda batch: len(batch._write_pbs))
+    _instrumented = True
+
+
+# Conteúdo da rota /metrics (com PROMETHEUS_MULTIPROC_DIR, agrega os processos do gunicorn;
+# as métricas de stats() dos componentes são as do processo que atende a coleta)
+def metrics_response():
+    registry = REGISTRY
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        registry.register(_stats_collector)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,240 @@
+# Números atendidos pelo webhook (multi-tenant), identificados pelo phone_number_id da WhatsApp Cloud API
+# Cada número tem token, instruções do sistema (modelo Gemini próprio), buckets e prefixo das coleções do Firestore.
+# Conexões (Graph API, Firestore, Cloud Storage, Gemini), pools de threads e caches são compartilhados entre os números;
+# os recursos de cada número (modelo, repositórios, despachante...) são construídos no primeiro uso.
+# O cadastro é lido de arquivo JSON (TENANTS_FILE) e recarregado quando o arquivo é alterado, sem reiniciar o serviço
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from lazy_init import on_fork, on_start
+
+SHARED_COLLECTIONS = frozenset(("campaigns", "alerts", "id_text", "id_medias"))    # Dados da conta (WABA) e IDs únicos da WhatsApp Cloud API: sem prefixo
+
+_local = threading.local()
+
+
+# Banco do número: coleções com o prefixo do número (exceto as compartilhadas); demais operações (batch, get_all...) inalteradas
+class TenantDatabase:
+    def __init__(self, db, prefix="", shared=SHARED_COLLECTIONS):
+        self._db = db
+        self.prefix = prefix
+        self.shared = shared
+
+    def collection(self, name):
+        if self.prefix and name not in self.shared:
+            name = f"{self.prefix}{name}"
+        return self._db.collection(name)
+
+    def __getattr__(self, attr):
+        return getattr(self._db, attr)
+
+
+class Tenant:
+    def __init__(self, phone_number_id, url_base, db, token, system_instruction=None, audio_bucket_name=None,
+                 image_bucket_name=None, collection_prefix="", name=None):
+        self.phone_number_id = phone_number_id
+        self.name = name or phone_number_id
+        self.token = token
+        self.system_instruction = system_instruction
+        self.audio_bucket_name = audio_bucket_name
+        self.image_bucket_name = image_bucket_name
+        self.collection_prefix = collection_prefix
+        self.config = (phone_number_id, url_base, token, system_instruction, audio_bucket_name, image_bucket_name, collection_prefix, self.name)
+
+        # URLs e headers pré-calculados (mesmos atributos do GraphApiClient: usados como remetente nas chamadas à Graph API)
+        self.messages_url = f"{url_base}/{phone_number_id}/messages"
+        self.auth_headers = {"Authorization": f"Bearer {token}"}
+        self.json_headers = {"Content-Type": "application/json", "Authorization": f"Bearer {token}"}
+        self.db = TenantDatabase(db, collection_prefix)
+
+        self._resources = {}                        # Nome => recurso construído para o número
+        self._closers = []                          # (função de encerramento, recurso)
+        self._lock = threading.RLock()                  # Reentrante: recursos construídos a partir de outros recursos do número
+
+    # Retorna o recurso do número, construindo-o no primeiro acesso (uma única vez, mesmo com várias threads)
+    def resource(self, name, factory, close=None):
+        value = self._resources.get(name)
+        if value is not None:
+            return value
+        with self._lock:
+            value = self._resources.get(name)
+            if value is None:
+                value = factory(self)
+                self._resources[name] = value
+                if close:
+                    self._closers.append((close, value))
+            return value
+
+    def built(self, name):
+        return self._resources.get(name)
+
+    # Encerra os recursos do número (removido ou alterado no cadastro)
+    def close(self):
+        with self._lock:
+            closers, self._closers = self._closers, []
+            self._resources = {}
+        for close, value in closers:
+            try:
+                close(value)
+            except Exception as e:
+                print(f"Falha ao encerrar recurso do número {self.name}. Detalhes: {e}")
+
+    # Processo filho (fork): recursos herdados são descartados sem encerramento (threads não existem no filho)
+    def reset(self):
+        self._lock = threading.RLock()
+        self._resources = {}
+        self._closers = []
+
+    def __repr__(self):
+        return f"<Tenant {self.name} ({self.phone_number_id})>"
+
+
+# Cadastro em arquivo JSON: lista de números (ou {"tenants": [...]}) com os campos phone_number_id, token, system_instructions,
+# audio_bucket_name, image_bucket_name, collection_prefix e name. Campos ausentes assumem os valores padrão (variáveis de ambiente).
+# Sem arquivo, o único número atendido é o padrão (ID_TEL)
+class TenantsFile:
+    FIELDS = {"token": "token", "system_instructions": "system_instruction", "audio_bucket_name": "audio_bucket_name",
+              "image_bucket_name": "image_bucket_name", "collection_prefix": "collection_prefix", "name": "name"}
+
+    def __init__(self, path, url_base, db, defaults):
+        self.path = path
+        self.url_base = url_base
+        self.db = db
+        self.defaults = defaults                    # Configuração do número padrão (phone_number_id e campos acima)
+        self._mtime = None
+
+    def load(self):
+        if not self.path:
+            return [self._tenant(self.defaults)]
+        self._mtime = os.path.getmtime(self.path)
+        with open(self.path, encoding="utf-8") as file:
+            data = json.load(file)
+        entries = data.get("tenants", []) if isinstance(data, dict) else data
+        return [self._tenant({**self.defaults, **entry}) for entry in entries]
+
+    # Arquivo alterado desde a última leitura
+    def changed(self):
+        return bool(self.path) and os.path.getmtime(self.path) != self._mtime
+
+    def _tenant(self, entry):
+        phone_number_id = f"{entry.get('phone_number_id') or ''}"
+        if not phone_number_id:
+            raise ValueError("Número sem phone_number_id no cadastro")
+        options = {attr: entry.get(field) for field, attr in self.FIELDS.items()}
+        options["collection_prefix"] = options["collection_prefix"] or ""
+        return Tenant(phone_number_id, self.url_base, self.db, **options)
+
+
+class TenantRegistry:
+    def __init__(self, source, reload_interval=0, on_reload=None, on_error=None):
+        self.source = source                        # TenantsFile (load/changed)
+        self.reload_interval = reload_interval      # Segundos entre verificações de alteração do cadastro (0 = sem recarga automática)
+        self.on_reload = on_reload                  # Callback (registry) após recarga com alterações
+        self.on_error = on_error                    # Callback (exception) em falhas de recarga (o cadastro anterior é mantido)
+        self._tenants = {}
+        self.default = None                         # Primeiro número do cadastro (usado fora do contexto de um número)
+        self._lock = threading.Lock()
+        self._apply(source.load())
+        on_fork(self._after_fork)
+        on_start(self.start)
+
+    # Verificação periódica de alterações do cadastro (iniciada com o processo, após o fork)
+    def start(self):
+        if self.reload_interval:
+            threading.Thread(target=self._watch, name="tenants-reload", daemon=True).start()
+
+    def get(self, phone_number_id):
+        return self._tenants.get(phone_number_id)
+
+    def ids(self):
+        return list(self._tenants)
+
+    def __iter__(self):
+        return iter(list(self._tenants.values()))
+
+    # Lê novamente o cadastro. Números inalterados mantêm seus recursos; removidos/alterados são encerrados
+    def reload(self):
+        with self._lock:
+            previous = self._tenants
+            changed = self._apply(self.source.load())
+        for phone_number_id, tenant in previous.items():
+            if self._tenants.get(phone_number_id) is not tenant:
+                tenant.close()
+        if changed and self.on_reload:
+            self.on_reload(self)
+        return changed
+
+    def _apply(self, loaded):
+        if not loaded:
+            raise ValueError("Cadastro de números vazio")
+        tenants = {}
+        for tenant in loaded:
+            current = self._tenants.get(tenant.phone_number_id)
+            tenants[tenant.phone_number_id] = current if current is not None and current.config == tenant.config else tenant
+        changed = list(tenants.items()) != list(self._tenants.items())
+        self._tenants = tenants                     # Troca atômica: leitores enxergam o cadastro anterior ou o novo
+        self.default = next(iter(tenants.values()))
+        return changed
+
+    def _watch(self):
+        while True:
+            time.sleep(self.reload_interval)
+            try:
+                if self.source.changed():
+                    self.reload()
+            except Exception as e:
+                if self.on_error:
+                    self.on_error(e)
+
+    # Processo filho (fork): recursos dos números (clientes, despachantes e suas threads) são construídos novamente no primeiro uso
+    def _after_fork(self):
+        self._lock = threading.Lock()
+        for tenant in self:
+            tenant.reset()
+
+    # Recurso construído por número (ex.: modelo com as instruções do sistema do número)
+    def resource(self, name, factory, close=None):
+        return TenantLocal(self, name, factory, close)
+
+
+# Acesso ao recurso do número em atendimento (contexto da thread) ou do número padrão, construído no primeiro uso
+class TenantLocal:
+    def __init__(self, registry, name, factory, close=None):
+        self._registry = registry
+        self._name = name
+        self._factory = factory                     # Função (tenant) que constrói o recurso
+        self._close = close                         # Função (recurso) chamada quando o número é removido/alterado
+
+    # Recurso do número informado (None = número em atendimento). Nome distinto de get: os atributos do recurso (ex.: contacts.get) são repassados
+    def for_tenant(self, tenant=None):
+        tenant = tenant or current_tenant() or self._registry.default
+        return tenant.resource(self._name, self._factory, self._close)
+
+    # Recursos já construídos (todos os números)
+    def instances(self):
+        return [value for value in (tenant.built(self._name) for tenant in self._registry) if value is not None]
+
+    def __getattr__(self, attr):
+        return getattr(self.for_tenant(), attr)
+
+    def __repr__(self):
+        return f"<TenantLocal {self._name}>"
+
+
+def current_tenant():
+    return getattr(_local, "tenant", None)
+
+
+# Associa o número em atendimento à thread atual (propagado para etapas executadas em outras threads)
+@contextmanager
+def use_tenant(tenant):
+    previous = current_tenant()
+    _local.tenant = tenant
+    try:
+        yield
+    finally:
+        _local.tenant = previous
+
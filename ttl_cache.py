@@ -0,0 +1,128 @@
+# Cache em memória LRU com expiração (TTL), limitado por quantidade de itens e/ou peso total (ex.: bytes)
+# Thread-safe. Mantém métricas de acertos, falhas e remoções
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    def __init__(self, max_items=1000, ttl=600, max_weight=None, weigh=None):
+        self.max_items = max_items
+        self.ttl = ttl                              # Segundos até a expiração do item (None = sem expiração)
+        self.max_weight = max_weight                # Peso total máximo (None = sem limite)
+        self.weigh = weigh                          # Função valor => peso (ex.: len para bytes)
+        self._data = OrderedDict()                  # chave => (valor, expira_em, peso)
+        self._weight = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    # Retorna o valor em cache (ou default), renovando sua posição LRU
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            value, expires_at, _ = item
+            if expires_at is not None and expires_at <= time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def __contains__(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            return item is not None and (item[1] is None or item[1] > time.monotonic())
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._set(key, value, ttl)
+
+    # Define o valor somente se a chave ainda não estiver em cache (operação atômica). Retorna True caso tenha definido
+    def add(self, key, value, ttl=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and (item[1] is None or item[1] > time.monotonic()):
+                return False
+            self._set(key, value, ttl)
+            return True
+
+    def _set(self, key, value, ttl):
+        ttl = self.ttl if ttl is None else ttl
+        weight = self.weigh(value) if self.weigh else 0
+        if key in self._data:
+            self._remove(key)
+        if self.max_weight is not None and weight > self.max_weight:
+            return                                  # Item maior que o próprio cache: não armazena
+        expires_at = time.monotonic() + ttl if ttl else None
+        self._data[key] = (value, expires_at, weight)
+        self._weight += weight
+        while len(self._data) > self.max_items or (self.max_weight is not None and self._weight > self.max_weight):
+            oldest = next(iter(self._data))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            self._remove(key)
+            return item[0]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._weight = 0
+
+    def _remove(self, key):
+        _, _, weight = self._data.pop(key)
+        self._weight -= weight
+
+    def __len__(self):
+        return len(self._data)
+
+    # Métricas do cache
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "weight": self._weight,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+# Visão de um cache compartilhado restrita a um escopo (ex.: número atendido): chaves (escopo, chave), mesmo limite de memória
+class ScopedCache:
+    def __init__(self, cache, scope):
+        self.cache = cache
+        self.scope = scope
+
+    def get(self, key, default=None):
+        return self.cache.get((self.scope, key), default)
+
+    def __contains__(self, key):
+        return (self.scope, key) in self.cache
+
+    def set(self, key, value, ttl=None):
+        self.cache.set((self.scope, key), value, ttl)
+
+    def add(self, key, value, ttl=None):
+        return self.cache.add((self.scope, key), value, ttl)
+
+    def pop(self, key, default=None):
+        return self.cache.pop((self.scope, key), default)
+
+    # Métricas do cache compartilhado
+    def stats(self):
+        return self.cache.stats()
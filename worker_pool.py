@@ -0,0 +1,123 @@
+# Pool de workers para processamento em segundo plano das notificações da WhatsApp Cloud API
+# O webhook apenas valida e enfileira a notificação, devolvendo 200 imediatamente; os workers fazem o processamento pesado
+import atexit
+import queue
+import threading
+import time
+
+from lazy_init import on_fork
+
+
+class WorkerPool:
+    def __init__(self, name, size, max_queue, on_error=None):
+        self.name = name
+        self.size = max(1, int(size))
+        self.on_error = on_error                            # Callback chamado com (exception) quando uma tarefa falha
+        self._queue = queue.Queue(maxsize=max(1, int(max_queue)))
+        self._threads = []
+        self._lock = threading.Lock()
+        self._accepting = False
+        self._in_flight = 0
+        self._processed = 0
+        self._rejected = 0
+        self._failed = 0
+        on_fork(self._after_fork)
+
+    # Inicia as threads de processamento (daemon, para não travar o encerramento do interpretador)
+    def start(self):
+        with self._lock:
+            if self._accepting:
+                return
+            self._accepting = True
+            for i in range(self.size):
+                thread = threading.Thread(target=self._run, name=f"{self.name}-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    # Enfileira tarefa. Retorna False caso a fila esteja cheia ou o pool esteja encerrando (backpressure)
+    def submit(self, fn, *args, **kwargs):
+        if not self._accepting:
+            return False
+        try:
+            self._queue.put_nowait((fn, args, kwargs, time.monotonic()))
+            return True
+        except queue.Full:
+            with self._lock:
+                self._rejected += 1
+            return False
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:                                # Sentinela de encerramento
+                self._queue.task_done()
+                return
+            fn, args, kwargs, _ = item
+            with self._lock:
+                self._in_flight += 1
+            try:
+                fn(*args, **kwargs)
+                with self._lock:
+                    self._processed += 1
+            except Exception as e:
+                with self._lock:
+                    self._failed += 1
+                if self.on_error:
+                    try:
+                        self.on_error(e)
+                    except Exception:
+                        pass
+            finally:
+                with self._lock:
+                    self._in_flight -= 1
+                self._queue.task_done()
+
+    # Encerramento gracioso: para de aceitar novas tarefas, processa o que já está na fila e finaliza as threads
+    def shutdown(self, timeout=30):
+        with self._lock:
+            if not self._accepting:
+                return
+            self._accepting = False
+        deadline = time.monotonic() + timeout
+        for _ in self._threads:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                try:
+                    self._queue.put(None, timeout=min(remaining, 1))
+                    break
+                except queue.Full:
+                    continue
+        for thread in self._threads:
+            thread.join(max(0, deadline - time.monotonic()))
+
+    # Registra o encerramento gracioso no fim do processo. Os executores do concurrent.futures (filas por contato, etapas paralelas)
+    # são encerrados por threading._register_atexit, antes dos callbacks do atexit: o pool precisa ser esvaziado antes deles
+    def drain_on_exit(self, timeout=30):
+        register = getattr(threading, "_register_atexit", None)
+        if register:
+            register(self.shutdown, timeout)        # Executado antes dos registrados anteriormente (concurrent.futures)
+        else:
+            atexit.register(self.shutdown, timeout)
+
+    # Estatísticas do pool (profundidade da fila, tarefas em andamento, processadas, rejeitadas e com falha)
+    def stats(self):
+        with self._lock:
+            return {
+                "size": self.size,
+                "queue_depth": self._queue.qsize(),
+                "queue_limit": self._queue.maxsize,
+                "in_flight": self._in_flight,
+                "processed": self._processed,
+                "rejected": self._rejected,
+                "failed": self._failed,
+            }
+
+    # Processo filho (fork): as threads e a fila (tarefas do processo pai) não são herdadas; o pool é iniciado com o processo
+    def _after_fork(self):
+        self._queue = queue.Queue(maxsize=self._queue.maxsize)
+        self._threads = []
+        self._lock = threading.Lock()
+        self._accepting = False
+        self._in_flight = 0